@@ -1,29 +1,45 @@
-import os
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from config import FINAL_SAVE_DIR, MANUAL_ANNOTATIONS_PATH
+from config import FINAL_SAVE_DIR, MANUAL_ANNOTATIONS_PATH, OLLAMA_MODEL, ORCHESTRATOR_MODELS
+from orchestrator import model_results_dir
+from evaluation import (
+    encode_roles, decode_roles, majority_vote, evaluate, fleiss_kappa, pairwise_cohen_kappa, load_predictions
+)
 
 annotated_data = pd.read_csv(MANUAL_ANNOTATIONS_PATH)
 
 models_file_names =['approach1', 'approach2', 'approach3', 'approach2_hashed', 'approach3_hashed']
 
-for file_name in models_file_names:
-    file_path = os.path.join(FINAL_SAVE_DIR, f"test_{file_name}.csv")
-    role_mapping = pd.read_csv(file_path).set_index('Sr No.')['Role'].to_dict()
-    annotated_data[f'{file_name} Role'] = annotated_data['Sr No.'].map(role_mapping)
+predictions = load_predictions(models_file_names, annotated_data['Sr No.'], results_dir=FINAL_SAVE_DIR,
+                               speakers=annotated_data['Speaker'])
+# Runs of the other models (orchestrator.py) are scored as "<file name> (<model>)".
+for model in ORCHESTRATOR_MODELS:
+    if model != OLLAMA_MODEL:
+        model_predictions = load_predictions(models_file_names, annotated_data['Sr No.'],
+                                             results_dir=model_results_dir(model), speakers=annotated_data['Speaker'])
+        predictions.update({f"{file_name} ({model})": roles for file_name, roles in model_predictions.items()})
+for file_name, roles in predictions.items():
+    annotated_data[f'{file_name} Role'] = roles
 
 role_columns = ['Amit Role', 'Noa Role', 'Guy Role', 'Omer Role']
 
-def resolve_majority_vote(row):
-    counts = row[role_columns].dropna().value_counts()
-    if len(counts) == 0:
-        return np.nan
-    max_count = counts.max()
-    candidates = counts[counts == max_count].index.tolist()
-    if len(candidates) == 1:
-        return candidates[0]
-    return np.random.choice(candidates)
-
-annotated_data['Majority Role'] = annotated_data.apply(resolve_majority_vote, axis=1)
-annotated_data.head()
\ No newline at end of file
+# Roles as integer codes (-1 for missing); ties in the vote are broken with a fixed seed.
+annotator_codes = encode_roles(annotated_data[role_columns])
+majority_codes = majority_vote(annotator_codes)
+annotated_data['Majority Role'] = decode_roles(majority_codes)
+
+print(f"Fleiss' kappa between annotators: {fleiss_kappa(annotator_codes):.3f}")
+print("Cohen's kappa between annotator pairs:")
+print(pairwise_cohen_kappa(annotator_codes, role_columns).round(3))
+
+metrics, per_class_f1, confusion = evaluate(
+    majority_codes, {file_name: encode_roles(roles) for file_name, roles in predictions.items()}
+)
+print("Agreement with the majority vote (95% bootstrap intervals):")
+print(metrics.round(3))
+print("Per-role F1:")
+print(per_class_f1.round(3))
+for file_name, matrix in confusion.items():
+    print(f"Confusion matrix for {file_name} (rows: majority role, columns: predicted role):")
+    print(matrix)
+
+annotated_data.head()
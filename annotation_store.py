@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import argparse
+import pandas as pd
+from config import ANNOTATION_DB_PATH, ANNOTATORS, MANUAL_ANNOTATIONS_PATH, TEST_PATH, VALID_ROLES
+
+
+class AnnotationStore:
+    """
+    SQLite store behind the manual annotation notebook, in place of rewriting the whole
+    annotated CSV on every save. The split's utterances are imported once into an
+    `utterances` table (indexed on Sr No. and Dialogue_ID), and each label is one row of
+    `labels`, keyed on (annotator, Sr No.): saving a dialogue upserts just its labels in one
+    transaction, and the next unannotated utterance of an annotator is found by walking the
+    Sr No. index. The database runs in WAL mode, so a save appends to the log rather than
+    rewriting the file. export_csv writes the wide annotated CSV analysis.py reads.
+    """
+    def __init__(self, path=ANNOTATION_DB_PATH, annotators=ANNOTATORS):
+        self.path = path
+        self.annotators = list(annotators)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS labels ("
+            "annotator TEXT NOT NULL, sr_no INTEGER NOT NULL, role TEXT NOT NULL, "
+            "PRIMARY KEY (annotator, sr_no)) WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        if not self.has_utterances:
+            return 0
+        return self.connection.execute("SELECT COUNT(*) FROM utterances").fetchone()[0]
+
+    @property
+    def has_utterances(self):
+        return self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'utterances'"
+        ).fetchone() is not None
+
+    def _check_annotator(self, annotator):
+        if annotator not in self.annotators:
+            raise ValueError(f"Unknown annotator {annotator!r}; expected one of {self.annotators}.")
+
+    def import_csv(self, path):
+        """
+        Adds a split's utterances to the store (only the first time; later imports keep them)
+        and upserts every label its "<annotator> Role" columns hold, so both test_sent_emo.csv
+        and an annotated CSV can be imported. Returns the number of labels imported.
+        """
+        data = pd.read_csv(path)
+        role_columns = {f"{annotator} Role": annotator for annotator in self.annotators}
+        with self.connection:
+            if not self.has_utterances:
+                data.drop(columns=[column for column in data.columns if column in role_columns]).to_sql(
+                    "utterances", self.connection, index=False
+                )
+                self.connection.execute('CREATE UNIQUE INDEX utterances_sr_no ON utterances ("Sr No.")')
+                self.connection.execute('CREATE INDEX utterances_dialogue ON utterances ("Dialogue_ID", "Sr No.")')
+            labels = [
+                (annotator, int(sr_no), role)
+                for column, annotator in role_columns.items() if column in data.columns
+                for sr_no, role in zip(data["Sr No."], data[column]) if pd.notnull(role)
+            ]
+            self._upsert(labels)
+        return len(labels)
+
+    def _upsert(self, labels):
+        invalid = {role for _, _, role in labels} - VALID_ROLES
+        if invalid:
+            raise ValueError(f"Unknown roles {sorted(invalid)}; expected one of {sorted(VALID_ROLES)}.")
+        self.connection.executemany(
+            "INSERT INTO labels (annotator, sr_no, role) VALUES (?, ?, ?) "
+            "ON CONFLICT (annotator, sr_no) DO UPDATE SET role = excluded.role",
+            labels,
+        )
+
+    def set_roles(self, annotator, roles):
+        """
+        Saves an annotator's labels ({sr_no: role}) in one transaction; a None role clears the
+        utterance's label, so it counts as unannotated again.
+        """
+        self._check_annotator(annotator)
+        with self.connection:
+            self._upsert([(annotator, int(sr_no), role) for sr_no, role in roles.items() if role is not None])
+            self.connection.executemany(
+                "DELETE FROM labels WHERE annotator = ? AND sr_no = ?",
+                [(annotator, int(sr_no)) for sr_no, role in roles.items() if role is None],
+            )
+
+    def set_role(self, annotator, sr_no, role):
+        self.set_roles(annotator, {sr_no: role})
+
+    def dialogue(self, dialogue_id, annotator):
+        """The utterances of one dialogue in Sr No. order, with the annotator's labels in a "Role" column."""
+        self._check_annotator(annotator)
+        return pd.read_sql(
+            'SELECT u.*, l.role AS "Role" FROM utterances u '
+            'LEFT JOIN labels l ON l.annotator = ? AND l.sr_no = u."Sr No." '
+            'WHERE u."Dialogue_ID" = ? ORDER BY u."Sr No."',
+            self.connection, params=(annotator, int(dialogue_id)),
+        )
+
+    def next_unannotated(self, annotator, after=None):
+        """
+        Returns the Dialogue_ID of the annotator's first unannotated utterance (after Sr No.
+        `after`, when given), or None when every utterance is labelled.
+        """
+        self._check_annotator(annotator)
+        row = self.connection.execute(
+            'SELECT u."Dialogue_ID" FROM utterances u WHERE u."Sr No." > ? AND NOT EXISTS '
+            '(SELECT 1 FROM labels l WHERE l.annotator = ? AND l.sr_no = u."Sr No.") '
+            'ORDER BY u."Sr No." LIMIT 1',
+            (after if after is not None else -1, annotator),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def progress(self):
+        """{annotator: number of labelled utterances}."""
+        counts = dict(self.connection.execute("SELECT annotator, COUNT(*) FROM labels GROUP BY annotator"))
+        return {annotator: counts.get(annotator, 0) for annotator in self.annotators}
+
+    def to_frame(self):
+        """The annotated split: the utterance columns followed by one "<annotator> Role" column per annotator."""
+        joins = " ".join(
+            f'LEFT JOIN labels l{i} ON l{i}.annotator = ? AND l{i}.sr_no = u."Sr No."'
+            for i in range(len(self.annotators))
+        )
+        roles = ", ".join(f'l{i}.role AS "{annotator} Role"' for i, annotator in enumerate(self.annotators))
+        return pd.read_sql(
+            f'SELECT u.*, {roles} FROM utterances u {joins} ORDER BY u."Sr No."',
+            self.connection, params=self.annotators,
+        )
+
+    def export_csv(self, path=MANUAL_ANNOTATIONS_PATH):
+        """Writes to_frame() to path (by default the annotated CSV analysis.py reads) and returns it."""
+        annotated = self.to_frame()
+        temp_path = path + ".tmp"
+        annotated.to_csv(temp_path, index=False)
+        os.replace(temp_path, path)
+        return annotated
+
+
+def open_store(path=ANNOTATION_DB_PATH, source_path=TEST_PATH, annotated_path=MANUAL_ANNOTATIONS_PATH):
+    """
+    Opens the annotation store, importing the split on first use: the annotated CSV when it
+    exists (so its labels carry over), test_sent_emo.csv otherwise.
+    """
+    store = AnnotationStore(path)
+    if not store.has_utterances:
+        store.import_csv(annotated_path if os.path.exists(annotated_path) else source_path)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import annotations into the annotation store or export them to CSV.")
+    parser.add_argument("--import", dest="import_paths", nargs="+", default=[],
+                        help="CSV files whose utterances and <annotator> Role columns to import")
+    parser.add_argument("--export", nargs="?", const=MANUAL_ANNOTATIONS_PATH, default=None,
+                        help=f"write the annotated CSV (default {MANUAL_ANNOTATIONS_PATH})")
+    args = parser.parse_args()
+
+    with open_store() as store:
+        for path in args.import_paths:
+            print(f"Imported {store.import_csv(path)} labels from {path}")
+        for annotator, labelled in store.progress().items():
+            print(f"{annotator}: {labelled}/{len(store)} utterances labelled")
+        if args.export:
+            store.export_csv(args.export)
+            print(f"Annotations exported to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
 import os
 import re
-import tqdm
-import pandas as pd
-from ollama_setup import run_llm
+from ollama_setup import get_client
+from retry_policy import PermanentLLMError
+from dialogue_runner import process_dialogues, default_max_in_flight
+from scheduler import DialogueScheduler, estimate_prompt_tokens
+from telemetry import RunTelemetry
+from dialogue_store import load_dialogues, DIALOGUE_COLUMNS
+from checkpoint import config_fingerprint
+from config import TRAIN_PATH, TEST_PATH, FINAL_SAVE_DIR, LLM_WARM_PREFIX, LLM_OUTPUT_TOKENS_PER_UTTERANCE
 
 
 class SpeakerRoleBaseline:
-    def __init__(self):
+    def __init__(self, client=None):
         # Option to hash speaker names (set to True if needed)
         self.is_hash_speakers = False
         self.max_retries = 3
+        # Shared LLM client (the process-wide one unless another is given)
+        self.client = client or get_client()
+        # Per-call trace, written while process_data runs
+        self.telemetry = RunTelemetry(type(self).__name__)
 
-        # The static roles description remains unchanged.
+        # The static roles description and prompt template remain unchanged.
         self.roles_description = """
 You are an expert in analyzing conversations and assigning speaker roles.
 
@@ -33,6 +42,16 @@ Format the output as a JSON file as follows:
 "role": "chosen_role"
 "justification": "detailed reason for choosing this role, referencing the utterances and character context"
         """
+        self.template = (
+            "You are an assistant specialized in analyzing dialogue and identifying speaker roles. "
+            "Answer the following question in a valid JSON format.\n\n"
+            "Question: {question}\n\n"
+            "Answer: Think step by step and provide a JSON object following the specified format."
+        )
+
+    def warm_up(self, workers):
+        """Has the server evaluate the static prompt prefix (template and roles description) once per worker."""
+        self.client.warm_prefix(self.roles_description, self.template, copies=workers)
 
     def generate_prompt(self, conversation, sr_no_list, dialogue_id, speakers_list):
         """
@@ -62,33 +81,45 @@ Format the output as a JSON file as follows:
         )
         return prompt
 
+    def estimate_cost(self, payload):
+        """
+        Estimated (prompt_tokens, output_tokens) of a dialogue's request; the answer is a single
+        speaker object, whatever the dialogue's length. Used by scheduler.DialogueScheduler.
+        """
+        static_chars = len(self.template) + len(self.roles_description) + 400
+        return estimate_prompt_tokens(payload[0], static_chars), 2 * LLM_OUTPUT_TOKENS_PER_UTTERANCE
+
     def assign_roles(self, conversation, sr_no_list, speakers_list, dialogue_id):
         """
         Builds the prompt using the new template, calls the LLM with retry logic, and returns parsed results.
         """
         prompt = self.generate_prompt(conversation, sr_no_list, dialogue_id, speakers_list)
-        template = (
-            "You are an assistant specialized in analyzing dialogue and identifying speaker roles. "
-            "Answer the following question in a valid JSON format.\n\n"
-            "Question: {question}\n\n"
-            "Answer: Think step by step and provide a JSON object following the specified format."
-        )
         attempts = 0
         response = None
         while attempts < self.max_retries:
             try:
-                response = run_llm(prompt, template)
+                response = self.client.invoke(prompt, self.template)
                 parsed_results = self.parse_response(response, sr_no_list, speakers_list, prompt, dialogue_id)
+                valid = all(result["Role"] != "Error" for result in parsed_results)
+                self.telemetry.record_call(dialogue_id, attempts + 1, prompt, getattr(self.client, "last_call", None),
+                                           "ok" if valid else "invalid", rows_accepted=len(parsed_results) if valid else 0)
                 # If all roles are successfully assigned (i.e. no "Error" returned), annotate and return.
-                if all(result["Role"] != "Error" for result in parsed_results):
+                if valid:
                     for result in parsed_results:
                         result["Dialogue_ID"] = dialogue_id
                         result["Prompt"] = prompt
                         result["Response"] = response
                     return parsed_results
+                # Do not let the retry replay the rejected response from the cache.
+                self.client.discard(prompt, self.template)
+            except PermanentLLMError as e:
+                self.telemetry.record_call(dialogue_id, attempts + 1, prompt, getattr(self.client, "last_call", None),
+                                           "error", error=e)
+                raise RuntimeError(f"Critical Error: {str(e)}") from e
             except Exception as e:
-                if "Connection refused" in str(e):
-                    raise RuntimeError(f"Critical Error: {str(e)}") from e
+                # Transient errors were already retried with backoff by the client's retry policy.
+                self.telemetry.record_call(dialogue_id, attempts + 1, prompt, getattr(self.client, "last_call", None),
+                                           "error", error=e)
             attempts += 1
 
         print(f"Failed to assign roles for Dialogue_ID {dialogue_id} after {self.max_retries} attempts.", flush=True)
@@ -140,52 +171,37 @@ Format the output as a JSON file as follows:
         return hashed, None
 
 
-# Example usage of the modified SpeakerRoleBaseline class within a process_data function:
-def process_data(mode, model_instance: SpeakerRoleBaseline, output_file_suffix):
+def process_data(mode, model_instance: SpeakerRoleBaseline, output_file_suffix, max_in_flight=None,
+                 output_dir=FINAL_SAVE_DIR, dry_run=False):
     """
     Processes input CSV data for SpeakerRoleBaseline.
-    Groups the dialogues by Dialogue_ID, calls the model to assign roles,
-    and appends (or writes) the results to a CSV file.
+    Takes the dialogues from the split's DialogueStore, calls the model to assign roles with up to
+    max_in_flight dialogues in flight at once (by default MAX_CONCURRENT_DIALOGUES per Ollama
+    server), and appends (or writes) the results to a CSV file in output_dir. Dialogues are
+    dispatched longest first (SCHEDULER_PRIORITY); with dry_run, only the run's estimated tokens
+    and wall-clock time are printed and returned.
     """
-    # Define your file paths (update these constants as needed)
-    TRAIN_PATH = "path_to_train.csv"
-    TEST_PATH = "path_to_test.csv"
-    FINAL_SAVE_DIR = "final_save_directory"
-
     input_path = TRAIN_PATH if mode == 'train' else TEST_PATH
-    input_df = pd.read_csv(input_path)
-    # Keep only the required columns.
-    input_df = input_df[['Sr No.', 'Dialogue_ID', 'Speaker', 'Utterance']]
-    grouped_conversations = input_df.groupby('Dialogue_ID')
+    store = load_dialogues(input_path)
 
     output_file = os.path.join(
-        FINAL_SAVE_DIR,
+        output_dir,
         f"{mode}_{output_file_suffix}{'_hashed' if model_instance.is_hash_speakers else ''}.csv"
     )
 
-    # Create the output file with header if it does not exist.
-    if not os.path.exists(output_file):
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write("Sr No.,Speaker,Dialogue_ID,Role,Justification,Prompt,Response\n")
-
-    existing_df = pd.read_csv(output_file) if os.path.exists(output_file) else pd.DataFrame()
-
-    for dialogue_id, group in tqdm.tqdm(grouped_conversations, desc="Processing dialogues"):
-        # Skip dialogues already processed successfully.
-        if dialogue_id in existing_df.get("Dialogue_ID", []):
-            dialogue_entries = existing_df[existing_df["Dialogue_ID"] == dialogue_id]
-            if "Error" not in dialogue_entries["Role"].values:
-                continue
-            existing_df = existing_df[existing_df["Dialogue_ID"] != dialogue_id]
-
-        conversation_data = list(zip(group['Speaker'], group['Utterance']))
-        sr_no_list = group['Sr No.'].tolist()
-        speakers_list = group['Speaker'].tolist()
-
-        roles = model_instance.assign_roles(conversation_data, sr_no_list, speakers_list, dialogue_id)
-        res_df = pd.DataFrame(roles)
-        existing_df = pd.concat([existing_df, res_df]).sort_values(by="Sr No.").reset_index(drop=True)
-        existing_df.to_csv(output_file, index=False, encoding='utf-8')
-
-    print(f"Results saved to {output_file}")
-    return existing_df
+    # Dialogues are fingerprinted so that changed inputs or prompt config get re-run on resume.
+    config_hash = config_fingerprint(model_instance)
+
+    jobs = []
+    for dialogue in store:
+        fingerprint = dialogue.fingerprint(config_hash, DIALOGUE_COLUMNS)
+        jobs.append((dialogue.dialogue_id, fingerprint, (
+            dialogue.conversation, dialogue.sr_no_list, dialogue.speakers_list, dialogue.dialogue_id
+        )))
+
+    return process_dialogues(
+        jobs, lambda job: model_instance.assign_roles(*job), output_file,
+        max_in_flight or default_max_in_flight(model_instance.client), desc="Processing dialogues",
+        telemetry=model_instance.telemetry,
+        warm_up=model_instance.warm_up if LLM_WARM_PREFIX else None,
+        scheduler=DialogueScheduler(model_instance.estimate_cost), dry_run=dry_run)
@@ -1,32 +1,46 @@
 import os
-import re
-import tqdm
-import pandas as pd
-from ollama_setup import run_llm
 from base_role_approach import BaseRoleApproach
-from config import TRAIN_PATH, TEST_PATH, FINAL_SAVE_DIR
+from response_parser import BATCH_RESPONSE_SCHEMA
+from retry_policy import PermanentLLMError
+from dialogue_runner import process_dialogues, default_max_in_flight, DialogueBatcher
+from scheduler import DialogueScheduler
+from dialogue_store import load_dialogues, DIALOGUE_COLUMNS
+from checkpoint import config_fingerprint
+from config import (
+    TRAIN_PATH, TEST_PATH, FINAL_SAVE_DIR, LLM_WARM_PREFIX, BATCH_DIALOGUES,
+    BATCH_TOKEN_BUDGET, BATCH_MAX_DIALOGUES
+)
 
 class Approach2(BaseRoleApproach):
     """
     Inherits the common functionality from BaseRoleApproach.
     """
-    def generate_prompt(self, conversation, sr_no_list, dialogue_id, speakers_list):
+    def _conversation_lines(self, conversation, sr_no_list, speakers_list, hashed_speakers=None):
+        """
+        Returns the prompt line of every utterance and the speaker names they use.
+        If self.is_hash_speakers is True, speaker names are replaced with hashed identifiers
+        (hashed_speakers when precomputed, e.g. by DialogueStore).
+        """
+        if self.is_hash_speakers:
+            speakers_list = hashed_speakers or self._hash_speakers(speakers_list)[0]
+        lines = [
+            f"Sr No. {sr_no}, {speaker}: \"{utterance}\""
+            for sr_no, (_, utterance), speaker in zip(sr_no_list, conversation, speakers_list)
+        ]
+        return lines, speakers_list
+
+    def _conversation_text(self, conversation, sr_no_list, speakers_list, hashed_speakers=None):
+        """Returns the utterance lines of the prompt, joined, and the speaker names they use."""
+        lines, speakers_list = self._conversation_lines(conversation, sr_no_list, speakers_list, hashed_speakers)
+        return "\n".join(lines), speakers_list
+
+    def generate_prompt(self, conversation, sr_no_list, dialogue_id, speakers_list, hashed_speakers=None):
         """
         Generates the prompt text for the LLM.
         If self.is_hash_speakers is True, speaker names are replaced with hashed identifiers.
         The conversation is a list of (Speaker, Utterance) tuples.
         """
-        if self.is_hash_speakers:
-            hashed_speakers_list, _ = self._hash_speakers(speakers_list)
-            conversation_text = "\n".join(
-                f"Sr No. {sr_no}, {hashed_speaker}: \"{utterance}\""
-                for sr_no, (_, utterance), hashed_speaker in zip(sr_no_list, conversation, hashed_speakers_list)
-            )
-        else:
-            conversation_text = "\n".join(
-                f"Sr No. {sr_no}, {speaker}: \"{utterance}\""
-                for sr_no, (speaker, utterance) in zip(sr_no_list, conversation)
-            )
+        conversation_text, _ = self._conversation_text(conversation, sr_no_list, speakers_list, hashed_speakers)
         prompt = (
             f"{self.roles_description}\n\n"
             f"Here is the context of the entire dialogue with Dialogue_ID {dialogue_id}:\n"
@@ -37,89 +51,155 @@ class Approach2(BaseRoleApproach):
         )
         return prompt
 
-    def assign_roles(self, conversation, sr_no_list, speakers_list, dialogue_id):
+    def assign_roles(self, conversation, sr_no_list, speakers_list, dialogue_id, hashed_speakers=None):
         """
         Builds the prompt, calls the LLM with retry logic, and returns parsed results.
+        Dialogues longer than window_tokens are labelled in windows (see BaseRoleApproach._assign_windowed).
         """
-        prompt = self.generate_prompt(conversation, sr_no_list, dialogue_id, speakers_list)
-        if self.is_hash_speakers:
-            hashed_speakers_list, _ = self._hash_speakers(speakers_list)
-            speakers_for_validation = hashed_speakers_list
-        else:
-            speakers_for_validation = speakers_list
-
-        template = (
-            "You are an assistant specialized in analyzing dialogue and identifying speaker roles. "
-            "Answer the following question in a valid JSON format.\n\n"
-            "Question: {question}\n\n"
-            "Answer: Think step by step and provide a JSON object following the specified format."
+        lines, speakers_for_validation = self._conversation_lines(conversation, sr_no_list, speakers_list, hashed_speakers)
+        if self._needs_windows(lines):
+            return self._assign_windowed(sr_no_list, speakers_for_validation, lines, dialogue_id)
+        prompt = self.generate_prompt(conversation, sr_no_list, dialogue_id, speakers_list, speakers_for_validation)
+
+        return self._assign_with_repair(prompt, lines, sr_no_list, speakers_for_validation, dialogue_id)
+
+    @property
+    def batch_response_format(self):
+        """The structured-output schema of a batch response, or None when structured_output is off."""
+        return BATCH_RESPONSE_SCHEMA if self.structured_output else None
+
+    def batch_item(self, payload):
+        """
+        Returns (dialogue_id, conversation_text, sr_no_list, speakers_list) for one process_data
+        payload, where conversation_text lists the utterances as in the single-dialogue prompt.
+        """
+        conversation, sr_no_list, speakers_list, dialogue_id, hashed_speakers = payload
+        conversation_text, speakers_for_validation = self._conversation_text(
+            conversation, sr_no_list, speakers_list, hashed_speakers
         )
+        return dialogue_id, conversation_text, sr_no_list, speakers_for_validation
+
+    def estimate_tokens(self, payload):
+        """Rough token count of a dialogue's utterances in a prompt (about four characters per token)."""
+        return len(self.batch_item(payload)[1]) // 4
 
-        attempts = 0
+    def generate_batch_prompt(self, items):
+        """Builds one prompt covering several dialogues (batch_item tuples), keyed by Dialogue_ID."""
+        dialogues_text = "\n\n".join(
+            f"Dialogue_ID {dialogue_id}:\n{conversation_text}" for dialogue_id, conversation_text, _, _ in items
+        )
+        return (
+            f"{self.roles_description}\n\n"
+            "Here are several independent dialogues. Assign roles within each dialogue separately:\n\n"
+            f"{dialogues_text}\n\n"
+            "Identify the role and provide justifications for each speaker in every dialogue. Ensure each response "
+            "includes 'Dialogue_ID', 'Sr No.', 'Speaker', 'Role', and 'Justification'."
+        )
+
+    def assign_roles_batch(self, payloads):
+        """
+        Assigns roles for several dialogues with a single LLM request and returns {dialogue_id: rows}.
+        The rows are split by Dialogue_ID (or by Sr No. when the model leaves it out) and validated
+        per dialogue; every dialogue that does not come back complete and valid falls back to a
+        single-dialogue request through assign_roles.
+        """
+        items = [self.batch_item(payload) for payload in payloads]
+        prompt = self.generate_batch_prompt(items)
+        owners = {sr_no: dialogue_id for dialogue_id, _, sr_no_list, _ in items for sr_no in sr_no_list}
+        dialogue_ids = [dialogue_id for dialogue_id, _, _, _ in items]
+        rows_by_dialogue = {}
         response = None
-        while attempts < self.max_retries:
-            try:
-                response = run_llm(prompt, template)
-                parsed_results = self.parse_response(response, sr_no_list, speakers_for_validation, prompt, dialogue_id)
-                if all(result["Role"] != "Error" for result in parsed_results):
-                    # Annotate valid results.
-                    for result in parsed_results:
-                        result["Dialogue_ID"] = dialogue_id
-                        result["Prompt"] = prompt
-                        result["Response"] = response
-                    return parsed_results
-            except Exception as e:
-                if "Connection refused" in str(e):
-                    raise RuntimeError(f"Critical Error: {str(e)}") from e
-            attempts += 1
-
-        print(f"Failed to assign roles for Dialogue_ID {dialogue_id} after {self.max_retries} attempts.", flush=True)
-        return [{
-            "Sr No.": sr_no,
-            "Speaker": speaker,
-            "Dialogue_ID": dialogue_id,
-            "Role": "Error",
-            "Justification": f"Failed after {self.max_retries} attempts.",
-            "Prompt": prompt
-        } for sr_no, speaker in zip(sr_no_list, speakers_for_validation)]
-
-def process_data(mode, model_instance: Approach2, output_file_suffix):
+        try:
+            response = self.client.invoke(prompt, self.template, format=self.batch_response_format)
+            for row in self._extract_rows(response):
+                dialogue_id = row.get("Dialogue_ID", owners.get(row["Sr No."]))
+                rows_by_dialogue.setdefault(dialogue_id, []).append(row)
+        except PermanentLLMError as e:
+            self._trace_batch_call(dialogue_ids, prompt, "error", error=e)
+            raise RuntimeError(f"Critical Error: {str(e)}") from e
+        except Exception as e:
+            # Transient errors were already retried with backoff by the client's retry policy.
+            self._trace_batch_call(dialogue_ids, prompt, "error", error=e)
+
+        results = {}
+        fallback = []
+        rows_accepted = 0
+        for payload, (dialogue_id, _, sr_no_list, speakers_list) in zip(payloads, items):
+            accepted = self._accept_rows(rows_by_dialogue.get(dialogue_id, []), dict(zip(sr_no_list, speakers_list)))
+            if len(accepted) == len(sr_no_list):
+                sources = {sr_no: (prompt, response) for sr_no in sr_no_list}
+                results[dialogue_id] = self._merge_rows(sr_no_list, speakers_list, accepted, sources, dialogue_id)
+                rows_accepted += len(accepted)
+                self._record_dialogue(0, failed=False)
+            else:
+                fallback.append((dialogue_id, payload))
+
+        if response is not None:
+            outcome = "ok" if not fallback else "partial" if results else "invalid"
+            self._trace_batch_call(dialogue_ids, prompt, outcome, rows_accepted)
+            if not results:
+                # Do not let a later batch replay a response that contributed nothing from the cache.
+                self.client.discard(prompt, self.template, self.batch_response_format)
+        with self._stats_lock:
+            self.call_stats["llm_calls"] += 1
+            self.call_stats["batch_calls"] += 1
+            self.call_stats["batched_dialogues"] += len(results)
+
+        for dialogue_id, payload in fallback:
+            results[dialogue_id] = self.assign_roles(*payload)
+        return results
+
+    def _trace_batch_call(self, dialogue_ids, prompt, parse_outcome, rows_accepted=0, error=None):
+        """Adds the client's latest call, made for a batch of dialogues, to the telemetry trace."""
+        self.telemetry.record_call(
+            None, 1, prompt, getattr(self.client, "last_call", None), parse_outcome, prompt_kind="batch",
+            rows_accepted=rows_accepted, error=error, batch=dialogue_ids
+        )
+
+def process_data(mode, model_instance: Approach2, output_file_suffix, max_in_flight=None,
+                 output_dir=FINAL_SAVE_DIR, batching=BATCH_DIALOGUES, dry_run=False, cascade=None):
     """
     Processes input CSV data for Approach 2.
-    Groups the dialogues by Dialogue_ID, calls the model to assign roles,
-    and appends (or writes) the results to a CSV file.
+    Takes the dialogues from the split's DialogueStore, calls the model to assign roles with up to
+    max_in_flight requests in flight at once (by default MAX_CONCURRENT_DIALOGUES per Ollama
+    server), and appends (or writes) the results to a CSV file in output_dir. With batching,
+    short dialogues are packed into multi-dialogue requests of up to BATCH_TOKEN_BUDGET
+    estimated tokens. Dialogues are dispatched longest first (SCHEDULER_PRIORITY); with dry_run,
+    only the run's estimated tokens and wall-clock time are printed and returned. With a fitted
+    cascade.RoleCascade, the dialogues it is confident about are answered without an LLM call.
     """
     input_path = TRAIN_PATH if mode == 'train' else TEST_PATH
-    input_df = pd.read_csv(input_path)
-    # Keep only the required columns.
-    input_df = input_df[['Sr No.', 'Dialogue_ID', 'Speaker', 'Utterance']]
-    grouped_conversations = input_df.groupby('Dialogue_ID')
+    store = load_dialogues(input_path)
 
     output_file = os.path.join(
-        FINAL_SAVE_DIR,
+        output_dir,
         f"{mode}_{output_file_suffix}{'_hashed' if model_instance.is_hash_speakers else ''}.csv"
     )
 
-    # Create the output file with header if it does not exist.
-    if not os.path.exists(output_file):
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write("Sr No.,Speaker,Dialogue_ID,Role,Justification,Prompt,Response\n")
-
-    existing_df = pd.read_csv(output_file) if os.path.exists(output_file) else pd.DataFrame()
-
-    for dialogue_id, group in tqdm.tqdm(grouped_conversations, desc="Processing dialogues"):
-        # Skip dialogues already processed successfully.
-        if dialogue_id in existing_df.get("Dialogue_ID", []):
-            dialogue_entries = existing_df[existing_df["Dialogue_ID"] == dialogue_id]
-            if "Error" not in dialogue_entries["Role"].values:
-                continue
-            existing_df = existing_df[existing_df["Dialogue_ID"] != dialogue_id]
-
-        conversation_data = list(zip(group['Speaker'], group['Utterance']))
-        sr_no_list = group['Sr No.'].tolist()
-        speakers_list = group['Speaker'].tolist()
-
-        roles = model_instance.assign_roles(conversation_data, sr_no_list, speakers_list, dialogue_id)
-        res_df = pd.DataFrame(roles)
-        existing_df = pd.concat([existing_df, res_df]).sort_values(by="Sr No.").reset_index(drop=True)
-        existing_df.to_csv(output_file, index=False, encoding='utf-8')
+    # Dialogues are fingerprinted so that changed inputs or prompt config get re-run on resume.
+    config_hash = config_fingerprint(model_instance)
+
+    jobs = []
+    for dialogue in store:
+        hashed_speakers = dialogue.hashed_speakers if model_instance.is_hash_speakers else None
+        fingerprint = dialogue.fingerprint(config_hash, DIALOGUE_COLUMNS)
+        jobs.append((dialogue.dialogue_id, fingerprint, (
+            dialogue.conversation, dialogue.sr_no_list, dialogue.speakers_list, dialogue.dialogue_id, hashed_speakers
+        )))
+
+    process_dialogue = lambda job: model_instance.assign_roles(*job)
+    batcher = DialogueBatcher(
+        model_instance.assign_roles_batch, process_dialogue, model_instance.estimate_tokens,
+        BATCH_TOKEN_BUDGET, BATCH_MAX_DIALOGUES
+    ) if batching else None
+    results_df = process_dialogues(
+        jobs, process_dialogue, output_file, max_in_flight or default_max_in_flight(model_instance.client),
+        desc="Processing dialogues",
+        telemetry=model_instance.telemetry, batcher=batcher,
+        warm_up=model_instance.warm_up if LLM_WARM_PREFIX else None,
+        scheduler=DialogueScheduler(model_instance.estimate_cost), dry_run=dry_run,
+        gate=cascade.gate(store, model_instance.is_hash_speakers) if cascade is not None else None)
+    if dry_run:
+        return results_df
+    print(model_instance.retry_summary())
+    return results_df
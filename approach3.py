@@ -1,59 +1,81 @@
 import os
-import re
-import tqdm
-import pandas as pd
-from ollama_setup import run_llm
 from base_role_approach import BaseRoleApproach
-from config import TRAIN_PATH, TEST_PATH, FINAL_SAVE_DIR
+from dialogue_runner import process_dialogues, default_max_in_flight
+from scheduler import DialogueScheduler
+from dialogue_store import load_dialogues, DIALOGUE_COLUMNS
+from checkpoint import config_fingerprint
+from config import TRAIN_PATH, TEST_PATH, FINAL_SAVE_DIR, LLM_WARM_PREFIX
 
 class Approach3(BaseRoleApproach):
     """
     Extends BaseRoleApproach and adds support for including conversation durations and connection summaries.
     """
-    def generate_prompt(self, conversation, sr_no_list, duration_list, dialogue_id, speakers_list, connection_summary=None):
+    def _conversation_lines(self, conversation, sr_no_list, duration_list, speakers_list, hashed_speakers=None):
         """
-        Generates the dialogue prompt.
-        Optionally includes a connection summary.
+        Returns the prompt line of every utterance (with its duration) and the speaker names they use.
+        Hashed speaker names are taken from hashed_speakers when precomputed (e.g. by DialogueStore).
         """
         if self.is_hash_speakers:
-            _, hashed_speakers_list = self._hash_speakers(speakers_list)
-        else:
-            hashed_speakers_list = speakers_list
-
-        conversation_text = "\n".join(
+            speakers_list = hashed_speakers or self._hash_speakers(speakers_list)[0]
+        lines = [
             f"Sr No. {sr_no}, {hashed_speaker} ({round(duration, 2)}s): \"{utterance}\""
             for sr_no, duration, (speaker, utterance), hashed_speaker
-            in zip(sr_no_list, duration_list, conversation, hashed_speakers_list)
+            in zip(sr_no_list, duration_list, conversation, speakers_list)
+        ]
+        return lines, speakers_list
+
+    def _connection_text(self, connection_summary, speakers=None):
+        """
+        Renders a connection summary for the prompt ("" without one). With speakers, only the
+        connections between them and their own participant entries are included.
+        """
+        if not connection_summary:
+            return ""
+        connections = connection_summary.get('Connection_Summary', [])
+        participants = connection_summary.get('Participants_Summary', [])
+        if speakers is not None:
+            speakers = set(speakers)
+            connections = [conn for conn in connections
+                           if conn['Speaker_Response'] in speakers and conn['Speaker_Responded_To'] in speakers]
+            participants = [part for part in participants if part['Speaker_Response'] in speakers]
+        connection_text = "\n\nHere is a detailed summary of how the participants interact with specific individuals:\n"
+        connection_text += "\n".join(
+            f"- Speaker `{conn['Speaker_Response']}` when interacting with `{conn['Speaker_Responded_To']}`:\n"
+            f"  • Avg Duration of Response: {conn['Response_Duration']:.2f}s\n"
+            f"  • Avg Words Used: {conn['Words_in_Response']:.2f}\n"
+            f"  • Avg Letters Used: {conn['Letters_in_Response']:.2f}\n"
+            f"  • Sentiments Expressed: {', '.join([f'{sent[0]} ({sent[1]}%)' for sent in conn['Sentiment_in_Response']])}\n"
+            f"  • Emotions Displayed: {', '.join([f'{emo[0]} ({emo[1]}%)' for emo in conn['Emotion_in_Response']])}"
+            for conn in connections
+        )
+        connection_text += "\n\nNow, let's look at an overall view of how each speaker communicates in general, across all their conversations:\n"
+        connection_text += "\n".join(
+            f"- Speaker `{part['Speaker_Response']}` (overall communication):\n"
+            f"  • Avg Duration of Response: {part['Response_Duration']:.2f}s\n"
+            f"  • Avg Words Used: {part['Words_in_Response']:.2f}\n"
+            f"  • Avg Letters Used: {part['Letters_in_Response']:.2f}\n"
+            f"  • Sentiments Expressed: {', '.join([f'{sent[0]} ({sent[1]}%)' for sent in part['Sentiment_in_Response']])}\n"
+            f"  • Emotions Displayed: {', '.join([f'{emo[0]} ({emo[1]}%)' for emo in part['Emotion_in_Response']])}"
+            for part in participants
         )
+        connection_text += (
+            "\n\nKey Insight:\n"
+            "The `Connection Summary` provides a focused view of how speakers communicate with specific individuals. "
+            "In contrast, the `Participants Summary` reveals their general communication patterns across all interactions.\n"
+            "Comparing these summaries can highlight whether speakers adjust their communication style based on the person they are speaking to."
+        )
+        return connection_text
 
-        connection_text = ""
-        if connection_summary:
-            connection_text = "\n\nHere is a detailed summary of how the participants interact with specific individuals:\n"
-            connection_text += "\n".join(
-                f"- Speaker `{conn['Speaker_Response']}` when interacting with `{conn['Speaker_Responded_To']}`:\n"
-                f"  • Avg Duration of Response: {conn['Response_Duration']:.2f}s\n"
-                f"  • Avg Words Used: {conn['Words_in_Response']:.2f}\n"
-                f"  • Avg Letters Used: {conn['Letters_in_Response']:.2f}\n"
-                f"  • Sentiments Expressed: {', '.join([f'{sent[0]} ({sent[1]}%)' for sent in conn['Sentiment_in_Response']])}\n"
-                f"  • Emotions Displayed: {', '.join([f'{emo[0]} ({emo[1]}%)' for emo in conn['Emotion_in_Response']])}"
-                for conn in connection_summary.get('Connection_Summary', [])
-            )
-            connection_text += "\n\nNow, let's look at an overall view of how each speaker communicates in general, across all their conversations:\n"
-            connection_text += "\n".join(
-                f"- Speaker `{part['Speaker_Response']}` (overall communication):\n"
-                f"  • Avg Duration of Response: {part['Response_Duration']:.2f}s\n"
-                f"  • Avg Words Used: {part['Words_in_Response']:.2f}\n"
-                f"  • Avg Letters Used: {part['Letters_in_Response']:.2f}\n"
-                f"  • Sentiments Expressed: {', '.join([f'{sent[0]} ({sent[1]}%)' for sent in part['Sentiment_in_Response']])}\n"
-                f"  • Emotions Displayed: {', '.join([f'{emo[0]} ({emo[1]}%)' for emo in part['Emotion_in_Response']])}"
-                for part in connection_summary.get('Participants_Summary', [])
-            )
-            connection_text += (
-                "\n\nKey Insight:\n"
-                "The `Connection Summary` provides a focused view of how speakers communicate with specific individuals. "
-                "In contrast, the `Participants Summary` reveals their general communication patterns across all interactions.\n"
-                "Comparing these summaries can highlight whether speakers adjust their communication style based on the person they are speaking to."
-            )
+    def generate_prompt(self, conversation, sr_no_list, duration_list, dialogue_id, speakers_list, connection_summary=None,
+                        hashed_speakers=None):
+        """
+        Generates the dialogue prompt.
+        Optionally includes a connection summary. Hashed speaker names are taken from
+        hashed_speakers when precomputed (e.g. by DialogueStore).
+        """
+        lines, _ = self._conversation_lines(conversation, sr_no_list, duration_list, speakers_list, hashed_speakers)
+        conversation_text = "\n".join(lines)
+        connection_text = self._connection_text(connection_summary)
 
         prompt = (
             f"{self.roles_description}\n\n"
@@ -64,94 +86,88 @@ class Approach3(BaseRoleApproach):
         )
         return prompt
 
-    def assign_roles(self, conversation, sr_no_list, duration_list, speakers_list, dialogue_id, connection_summary=None):
+    def estimate_cost(self, payload):
+        """Adds the utterance durations and the connection summary to BaseRoleApproach.estimate_cost."""
+        prompt_tokens, output_tokens = super().estimate_cost(payload)
+        conversation, connection_summary = payload[0], payload[5]
+        prompt_tokens += 2 * len(conversation)
+        if connection_summary:
+            # Every connection and participant entry renders to roughly 300 characters.
+            entries = (len(connection_summary.get('Connection_Summary', []))
+                       + len(connection_summary.get('Participants_Summary', [])))
+            prompt_tokens += 75 * entries + 100
+        return prompt_tokens, output_tokens
+
+    def assign_roles(self, conversation, sr_no_list, duration_list, speakers_list, dialogue_id, connection_summary=None,
+                     hashed_speakers=None):
         """
         Builds the prompt (including connection summaries if provided), calls the LLM, and returns parsed results.
+        Dialogues longer than window_tokens are labelled in windows (see BaseRoleApproach._assign_windowed),
+        each with the connection summary of its own speakers only.
         """
-        prompt = self.generate_prompt(conversation, sr_no_list, duration_list, dialogue_id, speakers_list, connection_summary)
-        if self.is_hash_speakers:
-            _, speakers_for_validation = self._hash_speakers(speakers_list)
-        else:
-            speakers_for_validation = speakers_list
-
-        template = (
-            "You are an assistant specialized in analyzing dialogue and identifying speaker roles. "
-            "Answer the following question in a valid JSON format.\n\n"
-            "Question: {question}\n\n"
-            "Answer: Think step by step and provide a JSON object following the specified format."
+        lines, speakers_for_validation = self._conversation_lines(
+            conversation, sr_no_list, duration_list, speakers_list, hashed_speakers
+        )
+        if self._needs_windows(lines):
+            return self._assign_windowed(
+                sr_no_list, speakers_for_validation, lines, dialogue_id,
+                window_notes=lambda speakers: self._connection_text(connection_summary, speakers)
+            )
+        prompt = self.generate_prompt(
+            conversation, sr_no_list, duration_list, dialogue_id, speakers_list, connection_summary, speakers_for_validation
         )
 
-        attempts = 0
-        response = None
-        while attempts < self.max_retries:
-            try:
-                response = run_llm(prompt, template)
-                parsed_results = self.parse_response(response, sr_no_list, speakers_for_validation, prompt, dialogue_id)
-                if all(result["Role"] != "Error" for result in parsed_results):
-                    for result in parsed_results:
-                        result["Dialogue_ID"] = dialogue_id
-                        result["Prompt"] = prompt
-                        result["Response"] = response
-                    return parsed_results
-            except Exception as e:
-                if "Connection refused" in str(e):
-                    raise RuntimeError(f"Critical Error: {str(e)}") from e
-            attempts += 1
-
-        print(f"Failed to assign roles for Dialogue_ID {dialogue_id} after {self.max_retries} attempts.", flush=True)
-        return [{
-            "Sr No.": sr_no,
-            "Speaker": speaker,
-            "Dialogue_ID": dialogue_id,
-            "Role": "Error",
-            "Justification": f"Failed after {self.max_retries} attempts.",
-            "Prompt": prompt,
-            "Response": response
-        } for sr_no, speaker in zip(sr_no_list, speakers_for_validation)]
+        return self._assign_with_repair(
+            prompt, lines, sr_no_list, speakers_for_validation, dialogue_id, self._connection_text(connection_summary)
+        )
 
-def process_data(mode, model_instance: Approach3, output_file_suffix, group_by, is_hash_speakers):
+def process_data(mode, model_instance: Approach3, output_file_suffix, group_by, is_hash_speakers,
+                 max_in_flight=None, output_dir=FINAL_SAVE_DIR, dry_run=False, cascade=None):
     """
     Processes the input CSV data for Approach 3.
-    Loads the data (including time fields to compute duration), groups by Dialogue_ID,
-    and calls the model to assign roles (with optional connection summaries).
-    
-    Note: For simplicity, this runner does not compute a full connection summary.
-          You can extend this function to call your own summarization routines.
+    Takes the dialogues (including utterance durations) from the split's DialogueStore,
+    and calls the model to assign roles, keeping up to max_in_flight dialogues in flight at once
+    (by default MAX_CONCURRENT_DIALOGUES per Ollama server).
+    When group_by is given (e.g. ["Episode", "Season"]), connection summaries are precomputed
+    once per group with ConnectionIndex and looked up for each dialogue; group_by=None
+    disables them. The output CSV is written to output_dir. Dialogues are dispatched longest
+    first (SCHEDULER_PRIORITY); with dry_run, only the run's estimated tokens and wall-clock time
+    are printed and returned. With a fitted cascade.RoleCascade, the dialogues it is confident
+    about are answered without an LLM call.
     """
     input_path = TRAIN_PATH if mode == 'train' else TEST_PATH
-    input_df = pd.read_csv(input_path)
-    # Convert StartTime and EndTime to datetime and compute Duration.
-    input_df['StartTime'] = pd.to_datetime(input_df['StartTime'].str.replace(',', '.'))
-    input_df['EndTime'] = pd.to_datetime(input_df['EndTime'].str.replace(',', '.'))
-    input_df['Duration'] = (input_df['EndTime'] - input_df['StartTime']).dt.total_seconds()
-    # Keep only needed columns.
-    input_df = input_df[['Sr No.', 'Dialogue_ID', 'Speaker', 'Utterance', 'Duration']]
-    grouped_conversations = input_df.groupby('Dialogue_ID')
+    store = load_dialogues(input_path)
+    connection_index = store.connection_index(group_by) if group_by else None
 
     output_file = os.path.join(
-        FINAL_SAVE_DIR,
+        output_dir,
         f"{mode}_{output_file_suffix}{'_hashed' if model_instance.is_hash_speakers else ''}.csv"
     )
-    if not os.path.exists(output_file):
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write("Sr No.,Speaker,Dialogue_ID,Role,Justification,Prompt,Response\n")
-    existing_df = pd.read_csv(output_file) if os.path.exists(output_file) else pd.DataFrame()
-
-    for dialogue_id, group in tqdm.tqdm(grouped_conversations, desc="Processing Dialogues"):
-        if dialogue_id in existing_df.get("Dialogue_ID", []):
-            dialogue_entries = existing_df[existing_df["Dialogue_ID"] == dialogue_id]
-            if "Error" not in dialogue_entries["Role"].values:
-                continue
-            existing_df = existing_df[existing_df["Dialogue_ID"] != dialogue_id]
+    # Dialogues are fingerprinted so that changed inputs or prompt config get re-run on resume.
+    config_hash = config_fingerprint(model_instance)
 
-        conversation = list(zip(group['Speaker'], group['Utterance']))
-        sr_no_list = group['Sr No.'].tolist()
-        duration_list = group['Duration'].tolist()
-        speakers_list = group['Speaker'].tolist()
+    jobs = []
+    for dialogue in store:
+        hashed_speakers = dialogue.hashed_speakers if model_instance.is_hash_speakers else None
+        connection_summary = None
+        if connection_index is not None:
+            # Speaker names in the summary must match the (possibly hashed) names in the dialogue.
+            name_map = dialogue.name_map if model_instance.is_hash_speakers else None
+            connection_summary = connection_index.summary_for(dialogue.dialogue_id, dialogue.speakers_list, name_map)
+        fingerprint = dialogue.fingerprint(config_hash, DIALOGUE_COLUMNS + ['Duration'], extra=connection_summary)
+        jobs.append((dialogue.dialogue_id, fingerprint, (
+            dialogue.conversation, dialogue.sr_no_list, dialogue.duration_list, dialogue.speakers_list,
+            dialogue.dialogue_id, connection_summary, hashed_speakers
+        )))
 
-        # For now, we set connection_summary to None.
-        connection_summary = None  
-        roles = model_instance.assign_roles(conversation, sr_no_list, duration_list, speakers_list, dialogue_id, connection_summary)
-        res_df = pd.DataFrame(roles)
-        existing_df = pd.concat([existing_df, res_df]).sort_values(by="Sr No.").reset_index(drop=True)
-        existing_df.to_csv(output_file, index=False, encoding='utf-8')
+    results_df = process_dialogues(
+        jobs, lambda job: model_instance.assign_roles(*job), output_file,
+        max_in_flight or default_max_in_flight(model_instance.client), desc="Processing Dialogues",
+        telemetry=model_instance.telemetry,
+        warm_up=model_instance.warm_up if LLM_WARM_PREFIX else None,
+        scheduler=DialogueScheduler(model_instance.estimate_cost), dry_run=dry_run,
+        gate=cascade.gate(store, model_instance.is_hash_speakers) if cascade is not None else None)
+    if dry_run:
+        return results_df
+    print(model_instance.retry_summary())
+    return results_df
@@ -1,17 +1,44 @@
 import re
-from config import VALID_ROLES
+import threading
+from collections import Counter
+from config import (
+    VALID_ROLES, LLM_STRUCTURED_OUTPUT, LLM_STREAMING, LLM_OUTPUT_TOKENS_PER_UTTERANCE, PROMPT_WINDOW_TOKENS,
+    PROMPT_WINDOW_OVERLAP
+)
+from ollama_setup import get_client
+from retry_policy import PermanentLLMError, GenerationAborted
+from response_parser import extract_json_rows, RESPONSE_SCHEMA, StreamingRowValidator
+from telemetry import RunTelemetry
+from scheduler import estimate_prompt_tokens
 
 class BaseRoleApproach:
     """
     Shared functionality for approaches that assign speaker roles.
     Contains:
-      - A common roles description.
+      - A common roles description and prompt template.
       - Speaker hashing.
-      - A generic response parser.
+      - One response parsing path (_extract_rows, validated by _accept_rows) and a retry loop
+        that repairs only the invalid rows.
+      - A shared LLM client (the process-wide one unless another is given).
+      - Optional structured output: Ollama constrains the response to RESPONSE_SCHEMA.
+      - Optional streaming: a response is cancelled as soon as its rows are provably wrong.
+      - Optional sliding-window prompting of long dialogues under a token budget.
+      - Per-call telemetry, traced while process_data runs.
     """
-    def __init__(self, max_retries=5, is_hash_speakers=False):
+    def __init__(self, max_retries=5, is_hash_speakers=False, client=None, structured_output=LLM_STRUCTURED_OUTPUT,
+                 streaming=LLM_STREAMING, window_tokens=PROMPT_WINDOW_TOKENS, window_overlap=PROMPT_WINDOW_OVERLAP):
         self.max_retries = max_retries
+        self.window_tokens = window_tokens
+        self.window_overlap = window_overlap
         self.is_hash_speakers = is_hash_speakers
+        self.client = client or get_client()
+        self.structured_output = structured_output
+        self.response_format = RESPONSE_SCHEMA if structured_output else None
+        self.streaming = streaming
+        self.call_stats = {"dialogues": 0, "llm_calls": 0, "failed_dialogues": 0, "batch_calls": 0,
+                           "batched_dialogues": 0, "windowed_dialogues": 0, "windows": 0}
+        self._stats_lock = threading.Lock()
+        self.telemetry = RunTelemetry(type(self).__name__)
         self.roles_description = (
             "\nYou are an expert in analyzing conversations and assigning speaker roles. "
             "The following conversation is taken from various contexts, and your task is to assign roles "
@@ -30,6 +57,20 @@ class BaseRoleApproach:
             '\t"Justification": <Detailed_Reason>\n'
             "}"
         )
+        self.template = (
+            "You are an assistant specialized in analyzing dialogue and identifying speaker roles. "
+            "Answer the following question in a valid JSON format.\n\n"
+            "Question: {question}\n\n"
+            "Answer: Think step by step and provide a JSON object following the specified format."
+        )
+
+    def warm_up(self, workers):
+        """
+        Has the server evaluate the static start of every prompt (template and roles description)
+        once per worker before a run. Prompts put this prefix first, byte for byte, so the
+        server's prompt cache only re-evaluates the dialogue-specific part.
+        """
+        self.client.warm_prefix(self.roles_description, self.template, copies=workers)
 
     def _hash_speakers(self, speakers_list):
         """
@@ -46,79 +87,297 @@ class BaseRoleApproach:
             hashed_list.append(mapping[speaker])
         return hashed_list, mapping
 
-    def parse_response(self, response, sr_no_list, speakers_list, prompt, dialogue_id):
+    def _extract_rows(self, response):
         """
-        Parses the JSON output from the LLM and validates that the order and values
-        of speaker names and serial numbers match expectations.
-        Returns a list of result dictionaries (or error dictionaries).
+        Returns the utterance rows in a response as dictionaries with ROW_FIELDS keys.
+        Uses the JSON parser first and falls back to the strict regex for non-JSON output.
         """
-        results = []
-        try:
-            matches = list(re.finditer(
+        rows = extract_json_rows(response)
+        if rows:
+            return rows
+        return [
+            {"Sr No.": int(match.group(1)), "Speaker": match.group(2), "Role": match.group(3),
+             "Justification": match.group(4)}
+            for match in re.finditer(
                 r'"Sr No\.":\s*(\d+),\s*"Speaker":\s*"([^"]+)",\s*"Role":\s*"([^"]+)",\s*"Justification":\s*"([^"]+)"',
                 response
-            ))
-            if not matches:
-                raise ValueError("Parsing failed: No valid matches found in the response.")
-
-            model_sr_no_list = [int(match.group(1)) for match in matches]
-            model_speakers_list = [match.group(2) for match in matches]
-            roles_set = {match.group(3) for match in matches}
-
-            if model_sr_no_list != sr_no_list:
-                for sr_no, speaker in zip(sr_no_list, speakers_list):
-                    results.append({
-                        "Sr No.": sr_no,
-                        "Speaker": speaker,
-                        "Dialogue_ID": dialogue_id,
-                        "Role": "Error",
-                        "Justification": f"Sr No. mismatch: Expected {sr_no_list}, but got {model_sr_no_list}.",
-                        "Prompt": prompt
-                    })
-                return results
-
-            if model_speakers_list != speakers_list:
-                for sr_no, speaker in zip(sr_no_list, speakers_list):
-                    results.append({
-                        "Sr No.": sr_no,
-                        "Speaker": speaker,
-                        "Dialogue_ID": dialogue_id,
-                        "Role": "Error",
-                        "Justification": f"Speaker mismatch: Expected {speakers_list}, but got {model_speakers_list}.",
-                        "Prompt": prompt
-                    })
-                return results
-
-            if not roles_set.issubset(VALID_ROLES):
-                invalid_roles = roles_set - VALID_ROLES
-                for sr_no, speaker in zip(sr_no_list, speakers_list):
-                    results.append({
-                        "Sr No.": sr_no,
-                        "Speaker": speaker,
-                        "Dialogue_ID": dialogue_id,
-                        "Role": "Error",
-                        "Justification": f"Invalid roles found: {invalid_roles}. Expected only {VALID_ROLES}.",
-                        "Prompt": prompt
-                    })
-                return results
-
-            # Build valid results.
-            for match in matches:
-                results.append({
-                    "Sr No.": int(match.group(1)),
-                    "Speaker": match.group(2),
-                    "Role": match.group(3),
-                    "Justification": match.group(4),
-                    "Dialogue_ID": dialogue_id,
-                    "Prompt": prompt
+            )
+        ]
+
+    def _accept_rows(self, rows, expected_speakers):
+        """
+        Returns the rows that can be kept, keyed by Sr No.: the Sr No. belongs to the dialogue,
+        the speaker matches the expected speaker for that utterance and the role is valid.
+        """
+        accepted = {}
+        for row in rows:
+            sr_no = row["Sr No."]
+            if sr_no in expected_speakers and sr_no not in accepted \
+                    and row.get("Speaker") == expected_speakers[sr_no] and row.get("Role") in VALID_ROLES:
+                accepted[sr_no] = row
+        return accepted
+
+    def generate_repair_prompt(self, lines, sr_no_list, speakers_list, accepted, dialogue_id, notes=""):
+        """
+        Builds a follow-up prompt that only asks for the utterances still missing a valid role.
+        lines are the utterance lines as the approach rendered them in the first prompt, so the
+        missing utterances are shown the same way (e.g. with Approach 3's durations), and notes
+        is the rest of the approach's context (e.g. its connection summary). Already validated
+        rows are listed without their utterance text. The prompt starts with the same roles
+        description as the full prompt, so the server reuses its cached evaluation of that
+        prefix instead of evicting it.
+        """
+        labeled_text = "\n".join(
+            f"Sr No. {sr_no}, {speaker}: {accepted[sr_no]['Role']}"
+            for sr_no, speaker in zip(sr_no_list, speakers_list) if sr_no in accepted
+        )
+        missing_text = "\n".join(line for sr_no, line in zip(sr_no_list, lines) if sr_no not in accepted)
+        return (
+            f"{self.roles_description}\n\n"
+            f"Assign a speaker role to utterances of the dialogue with Dialogue_ID {dialogue_id}.\n\n"
+            f"Roles already assigned in this dialogue:\n{labeled_text or '(none)'}\n\n"
+            f"Assign roles only to these utterances, keeping their Sr No. and speaker names exactly:\n{missing_text}{notes}\n\n"
+            "For each of them output a JSON object with 'Sr No.', 'Speaker', 'Role' and 'Justification'."
+        )
+
+    def _assign_with_repair(self, prompt, lines, sr_no_list, speakers_list, dialogue_id, notes=""):
+        """
+        Calls the LLM with retry logic and returns one result row per utterance.
+        Valid rows are kept across attempts; every retry after the first sends a repair prompt
+        covering only the missing, misordered or invalid utterances, and the rows are merged
+        back in Sr No. order. lines and speakers_list are the utterance lines and speaker names
+        as they appear in the prompt, and notes the approach's extra context, which the repair
+        prompts repeat (see generate_repair_prompt).
+        """
+        results, llm_calls, failed = self._label_with_repair(
+            prompt, lines, sr_no_list, speakers_list, dialogue_id, notes=notes
+        )
+        self._record_dialogue(llm_calls, failed)
+        return results
+
+    def _label_with_repair(self, prompt, lines, sr_no_list, speakers_list, dialogue_id, prompt_kind="full", notes=""):
+        """
+        The retry loop of _assign_with_repair, for the utterances of one prompt (a whole dialogue
+        or, with prompt_kind "window", one window of it). Returns (results, llm_calls, failed).
+        """
+        expected_speakers = dict(zip(sr_no_list, speakers_list))
+        accepted = {}
+        sources = {}
+        attempt_prompt = prompt
+        attempt_prompts = []
+        attempts = 0
+        response = None
+        while attempts < self.max_retries:
+            try:
+                aborted = False
+                attempt_prompts.append(attempt_prompt)
+                check = StreamingRowValidator(expected_speakers, ignore=accepted) if self.streaming else None
+                try:
+                    response = self.client.invoke(attempt_prompt, self.template, format=self.response_format, check=check)
+                except GenerationAborted as e:
+                    # Keep whatever valid rows arrived before the generation was cancelled.
+                    response = e.text
+                    aborted = True
+                new_rows = {
+                    sr_no: row for sr_no, row in self._accept_rows(self._extract_rows(response), expected_speakers).items()
+                    if sr_no not in accepted
+                }
+                for sr_no, row in new_rows.items():
+                    accepted[sr_no] = row
+                    sources[sr_no] = (attempt_prompt, response)
+                complete = len(accepted) == len(expected_speakers)
+                outcome = "ok" if complete else "aborted" if aborted else "partial" if new_rows else "invalid"
+                self._trace_call(dialogue_id, attempts + 1, attempt_prompt, prompt, outcome, len(new_rows),
+                                 prompt_kind=prompt_kind)
+                if complete:
+                    return self._merge_rows(sr_no_list, speakers_list, accepted, sources, dialogue_id), attempts + 1, False
+                if not new_rows:
+                    # Do not let the retry replay a response that contributed nothing from the cache.
+                    self.client.discard(attempt_prompt, self.template, self.response_format)
+                attempt_prompt = self.generate_repair_prompt(
+                    lines, sr_no_list, speakers_list, accepted, dialogue_id, notes
+                )
+            except PermanentLLMError as e:
+                self._trace_call(dialogue_id, attempts + 1, attempt_prompt, prompt, "error", error=e,
+                                 prompt_kind=prompt_kind)
+                raise RuntimeError(f"Critical Error: {str(e)}") from e
+            except Exception as e:
+                # Transient errors were already retried with backoff by the client's retry policy.
+                self._trace_call(dialogue_id, attempts + 1, attempt_prompt, prompt, "error", error=e,
+                                 prompt_kind=prompt_kind)
+            attempts += 1
+
+        print(f"Failed to assign roles for Dialogue_ID {dialogue_id} after {self.max_retries} attempts.", flush=True)
+        # Drop the whole chain from the cache, partial answers included, so a resumed run asks the
+        # model again instead of replaying the same failing responses.
+        for attempt_prompt in dict.fromkeys(attempt_prompts):
+            self.client.discard(attempt_prompt, self.template, self.response_format)
+        results = self._merge_rows(sr_no_list, speakers_list, accepted, sources, dialogue_id)
+        for result in results:
+            if result["Role"] is None:
+                result.update({
+                    "Role": "Error",
+                    "Justification": f"Failed after {self.max_retries} attempts.",
+                    "Prompt": prompt,
+                    "Response": response
                 })
-        except Exception as e:
+        return results, attempts, True
+
+    def _needs_windows(self, lines):
+        """True when windowed prompting is on and the dialogue's utterance lines exceed window_tokens."""
+        return self.window_tokens is not None and sum(len(line) for line in lines) // 4 > self.window_tokens
+
+    def _window_ranges(self, lines):
+        """
+        Splits a dialogue's utterance lines into consecutive windows of (context_start, start, stop):
+        lines[start:stop] are labelled, and lines[context_start:start], the last window_overlap
+        utterances of the previous window, are repeated as context. A window holds as many
+        utterances as fit in window_tokens (about four characters per token), counting its
+        context, and always at least one.
+        """
+        tokens = [len(line) // 4 + 1 for line in lines]
+        windows = []
+        start = 0
+        while start < len(lines):
+            context_start = max(start - self.window_overlap, 0)
+            used = sum(tokens[context_start:start])
+            stop = start
+            while stop < len(lines) and (stop == start or used + tokens[stop] <= self.window_tokens):
+                used += tokens[stop]
+                stop += 1
+            windows.append((context_start, start, stop))
+            start = stop
+        return windows
+
+    def _rolling_summary(self, speakers_list, roles):
+        """
+        Summarizes the turns before a window: each speaker's number of turns and the roles they
+        were given. Its length grows with the number of speakers, not with the dialogue.
+        """
+        turns = Counter(speakers_list)
+        assigned = {speaker: Counter() for speaker in turns}
+        for speaker, role in zip(speakers_list, roles):
+            if role in VALID_ROLES:
+                assigned[speaker][role] += 1
+        return "\n".join(
+            f"- {speaker}: {turns[speaker]} turns; roles so far: "
+            + (", ".join(f"{role} ({count})" for role, count in assigned[speaker].most_common()) or "none")
+            for speaker in turns
+        )
+
+    def generate_window_prompt(self, dialogue_id, number, windows, summary, context_text, conversation_text, notes=""):
+        """
+        Builds the prompt for one window of a long dialogue: the rolling summary of the turns
+        before it, the overlapping utterances with the roles they got, and the utterances to label.
+        notes is appended after them (e.g. Approach 3's connection summary for the window's speakers).
+        """
+        return (
+            f"{self.roles_description}\n\n"
+            f"Here is part {number} of {windows} of the dialogue with Dialogue_ID {dialogue_id}.\n\n"
+            f"Summary of the earlier turns:\n{summary or '(this is the start of the dialogue)'}\n\n"
+            f"The utterances just before this part, already labelled (context only):\n{context_text or '(none)'}\n\n"
+            f"Utterances to label:\n{conversation_text}{notes}\n\n"
+            "Identify the role and provide justifications for each utterance to label. Ensure each response includes "
+            "'Sr No.', 'Speaker', 'Role', and 'Justification'."
+        )
+
+    def _assign_windowed(self, sr_no_list, speakers_list, lines, dialogue_id, window_notes=None):
+        """
+        Labels a long dialogue window by window (see _window_ranges), so no single request grows
+        with the dialogue's length. lines are the dialogue's utterance lines as they appear in the
+        full prompt, and speakers_list the (possibly hashed) names in them. Each window is
+        validated and repaired on its own, and its rows feed the next window's summary and
+        context; the rows are returned in dialogue order. window_notes(speakers), when given,
+        returns extra prompt text for the speakers of a window, which its repair prompts repeat.
+        """
+        windows = self._window_ranges(lines)
+        results, llm_calls, failed = [], 0, False
+        for number, (context_start, start, stop) in enumerate(windows, 1):
+            roles = [row["Role"] for row in results]
+            summary = self._rolling_summary(speakers_list[:context_start], roles[:context_start])
+            context_text = "\n".join(
+                f"{line} -> {role}" for line, role in zip(lines[context_start:start], roles[context_start:start])
+            )
+            notes = window_notes(speakers_list[context_start:stop]) if window_notes else ""
+            prompt = self.generate_window_prompt(
+                dialogue_id, number, len(windows), summary, context_text, "\n".join(lines[start:stop]), notes
+            )
+            rows, calls, window_failed = self._label_with_repair(
+                prompt, lines[start:stop], sr_no_list[start:stop], speakers_list[start:stop], dialogue_id,
+                prompt_kind="window", notes=notes
+            )
+            results.extend(rows)
+            llm_calls += calls
+            failed = failed or window_failed
+        self._record_dialogue(llm_calls, failed, windows=len(windows))
+        return results
+
+    def estimate_cost(self, payload):
+        """
+        Estimated (prompt_tokens, output_tokens) of a dialogue's request, from its utterance
+        count and text length. payload is a process_data payload, which starts with the
+        conversation. Used by scheduler.DialogueScheduler to order and plan runs.
+        """
+        conversation = payload[0]
+        # The template, roles description, dialogue header and closing instructions.
+        static_chars = len(self.template) + len(self.roles_description) + 400
+        prompt_tokens = estimate_prompt_tokens(conversation, static_chars)
+        if self.window_tokens is not None:
+            # Every window past the first repeats the static text.
+            windows = -(-(prompt_tokens - static_chars // 4) // self.window_tokens)
+            prompt_tokens += max(windows - 1, 0) * static_chars // 4
+        return prompt_tokens, len(conversation) * LLM_OUTPUT_TOKENS_PER_UTTERANCE
+
+    def _merge_rows(self, sr_no_list, speakers_list, accepted, sources, dialogue_id):
+        """Stitches the accepted rows back into dialogue order; missing rows get Role None."""
+        results = []
+        for sr_no, speaker in zip(sr_no_list, speakers_list):
+            row = accepted.get(sr_no)
+            row_prompt, row_response = sources.get(sr_no, (None, None))
             results.append({
-                "Sr No.": None,
-                "Speaker": "Error",
+                "Sr No.": sr_no,
+                "Speaker": speaker,
+                "Role": row["Role"] if row else None,
+                "Justification": row.get("Justification") if row else None,
                 "Dialogue_ID": dialogue_id,
-                "Role": "Error",
-                "Justification": f"Error parsing response: {str(e)}",
-                "Prompt": prompt
+                "Prompt": row_prompt,
+                "Response": row_response
             })
         return results
+
+    def _trace_call(self, dialogue_id, attempt, attempt_prompt, prompt, parse_outcome, rows_accepted=0, error=None,
+                    prompt_kind="full"):
+        """Adds the client's latest call to the telemetry trace (a no-op outside process_data)."""
+        self.telemetry.record_call(
+            dialogue_id, attempt, attempt_prompt, getattr(self.client, "last_call", None), parse_outcome,
+            prompt_kind=prompt_kind if attempt_prompt is prompt else "repair", rows_accepted=rows_accepted, error=error
+        )
+
+    def _record_dialogue(self, llm_calls, failed, windows=1):
+        """Counts LLM calls per dialogue so the retry rate can be reported after a run."""
+        with self._stats_lock:
+            self.call_stats["dialogues"] += 1
+            self.call_stats["llm_calls"] += llm_calls
+            self.call_stats["failed_dialogues"] += int(failed)
+            if windows > 1:
+                self.call_stats["windowed_dialogues"] += 1
+                self.call_stats["windows"] += windows
+
+    def retry_summary(self):
+        """Returns a one-line summary of LLM calls and retries per dialogue."""
+        with self._stats_lock:
+            stats = dict(self.call_stats)
+        dialogues = stats["dialogues"] or 1
+        # Every dialogue needs one call of its own (one per window when windowed), except those
+        # answered by a batched call.
+        retries = (stats["llm_calls"] - stats["batch_calls"] - (stats["dialogues"] - stats["batched_dialogues"])
+                   - (stats["windows"] - stats["windowed_dialogues"]))
+        return (
+            f"{stats['dialogues']} dialogues, {stats['llm_calls']} LLM calls, "
+            f"retry rate {retries / dialogues:.2f} retries/dialogue, "
+            f"{stats['failed_dialogues']} failed after {self.max_retries} attempts, "
+            f"{stats['batched_dialogues']} answered by {stats['batch_calls']} batched calls, "
+            f"{stats['windowed_dialogues']} split into {stats['windows']} windows "
+            f"(structured output {'on' if self.structured_output else 'off'}); "
+            f"retry policy: {self.client.retry_policy.stats()}"
+        )
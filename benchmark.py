@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from datetime import datetime
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from mock_ollama import MockBehaviour, MockOllamaServer
+from config import BASE_DIR, BENCHMARK_DIR, MAX_CONCURRENT_DIALOGUES, IMPORT_TIME_BUDGET_SECONDS
+
+APPROACHES = ("approach1", "approach2", "approach3")
+
+# Dependencies that must not be loaded just by importing the approach modules.
+HEAVY_MODULES = ("torch", "huggingface_hub", "langchain_core", "ollama", "httpx", "sklearn")
+
+_IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {modules}
+print(time.perf_counter() - start)
+print(",".join(module for module in {heavy!r} if module in sys.modules))
+"""
+
+
+def check_import_time(modules=("approach1", "approach2", "approach3", "main"), budget=IMPORT_TIME_BUDGET_SECONDS,
+                      repeats=3):
+    """
+    Measures, in fresh interpreters, how long importing the given modules takes (best of
+    `repeats`) and which heavy dependencies the import pulls in.
+    """
+    probe = _IMPORT_PROBE.format(modules=", ".join(modules), heavy=HEAVY_MODULES)
+    timings = []
+    heavy_loaded = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", probe], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+        timings.append(float(output[0]))
+        heavy_loaded = [module for module in output[1].split(",") if module] if len(output) > 1 else []
+    seconds = min(timings)
+    return {
+        "modules": list(modules),
+        "seconds": round(seconds, 4),
+        "budget_seconds": budget,
+        "heavy_modules_loaded": heavy_loaded,
+        "within_budget": seconds <= budget and not heavy_loaded,
+    }
+
+
+def _peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_approach(name, host, mode, max_in_flight, is_hash_speakers, batching=False):
+    """
+    Runs one approach over a split against the given server, in a fresh process, and
+    returns its timing, retry and memory figures. Results are written to a temporary
+    directory, so nothing is resumed from (or added to) the real results.
+    """
+    from ollama_setup import LLMClient
+    from retry_policy import RetryPolicy, CircuitBreaker
+
+    # Short backoff and circuit reset so that injected errors do not dominate the timings.
+    retry_policy = RetryPolicy(base_delay=0.05, max_delay=1.0, breaker=CircuitBreaker(reset_timeout=1.0), seed=0)
+    client = LLMClient(host=host, use_cache=False, retry_policy=retry_policy)
+
+    if name == "approach1":
+        from approach1 import SpeakerRoleBaseline, process_data
+        instance = SpeakerRoleBaseline(client=client)
+        run = lambda output_dir: process_data(mode, instance, name, max_in_flight, output_dir)
+    elif name == "approach2":
+        from approach2 import Approach2, process_data
+        instance = Approach2(is_hash_speakers=is_hash_speakers, client=client)
+        run = lambda output_dir: process_data(mode, instance, name, max_in_flight, output_dir, batching)
+    elif name == "approach3":
+        from approach3 import Approach3, process_data
+        instance = Approach3(is_hash_speakers=is_hash_speakers, client=client)
+        run = lambda output_dir: process_data(mode, instance, name, ["Episode", "Season"], is_hash_speakers,
+                                              max_in_flight, output_dir)
+    else:
+        raise ValueError(f"Unknown approach: {name}")
+
+    # Count HTTP requests (every attempt, including transport retries) per dialogue thread.
+    local = threading.local()
+    generate = client._client.generate
+
+    def counted_generate(*args, **kwargs):
+        local.requests = getattr(local, "requests", 0) + 1
+        return generate(*args, **kwargs)
+
+    client._client.generate = counted_generate
+
+    latencies = []
+    requests = []
+    assign_roles = instance.assign_roles
+
+    def timed_assign_roles(*args):
+        local.requests = 0
+        local.single_dialogues = getattr(local, "single_dialogues", 0) + 1
+        start = time.perf_counter()
+        try:
+            return assign_roles(*args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+            requests.append(local.requests)
+
+    instance.assign_roles = timed_assign_roles
+
+    if hasattr(instance, "assign_roles_batch"):
+        assign_roles_batch = instance.assign_roles_batch
+
+        def timed_assign_roles_batch(payloads):
+            # Dialogues answered by the batched request get its latency; fallbacks are timed on their own.
+            local.single_dialogues = 0
+            start = time.perf_counter()
+            results = assign_roles_batch(payloads)
+            elapsed = time.perf_counter() - start
+            for _ in range(len(payloads) - local.single_dialogues):
+                latencies.append(elapsed)
+                requests.append(1)
+            return results
+
+        instance.assign_roles_batch = timed_assign_roles_batch
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        results_df = run(output_dir)
+        wall_seconds = time.perf_counter() - start
+    host_stats = client.host_stats()
+
+    latencies = np.array(latencies)
+    retries = np.maximum(np.array(requests) - 1, 0)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+    return {
+        "dialogues": int(len(latencies)),
+        "utterances": int(len(results_df)),
+        "failed_dialogues": int(results_df.loc[results_df["Role"] == "Error", "Dialogue_ID"].nunique()),
+        "wall_seconds": round(wall_seconds, 3),
+        "dialogues_per_second": round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+        "latency_seconds": {
+            "mean": round(float(latencies.mean()), 4) if len(latencies) else 0.0,
+            "p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "max": round(float(latencies.max()), 4) if len(latencies) else 0.0,
+        },
+        "requests": int(sum(requests)),
+        "retries_per_dialogue": {
+            "mean": round(float(retries.mean()), 4) if len(retries) else 0.0,
+            "max": int(retries.max()) if len(retries) else 0,
+            "histogram": {int(k): int(v) for k, v in zip(*np.unique(retries, return_counts=True))},
+        },
+        "retry_policy": retry_policy.stats(),
+        "hosts": host_stats,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(approaches=APPROACHES, mode="test", max_in_flight=None, behaviour=None,
+                  host=None, is_hash_speakers=False, output_dir=BENCHMARK_DIR, batching=False, mock_servers=1,
+                  down_servers=0):
+    """
+    Benchmarks the approaches end to end over a split and saves the report as JSON.
+    Without a host, requests go to mock_servers MockOllamaServers following `behaviour`, so the
+    numbers measure the pipeline itself (prompt building, parsing, retries, storage) rather than
+    the model; down_servers more addresses that refuse connections are added to the host list to
+    exercise the removal of unhealthy hosts. host may also be a list of real servers.
+    max_in_flight defaults to MAX_CONCURRENT_DIALOGUES per server. Each approach runs in its
+    own process, which keeps the peak RSS figures separate. batching enables multi-dialogue
+    requests for the approaches that support them (Approach 2). Returns the report dict.
+    """
+    behaviour = behaviour or MockBehaviour()
+    servers = [] if host else [MockOllamaServer(behaviour) for _ in range(mock_servers)]
+    if not host:
+        # Bind and release ports, so that connections to them are refused.
+        down_urls = []
+        for _ in range(down_servers):
+            down = MockOllamaServer(behaviour)
+            down_urls.append(down.url)
+            down._httpd.server_close()
+        host = [server.url for server in servers] + down_urls
+    hosts = host if isinstance(host, (list, tuple)) else [host]
+    host = hosts if len(hosts) > 1 else hosts[0]
+    max_in_flight = max_in_flight or MAX_CONCURRENT_DIALOGUES * len(hosts)
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": mode,
+        "max_in_flight": max_in_flight,
+        "is_hash_speakers": is_hash_speakers,
+        "batching": batching,
+        "server": hosts if not servers else {
+            "mock": {key: value for key, value in vars(behaviour).items() if not key.startswith("_")},
+            "servers": len(servers), "down_servers": down_servers,
+        },
+        "import_time": check_import_time(),
+        "approaches": {},
+    }
+    print(f"Import time: {report['import_time']['seconds']:.3f}s "
+          f"(budget {report['import_time']['budget_seconds']:.1f}s)")
+    if report["import_time"]["heavy_modules_loaded"]:
+        print(f"Heavy modules loaded at import: {', '.join(report['import_time']['heavy_modules_loaded'])}")
+
+    for server in servers:
+        server.start()
+    try:
+        for name in approaches:
+            for server in servers:
+                server.reset_stats()
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(
+                    _run_approach, name, host, mode, max_in_flight, is_hash_speakers, batching
+                ).result()
+            if servers:
+                result["server"] = [{key: value for key, value in server.stats().items()
+                                     if key != "requests_by_dialogue"} for server in servers]
+            report["approaches"][name] = result
+            latency = result["latency_seconds"]
+            print(f"{name}: {result['dialogues_per_second']} dialogues/s, "
+                  f"p50 {latency['p50']:.3f}s, p95 {latency['p95']:.3f}s, p99 {latency['p99']:.3f}s, "
+                  f"{result['retries_per_dialogue']['mean']:.2f} retries/dialogue, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+            if result["hosts"]:
+                print("  requests by host: " + ", ".join(
+                    f"{entry['host']} {entry['requests']} ({entry['errors']} errors, {entry['ejections']} ejections)"
+                    for entry in result["hosts"]
+                ))
+    finally:
+        for server in servers:
+            server.stop()
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, f"benchmark_{mode}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark saved to {output_file}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the role-assignment pipeline against a (mock) Ollama server.")
+    parser.add_argument("--approaches", nargs="+", default=list(APPROACHES), choices=APPROACHES)
+    parser.add_argument("--mode", default="test", choices=("test", "train"))
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help=f"default: {MAX_CONCURRENT_DIALOGUES} per server")
+    parser.add_argument("--hash-speakers", action="store_true")
+    parser.add_argument("--batching", action="store_true", help="pack short dialogues into multi-dialogue requests")
+    parser.add_argument("--host", nargs="+", default=None,
+                        help="benchmark real Ollama servers instead of the mock (several hosts are load balanced)")
+    parser.add_argument("--mock-servers", type=int, default=1, help="mock: number of servers to balance across")
+    parser.add_argument("--down-servers", type=int, default=0,
+                        help="mock: extra host addresses that refuse connections")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mock: median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="mock: log-normal shape of the latency")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="mock: generation time per output token")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.0,
+                        help="mock: evaluation time per uncached prompt token")
+    parser.add_argument("--slots", type=int, default=4, help="mock: parallel slots, each caching its last prompt")
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=BENCHMARK_DIR)
+    parser.add_argument("--strict", action="store_true", help="exit with status 1 if the import-time budget is exceeded")
+    args = parser.parse_args()
+
+    behaviour = MockBehaviour(args.latency_ms, args.latency_sigma, args.token_ms, args.slow_rate, args.slow_factor,
+                              args.error_rate, malformed_rate=args.malformed_rate, seed=args.seed,
+                              prompt_token_ms=args.prompt_token_ms, slots=args.slots)
+    report = run_benchmark(args.approaches, args.mode, args.max_in_flight, behaviour, args.host, args.hash_speakers,
+                           args.output_dir, args.batching, args.mock_servers, args.down_servers)
+    if args.strict and not report["import_time"]["within_budget"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from preprocessing import load_split
+from evaluation import ROLES, encode_roles, decode_roles, majority_vote, evaluate, load_predictions
+from config import (
+    TEST_PATH, MANUAL_ANNOTATIONS_PATH, FINAL_SAVE_DIR, EVALUATION_SEED, CASCADE_THRESHOLD, CASCADE_CV_FOLDS
+)
+
+CATEGORICAL_FEATURES = ["Emotion", "Sentiment"]
+NUMERIC_FEATURES = [
+    "Duration", "Words", "Letters", "Utterance_Position", "Relative_Position", "Dialogue_Length",
+    "Dialogue_Speakers", "Speaker_Turns", "Speaker_Share", "Speaker_Order", "Question", "Exclamation",
+]
+ANNOTATOR_COLUMNS = ["Amit Role", "Noa Role", "Guy Role", "Omer Role"]
+# Columns that identify a row of a split, for telling whether the cascade was trained on it.
+ROW_KEY_COLUMNS = ["Dialogue_ID", "Sr No.", "Utterance"]
+
+
+def utterance_features(frame):
+    """
+    Returns the classifier's features for every row of a preprocessed split (see
+    preprocessing.load_split): the utterance's emotion, sentiment, duration and length, its
+    position in the dialogue, and how much of the dialogue its speaker takes part in. Speaker
+    names are left out, so the features are the same for hashed and plain runs.
+    """
+    by_dialogue = frame.groupby("Dialogue_ID")
+    by_speaker = frame.groupby(["Dialogue_ID", "Speaker"])
+    length = by_dialogue["Sr No."].transform("size")
+    turns = by_speaker["Sr No."].transform("size")
+    first_turn = by_speaker["Utterance_Position"].transform("min")
+    utterance = frame["Utterance"].fillna("")
+    return pd.DataFrame({
+        "Emotion": frame["Emotion"].astype(str),
+        "Sentiment": frame["Sentiment"].astype(str),
+        "Duration": frame["Duration"],
+        "Words": frame["Words"],
+        "Letters": frame["Letters"],
+        "Utterance_Position": frame["Utterance_Position"],
+        "Relative_Position": frame["Utterance_Position"] / (length - 1).clip(lower=1),
+        "Dialogue_Length": length,
+        "Dialogue_Speakers": by_dialogue["Speaker"].transform("nunique"),
+        "Speaker_Turns": turns,
+        "Speaker_Share": turns / length,
+        # 0 for the dialogue's first speaker, 1 for the second, ... (the hashed "Person" letter).
+        "Speaker_Order": first_turn.groupby(frame["Dialogue_ID"]).rank(method="dense") - 1,
+        "Question": utterance.str.contains("?", regex=False).astype(int),
+        "Exclamation": utterance.str.contains("!", regex=False).astype(int),
+    }, index=frame.index)
+
+
+def _row_keys(frame):
+    return pd.util.hash_pandas_object(frame[ROW_KEY_COLUMNS], index=False).to_numpy()
+
+
+def _dialogue_predictions(proba, frame):
+    """(roles, confidence, dialogue_confidence) of every row from its role probabilities (see RoleCascade.predict)."""
+    confidence = proba.max(axis=1)
+    dialogue_confidence = pd.Series(confidence, index=frame.index).groupby(frame["Dialogue_ID"]).transform("min")
+    return proba.argmax(axis=1), confidence, dialogue_confidence.to_numpy()
+
+
+def out_of_fold_proba(frame, roles, folds=CASCADE_CV_FOLDS, seed=EVALUATION_SEED):
+    """
+    Role probabilities of every row of frame from a cascade that did not see its dialogue:
+    folds grouped by Dialogue_ID, each predicted by a cascade fitted on the others.
+    """
+    from sklearn.model_selection import GroupKFold
+    roles = np.asarray(roles)
+    proba = np.zeros((len(frame), len(ROLES)))
+    for train, held_out in GroupKFold(n_splits=folds).split(frame, groups=frame["Dialogue_ID"]):
+        proba[held_out] = RoleCascade(seed=seed).fit(frame.iloc[train], roles[train]).predict_proba(frame.iloc[held_out])
+    return proba
+
+
+class RoleCascade:
+    """
+    Cheap first stage in front of the LLM: a gradient-boosted classifier over utterance_features,
+    with isotonic calibration so its probabilities can be thresholded. A dialogue's confidence
+    is that of its least certain utterance; dialogues at or above threshold are answered by the
+    classifier and the rest go to the approach's assign_roles as before. scikit-learn is only
+    imported when the cascade is fitted.
+    A cascade must not answer the dialogues it was trained on: the approaches' results are
+    scored against the same annotations. gate() refuses them unless the cascade was fitted with
+    fit_out_of_fold, in which case they get out-of-fold predictions instead.
+    """
+    def __init__(self, threshold=CASCADE_THRESHOLD, seed=EVALUATION_SEED, calibration_folds=3):
+        self.threshold = threshold
+        self.seed = seed
+        self.calibration_folds = calibration_folds
+        self.model = None
+        self.training_rows = set()
+        self.held_out = None
+
+    def _pipeline(self):
+        from sklearn.calibration import CalibratedClassifierCV
+        from sklearn.compose import ColumnTransformer
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import OneHotEncoder
+        features = ColumnTransformer([
+            ("categories", OneHotEncoder(handle_unknown="ignore", sparse_output=False), CATEGORICAL_FEATURES),
+            ("numbers", "passthrough", NUMERIC_FEATURES),
+        ])
+        classifier = HistGradientBoostingClassifier(
+            max_iter=100, learning_rate=0.1, max_leaf_nodes=15, random_state=self.seed
+        )
+        return CalibratedClassifierCV(make_pipeline(features, classifier), method="isotonic", cv=self.calibration_folds)
+
+    def fit(self, frame, roles):
+        """Fits the classifier on a preprocessed split and its role codes (see evaluation.encode_roles); -1 rows are skipped."""
+        roles = np.asarray(roles)
+        known = roles >= 0
+        self.model = self._pipeline().fit(utterance_features(frame)[known], roles[known])
+        self.training_rows = set(_row_keys(frame).tolist())
+        self.held_out = None
+        return self
+
+    def fit_out_of_fold(self, frame, roles, folds=CASCADE_CV_FOLDS):
+        """
+        fit, plus out-of-fold probabilities for the rows of frame (see out_of_fold_proba), which
+        gate() uses for them in place of the fitted model's, so the training split (the annotated
+        test set) can be gated without scoring the cascade on its own training labels.
+        """
+        self.fit(frame, roles)
+        self.held_out = dict(zip(_row_keys(frame).tolist(), out_of_fold_proba(frame, roles, folds, self.seed)))
+        return self
+
+    def predict_proba(self, frame):
+        """(n_rows, len(ROLES)) calibrated role probabilities, in evaluation.ROLES order."""
+        proba = np.zeros((len(frame), len(ROLES)))
+        proba[:, self.model.classes_] = self.model.predict_proba(utterance_features(frame))
+        return proba
+
+    def predict(self, frame):
+        """
+        Returns (roles, confidence, dialogue_confidence) for every row of frame: the most likely
+        role code, its probability, and the lowest such probability in the row's dialogue.
+        """
+        return _dialogue_predictions(self.predict_proba(frame), frame)
+
+    def gate(self, store, hash_speakers=False):
+        """
+        Returns the CascadeGate of a DialogueStore: the result rows of every dialogue the
+        classifier is confident about, with hashed speaker names when hash_speakers is set.
+        Rows the cascade was trained on get their out-of-fold probabilities; without them (a
+        plain fit on this split), a ValueError is raised.
+        """
+        proba = self.predict_proba(store.frame)
+        keys = _row_keys(store.frame).tolist()
+        seen = np.array([key in self.training_rows for key in keys], dtype=bool)
+        if seen.any():
+            if self.held_out is None:
+                raise ValueError(
+                    f"The cascade was trained on {int(seen.sum())} rows of this split, whose results are "
+                    "scored against the same labels; fit it with fit_out_of_fold to gate them."
+                )
+            proba[seen] = [self.held_out[key] for key, row_seen in zip(keys, seen) if row_seen]
+        roles, confidence, dialogue_confidence = _dialogue_predictions(proba, store.frame)
+        role_names = decode_roles(roles)
+        answers = {}
+        for dialogue in store:
+            if dialogue_confidence[dialogue.start] < self.threshold:
+                continue
+            speakers = dialogue.hashed_speakers if hash_speakers else dialogue.speakers_list
+            answers[dialogue.dialogue_id] = [{
+                "Sr No.": sr_no,
+                "Speaker": speaker,
+                "Role": role,
+                "Justification": f"Cascade classifier (confidence {probability:.2f}).",
+                "Dialogue_ID": dialogue.dialogue_id,
+                "Prompt": None,
+                "Response": None,
+            } for sr_no, speaker, role, probability in zip(
+                dialogue.sr_no_list, speakers, role_names[dialogue.start:dialogue.stop].tolist(),
+                confidence[dialogue.start:dialogue.stop].tolist()
+            )]
+        return CascadeGate(answers, len(store))
+
+
+class CascadeGate:
+    """
+    Dialogues answered by a RoleCascade ({dialogue_id: rows}), for process_dialogues. Their
+    checkpoint fingerprints include the classifier's answer, so turning the cascade off (or
+    a classifier that answers differently) sends them back to the LLM on resume.
+    """
+    def __init__(self, answers, dialogues):
+        self.answers = answers
+        self.dialogues = dialogues
+
+    def __contains__(self, dialogue_id):
+        return dialogue_id in self.answers
+
+    def fingerprint(self, dialogue_id, fingerprint):
+        roles = [row["Role"] for row in self.answers[dialogue_id]]
+        return hashlib.sha256(f"cascade:{fingerprint}:{json.dumps(roles)}".encode("utf-8")).hexdigest()
+
+
+def load_annotations(annotations_path=MANUAL_ANNOTATIONS_PATH, split_path=TEST_PATH, seed=EVALUATION_SEED):
+    """Returns the preprocessed annotated split and the annotators' majority role codes, row for row."""
+    frame = load_split(split_path)
+    annotated = pd.read_csv(annotations_path).set_index("Sr No.")
+    votes = annotated.reindex(frame["Sr No."])[ANNOTATOR_COLUMNS]
+    return frame, majority_vote(encode_roles(votes), seed)
+
+
+def cascade_report(frame, truth, llm_roles=None, thresholds=(0.5, 0.6, 0.7, 0.8, 0.9, 0.95),
+                   folds=CASCADE_CV_FOLDS, seed=EVALUATION_SEED):
+    """
+    Measures the cascade on annotated data with out-of-fold predictions (folds grouped by
+    Dialogue_ID, so no dialogue is scored by a classifier trained on it). For every threshold:
+    the share of dialogues (one LLM call each) the classifier answers, its accuracy on them,
+    and the accuracy, macro F1 and Cohen's kappa against truth of the cascade (classifier where
+    confident, llm_roles elsewhere) next to those of llm_roles alone. Without llm_roles only
+    the classifier's figures are reported.
+    """
+    truth = np.asarray(truth)
+    roles, _, dialogue_confidence = _dialogue_predictions(out_of_fold_proba(frame, truth, folds, seed), frame)
+
+    dialogues = frame["Dialogue_ID"].nunique()
+    known = truth >= 0
+    rows = []
+    for threshold in thresholds:
+        answered = dialogue_confidence >= threshold
+        row = {
+            "threshold": threshold,
+            "dialogues_answered": frame.loc[answered, "Dialogue_ID"].nunique(),
+            "llm_calls_saved": frame.loc[answered, "Dialogue_ID"].nunique() / dialogues,
+            "utterances_answered": int(answered.sum()),
+            "classifier_accuracy": np.mean(roles[answered & known] == truth[answered & known])
+            if (answered & known).any() else np.nan,
+        }
+        if llm_roles is not None:
+            llm = encode_roles(llm_roles)
+            row["llm_accuracy_on_answered"] = np.mean(llm[answered & known] == truth[answered & known]) \
+                if (answered & known).any() else np.nan
+            scores, _, _ = evaluate(truth, {"cascade": np.where(answered, roles, llm), "llm": llm}, n_bootstrap=0)
+            for metric in ("accuracy", "macro_f1", "kappa"):
+                row[f"cascade_{metric}"] = scores.loc["cascade", metric]
+                row[f"llm_{metric}"] = scores.loc["llm", metric]
+            row["accuracy_loss"] = row["llm_accuracy"] - row["cascade_accuracy"]
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("threshold")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the LLM calls the cascade saves and the agreement it costs on the annotated test set."
+    )
+    parser.add_argument("--llm", default="approach2",
+                        help="approach whose test predictions the cascade falls back to (e.g. approach1)")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
+    parser.add_argument("--folds", type=int, default=CASCADE_CV_FOLDS)
+    args = parser.parse_args()
+
+    frame, truth = load_annotations()
+    llm_roles = load_predictions([args.llm], frame["Sr No."], results_dir=FINAL_SAVE_DIR, speakers=frame["Speaker"]).get(args.llm)
+    report = cascade_report(frame, truth, llm_roles, args.thresholds, args.folds)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.round(3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+
+def config_fingerprint(model_instance):
+    """
+    Returns a hash of everything in an approach that shapes its prompts and outputs:
+    the approach class, speaker hashing, roles description, template, output format, model name
+    and prompt window settings.
+    """
+    client = getattr(model_instance, "client", None)
+    config = {
+        "approach": type(model_instance).__name__,
+        "is_hash_speakers": model_instance.is_hash_speakers,
+        "roles_description": model_instance.roles_description,
+        "template": getattr(model_instance, "template", None),
+        "response_format": getattr(model_instance, "response_format", None),
+        "model": getattr(client, "model", None),
+    }
+    if getattr(model_instance, "window_tokens", None) is not None:
+        # Only windowed runs add the key, so the hashes of existing runs are unchanged.
+        config["window"] = [model_instance.window_tokens, model_instance.window_overlap]
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def dialogue_fingerprint(group, config_hash, extra=None):
+    """
+    Returns a hash of one dialogue's input rows combined with the approach config hash.
+    extra holds any other JSON-serializable prompt input (e.g. Approach 3's connection summary).
+    """
+    return rows_fingerprint(pd.util.hash_pandas_object(group, index=False).values, config_hash, extra)
+
+
+def rows_fingerprint(row_hashes, config_hash, extra=None):
+    """dialogue_fingerprint from already computed per-row hashes (see dialogue_store.DialogueStore)."""
+    digest = hashlib.sha256(config_hash.encode("utf-8"))
+    digest.update(row_hashes.tobytes())
+    if extra is not None:
+        digest.update(json.dumps(extra, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CheckpointManifest:
+    """
+    Per-output-file record of which dialogues are done.
+    Lives next to the output CSV as `<name>.manifest.jsonl`; each line records a
+    Dialogue_ID's status ("ok" / "error"), how many times it was attempted and the
+    fingerprint it was produced with. The file is read once into a dict, so checking a
+    dialogue costs O(1), and updates are appended (the latest line per dialogue wins).
+    Lines are not fsynced, so after a crash the manifest can list dialogues whose rows never
+    reached the results store; process_dialogues re-runs those.
+    """
+    def __init__(self, output_file):
+        self.path = os.path.splitext(output_file)[0] + ".manifest.jsonl"
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["Dialogue_ID"]] = entry
+
+    def __contains__(self, dialogue_id):
+        return dialogue_id in self.entries
+
+    def is_complete(self, dialogue_id, fingerprint):
+        """True when the dialogue finished successfully with the same inputs and config."""
+        entry = self.entries.get(dialogue_id)
+        return entry is not None and entry["status"] == "ok" and entry["fingerprint"] == fingerprint
+
+    def record(self, dialogue_id, status, fingerprint):
+        """Appends the outcome of one attempt at a dialogue."""
+        previous = self.entries.get(dialogue_id)
+        entry = {
+            "Dialogue_ID": dialogue_id.item() if hasattr(dialogue_id, "item") else dialogue_id,
+            "status": status,
+            "attempts": (previous["attempts"] if previous else 0) + 1,
+            "fingerprint": fingerprint,
+        }
+        self.entries[dialogue_id] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
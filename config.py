@@ -6,6 +6,8 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 RESULTS_DIR = os.path.join(BASE_DIR, "results")
 FINAL_SAVE_DIR = os.path.join(RESULTS_DIR, "Approaches Annotations")
 MANUAL_ANNOTATIONS_DIR = os.path.join(RESULTS_DIR, "Manual Annotations")
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+BENCHMARK_DIR = os.path.join(RESULTS_DIR, "benchmarks")
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -18,8 +20,113 @@ MANUAL_ANNOTATIONS_PATH = os.path.join(MANUAL_ANNOTATIONS_DIR, "annotated_test_s
 # Ollama model name
 OLLAMA_MODEL = "mistral"
 
+# Models compared by orchestrator.py. OLLAMA_MODEL writes its results to FINAL_SAVE_DIR,
+# every other model to a subdirectory of it named after the model.
+ORCHESTRATOR_MODELS = [OLLAMA_MODEL]
+
+# Ollama server address (None uses the OLLAMA_HOST environment variable or localhost:11434).
+# A list of addresses spreads the dialogues across several servers, e.g.
+# ["http://gpu1:11434", "http://gpu2:11434"]; MAX_CONCURRENT_DIALOGUES then applies per server.
+OLLAMA_HOST = None
+
+# Size of the keep-alive HTTP connection pool to each Ollama server
+OLLAMA_MAX_CONNECTIONS = 8
+
+# With several servers, a server is taken out of rotation after this many consecutive
+# failures, for this many seconds (doubling while it keeps failing)
+OLLAMA_HOST_EJECT_FAILURES = 3
+OLLAMA_HOST_EJECT_SECONDS = 30.0
+
+# How long Ollama keeps the model (and its cached prompt prefix) loaded after each request
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Evaluate the static prompt prefix (roles description) on the server once per worker before a run
+LLM_WARM_PREFIX = True
+
+# Retry policy for LLM calls: per-attempt timeout, attempts on transient errors and backoff bounds
+LLM_TIMEOUT_SECONDS = 300.0
+LLM_MAX_ATTEMPTS = 4
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 30.0
+
+# Circuit breaker: pause the run after this many consecutive transient failures, probe again
+# after the reset window, and stop the run if the server stays unhealthy past the give-up window
+LLM_CIRCUIT_FAILURE_THRESHOLD = 5
+LLM_CIRCUIT_RESET_SECONDS = 30.0
+LLM_CIRCUIT_GIVE_UP_SECONDS = 600.0
+
+# On-disk LLM response cache (set LLM_CACHE_ENABLED = False to always query the model)
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_responses.sqlite")
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Ask Ollama to constrain role-assignment responses to the JSON schema in response_parser.py
+LLM_STRUCTURED_OUTPUT = True
+
+# Stream role-assignment responses and cancel the generation as soon as the output is invalid
+LLM_STREAMING = True
+
+# Maximum number of dialogues sent to Ollama at the same time.
+# Match this to the server's OLLAMA_NUM_PARALLEL setting.
+MAX_CONCURRENT_DIALOGUES = 4
+
+# Dispatch order of the dialogues in a run (scheduler.py): "lpt" (longest first), "spt" or "fifo"
+SCHEDULER_PRIORITY = "lpt"
+
+# Cost model used to order dialogues and to plan runs: rough throughput of one server slot,
+# fixed time per request, and output tokens expected per labelled utterance
+LLM_PROMPT_TOKENS_PER_SECOND = 500.0
+LLM_OUTPUT_TOKENS_PER_SECOND = 25.0
+LLM_REQUEST_OVERHEAD_SECONDS = 0.2
+LLM_OUTPUT_TOKENS_PER_UTTERANCE = 40
+
+# Multi-dialogue batching (Approach 2): pack short dialogues into one request, up to this
+# many estimated tokens of utterances and this many dialogues per request
+BATCH_DIALOGUES = False
+BATCH_TOKEN_BUDGET = 1024
+BATCH_MAX_DIALOGUES = 8
+
+# Sliding-window prompting (Approaches 2 and 3): dialogues whose utterances exceed this many
+# estimated tokens are labelled in consecutive windows of at most that size, each repeating
+# the last PROMPT_WINDOW_OVERLAP utterances before it and a rolling summary of the earlier
+# turns (None sends every dialogue in one prompt)
+PROMPT_WINDOW_TOKENS = None
+PROMPT_WINDOW_OVERLAP = 2
+
+# Number of finished dialogues between fsyncs of the append-only results file. Lines are
+# flushed as each dialogue finishes, so only a power loss or OS crash can lose data: at most
+# the last RESULTS_FSYNC_EVERY - 1 dialogues, which re-run on resume. Closing the store
+# (the end of a run, or an exception) always fsyncs.
+RESULTS_FSYNC_EVERY = 20
+
+# Write the full prompt, response and justification on every row of the output CSV (its
+# original shape). Setting it to False opts into slim CSVs whose `<column>_ref` columns hold
+# keys into the run's `.texts.jsonl` side table instead of the texts
+RESULTS_CSV_WITH_TEXTS = True
+
+# Budget for importing the approach modules (checked by benchmark.py); heavy dependencies
+# such as torch, langchain and ollama must only be imported when they are used
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+
 # Hugging Face Token (ask user at runtime)
 # HF_TOKEN = input("Enter your Hugging Face API token: ").strip()
 # HF_TOKEN = "enter_your_HF_token_here"
 
 VALID_ROLES = {'Protagonist', 'Supporter', 'Neutral', 'Gatekeeper', 'Attacker'}
+
+# Evaluation (evaluation.py): seed for majority-vote tie-breaking and bootstrap resampling,
+# number of bootstrap resamples and confidence level of the intervals
+EVALUATION_SEED = 42
+EVALUATION_BOOTSTRAP_SAMPLES = 2000
+EVALUATION_CONFIDENCE = 0.95
+
+# Cascade (cascade.py): a dialogue is answered by the local classifier, without an LLM call,
+# when every utterance's calibrated role probability is at least CASCADE_THRESHOLD;
+# CASCADE_CV_FOLDS grouped folds are used to measure it on the annotated test set
+CASCADE_THRESHOLD = 0.7
+CASCADE_CV_FOLDS = 5
+
+# Manual annotations (annotation_store.py): SQLite database the annotation notebook saves each
+# label to, and the annotators, in the column order of the exported MANUAL_ANNOTATIONS_PATH
+ANNOTATION_DB_PATH = os.path.join(MANUAL_ANNOTATIONS_DIR, "annotations.sqlite")
+ANNOTATORS = ["Guy", "Amit", "Noa", "Omer"]
@@ -0,0 +1,112 @@
+def _label_percentages(df, keys, column):
+    """
+    Returns {key tuple: [(label, percent), ...]} with the share of each label of `column`
+    within every key group, most frequent first.
+    """
+    shares = (
+        df.groupby(keys)[column].value_counts(normalize=True).mul(100).round(1)
+        .rename("Percent").reset_index()
+        .sort_values(keys + ["Percent", column], ascending=[True] * len(keys) + [False, True])
+    )
+    key_tuples = list(zip(*(shares[key] for key in keys)))
+    labelled = zip(shares[column], shares["Percent"])
+    percentages = {}
+    for key, (label, percent) in zip(key_tuples, labelled):
+        percentages.setdefault(key, []).append((label, float(percent)))
+    return percentages
+
+
+def _summaries(df, keys, speaker_columns):
+    """Aggregates duration/words/letters means and sentiment/emotion shares for every key group."""
+    means = df.groupby(keys)[["Duration", "Words", "Letters"]].mean()
+    sentiments = _label_percentages(df, keys, "Sentiment")
+    emotions = _label_percentages(df, keys, "Emotion")
+    summaries = {}
+    for key, (duration, words, letters) in zip(means.index, means.itertuples(index=False)):
+        key = key if isinstance(key, tuple) else (key,)
+        entry = dict(zip(speaker_columns, key[-len(speaker_columns):]))
+        entry.update({
+            "Response_Duration": float(duration),
+            "Words_in_Response": float(words),
+            "Letters_in_Response": float(letters),
+            "Sentiment_in_Response": sentiments.get(key, []),
+            "Emotion_in_Response": emotions.get(key, []),
+        })
+        summaries[key] = entry
+    return summaries
+
+
+class ConnectionIndex:
+    """
+    Precomputed connection statistics for Approach 3, built in one vectorized pass.
+    For every group (by default each (Season, Episode)) it holds:
+      - per speaker pair: how a speaker responds to another one (average response duration,
+        words, letters and sentiment/emotion percentages), where the speaker being responded
+        to is the last different speaker earlier in the same dialogue;
+      - per participant: the same statistics over all of the speaker's utterances in the group.
+    summary_for() turns a dialogue into the connection_summary dict expected by
+    Approach3.generate_prompt with dictionary lookups only.
+    """
+    def __init__(self, df, group_by=("Season", "Episode")):
+        self.group_by = list(group_by)
+        df = df.sort_values(self.group_by + ["Dialogue_ID", "Utterance_ID"]).copy()
+        # Word and letter counts come precomputed from preprocessing.load_split when available.
+        if "Words" not in df.columns:
+            df["Words"] = df["Utterance"].str.split().str.len().fillna(0)
+        if "Letters" not in df.columns:
+            df["Letters"] = df["Utterance"].str.count(r"[A-Za-z]").fillna(0)
+
+        # Who responds to whom: the previous speaker in the dialogue, skipping consecutive turns by the same speaker.
+        previous = df.groupby("Dialogue_ID")["Speaker"].shift()
+        previous = previous.where(previous != df["Speaker"])
+        df["Speaker_Responded_To"] = previous.groupby(df["Dialogue_ID"]).ffill()
+        df["Speaker_Response"] = df["Speaker"]
+
+        responses = df[df["Speaker_Responded_To"].notna()]
+        pair_keys = self.group_by + ["Speaker_Response", "Speaker_Responded_To"]
+        participant_keys = self.group_by + ["Speaker_Response"]
+
+        n_group = len(self.group_by)
+        self.connections = {}
+        for key, entry in _summaries(responses, pair_keys, ["Speaker_Response", "Speaker_Responded_To"]).items():
+            self.connections.setdefault(key[:n_group], {}).setdefault(key[n_group], []).append(entry)
+        self.participants = {}
+        for key, entry in _summaries(df, participant_keys, ["Speaker_Response"]).items():
+            self.participants.setdefault(key[:n_group], {})[key[n_group]] = entry
+
+        # Dialogue_ID -> group key, so callers only need the dialogue.
+        first_rows = df.drop_duplicates("Dialogue_ID")
+        self.dialogue_groups = dict(zip(
+            first_rows["Dialogue_ID"], zip(*(first_rows[column] for column in self.group_by))
+        ))
+
+    def summary_for(self, dialogue_id, speakers, name_map=None):
+        """
+        Returns the connection summary for one dialogue, restricted to its speakers.
+        name_map (e.g. the hashed-speaker mapping) renames speakers in the output.
+        """
+        group_key = self.dialogue_groups.get(dialogue_id)
+        if group_key is None:
+            return None
+        speakers = list(dict.fromkeys(speakers))
+        speaker_set = set(speakers)
+        rename = (lambda name: name_map.get(name, name)) if name_map else (lambda name: name)
+
+        connection_summary = []
+        group_connections = self.connections.get(group_key, {})
+        for speaker in speakers:
+            for entry in group_connections.get(speaker, []):
+                if entry["Speaker_Responded_To"] in speaker_set:
+                    connection_summary.append(dict(
+                        entry,
+                        Speaker_Response=rename(entry["Speaker_Response"]),
+                        Speaker_Responded_To=rename(entry["Speaker_Responded_To"]),
+                    ))
+
+        participants_summary = []
+        group_participants = self.participants.get(group_key, {})
+        for speaker in speakers:
+            if speaker in group_participants:
+                participants_summary.append(dict(group_participants[speaker], Speaker_Response=rename(speaker)))
+
+        return {"Connection_Summary": connection_summary, "Participants_Summary": participants_summary}
@@ -0,0 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import tqdm
+from results_store import ResultsStore
+from checkpoint import CheckpointManifest
+from telemetry import format_summary
+from scheduler import format_plan
+from config import MAX_CONCURRENT_DIALOGUES
+
+
+def run_dialogues(jobs, process_dialogue, max_in_flight=1, desc="Processing dialogues"):
+    """
+    Runs process_dialogue over every job with at most max_in_flight calls outstanding at once.
+    Each job is a (dialogue_id, payload) tuple; process_dialogue receives the payload.
+    Yields (dialogue_id, result) tuples in completion order, so the caller can persist each
+    dialogue as soon as it finishes. With max_in_flight=1 the jobs run sequentially in order.
+    """
+    jobs = list(jobs)
+    progress = tqdm.tqdm(total=len(jobs), desc=desc)
+    try:
+        if max_in_flight <= 1:
+            for dialogue_id, payload in jobs:
+                result = process_dialogue(payload)
+                progress.update(1)
+                yield dialogue_id, result
+            return
+
+        pending_jobs = iter(jobs)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            def submit_next():
+                for dialogue_id, payload in pending_jobs:
+                    in_flight[executor.submit(process_dialogue, payload)] = dialogue_id
+                    return True
+                return False
+
+            for _ in range(max_in_flight):
+                if not submit_next():
+                    break
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dialogue_id = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        # Abort the run: drop the queued work and let the error propagate.
+                        for other in in_flight:
+                            other.cancel()
+                        raise
+                    submit_next()
+                    progress.update(1)
+                    yield dialogue_id, result
+    finally:
+        progress.close()
+
+
+class DialogueBatcher:
+    """
+    Packs short dialogues into multi-dialogue LLM requests.
+    Jobs are taken in order and packed greedily while the estimated tokens of the packed
+    dialogues stay within token_budget and the batch holds at most max_dialogues; a dialogue
+    estimated above half the budget always goes alone. process_batch(payloads) returns
+    {dialogue_id: rows} for a batch; single-dialogue batches use process_dialogue(payload).
+    """
+    def __init__(self, process_batch, process_dialogue, estimate_tokens, token_budget, max_dialogues):
+        self.process_batch = process_batch
+        self.process_dialogue = process_dialogue
+        self.estimate_tokens = estimate_tokens
+        self.token_budget = token_budget
+        self.max_dialogues = max_dialogues
+
+    def pack(self, jobs):
+        """Groups (dialogue_id, payload) jobs into a list of batches."""
+        batches = []
+        batch, batch_tokens = [], 0
+        for dialogue_id, payload in jobs:
+            tokens = self.estimate_tokens(payload)
+            if tokens > self.token_budget / 2:
+                batches.append([(dialogue_id, payload)])
+                continue
+            if batch and (batch_tokens + tokens > self.token_budget or len(batch) >= self.max_dialogues):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append((dialogue_id, payload))
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __call__(self, batch):
+        if len(batch) == 1:
+            dialogue_id, payload = batch[0]
+            return {dialogue_id: self.process_dialogue(payload)}
+        return self.process_batch([payload for _, payload in batch])
+
+
+def default_max_in_flight(client):
+    """MAX_CONCURRENT_DIALOGUES for each Ollama server the client spreads its requests across."""
+    return MAX_CONCURRENT_DIALOGUES * len(client.hosts)
+
+
+def _status(rows):
+    return "ok" if all(row["Role"] != "Error" for row in rows) else "error"
+
+
+def process_dialogues(jobs, process_dialogue, output_file, max_in_flight=1, desc="Processing dialogues",
+                      telemetry=None, batcher=None, warm_up=None, scheduler=None, dry_run=False, gate=None):
+    """
+    Runs every job whose dialogue is not already complete and stores the results.
+    Each job is a (dialogue_id, fingerprint, payload) tuple. A dialogue is skipped when the
+    checkpoint manifest records it as "ok" with the same fingerprint and the results store holds
+    its rows (after a crash the manifest may be ahead of the last fsync of the store); errored
+    dialogues and dialogues whose input rows or approach config changed are re-run. Finished dialogues are
+    appended to the results store as they complete, and the CSV is exported once at the end.
+    When a RunTelemetry is given, its trace is open for the duration of the run and its
+    summary is printed at the end. With a DialogueBatcher, the dialogues to run are packed into
+    batches first, and each batch is one unit of work. warm_up(workers) is called before the
+    first job when there is work to do (e.g. to have the server evaluate the static prompt prefix).
+    A DialogueScheduler sets the dispatch order of the dialogues (longest first by default).
+    With dry_run, nothing is sent to the LLM: the scheduler's plan for the dialogues left to run
+    (estimated tokens and wall-clock time, without batching) is printed and returned instead.
+    With a cascade.CascadeGate, the dialogues it answers are stored without an LLM call.
+    """
+    store = ResultsStore(output_file)
+    manifest = CheckpointManifest(output_file)
+
+    stored = {dialogue_id: _status(rows) for dialogue_id, rows in store.stored_rows().items()}
+
+    # Adopt results written before the manifest existed, assuming the current config produced them.
+    if not manifest.entries:
+        fingerprints = {dialogue_id: fingerprint for dialogue_id, fingerprint, _ in jobs}
+        for dialogue_id, status in stored.items():
+            if dialogue_id in fingerprints:
+                manifest.record(dialogue_id, status, fingerprints[dialogue_id])
+
+    fingerprints = {}
+    pending = []
+    answered = []
+    for dialogue_id, fingerprint, payload in jobs:
+        if gate is not None and dialogue_id in gate:
+            fingerprint = gate.fingerprint(dialogue_id, fingerprint)
+        if manifest.is_complete(dialogue_id, fingerprint) and stored.get(dialogue_id) == "ok":
+            continue
+        fingerprints[dialogue_id] = fingerprint
+        if gate is not None and dialogue_id in gate:
+            answered.append(dialogue_id)
+        else:
+            pending.append((dialogue_id, payload))
+    if gate is not None:
+        print(f"Cascade: {len(gate.answers)} of {gate.dialogues} dialogues answered without the LLM "
+              f"({len(answered)} to store, {len(pending)} left for the LLM)", flush=True)
+
+    if dry_run:
+        if scheduler is None:
+            raise ValueError("A dry run needs a scheduler to estimate the dialogues' cost.")
+        plan = scheduler.plan(pending, max_in_flight)
+        print(format_plan(plan))
+        return plan
+    if scheduler is not None:
+        pending = scheduler.order(pending)
+
+    if batcher is not None:
+        work = [(tuple(dialogue_id for dialogue_id, _ in batch), batch) for batch in batcher.pack(pending)]
+        process_work = batcher
+    else:
+        work = [(dialogue_id, (dialogue_id, payload)) for dialogue_id, payload in pending]
+        process_work = lambda job: {job[0]: process_dialogue(job[1])}
+
+    if warm_up is not None and work:
+        warm_up(min(max_in_flight, len(work)))
+
+    if telemetry is not None:
+        telemetry.open(output_file)
+    try:
+        with store:
+            for dialogue_id in answered:
+                store.append(dialogue_id, gate.answers[dialogue_id])
+                manifest.record(dialogue_id, "ok", fingerprints[dialogue_id])
+            for _, results in run_dialogues(work, process_work, max_in_flight, desc=desc):
+                for dialogue_id, rows in results.items():
+                    store.append(dialogue_id, rows)
+                    manifest.record(dialogue_id, _status(rows), fingerprints[dialogue_id])
+    finally:
+        if telemetry is not None:
+            print(format_summary(telemetry.close()))
+
+    results_df = store.export_csv()
+    print(f"Results saved to {output_file}")
+    return results_df
@@ -0,0 +1,165 @@
+import os
+import numpy as np
+import pandas as pd
+from functools import cached_property
+from preprocessing import load_split
+from checkpoint import rows_fingerprint
+from connection_summary import ConnectionIndex
+
+# Columns hashed into a dialogue's fingerprint by Approaches 1 and 2.
+DIALOGUE_COLUMNS = ["Sr No.", "Dialogue_ID", "Speaker", "Utterance"]
+
+
+class DialogueStore:
+    """
+    Read-only columnar view of a preprocessed split, for building per-dialogue jobs.
+    Utterance columns are held as contiguous NumPy arrays, and dialogue i spans rows
+    offsets[i]:offsets[i + 1] (load_split keeps every dialogue contiguous). Speakers are interned
+    as integer IDs, and each utterance's hashed speaker ("Person A", "Person B", ... in order of
+    first appearance within its dialogue, as BaseRoleApproach._hash_speakers names them) is
+    precomputed for the whole split at once. Iterating yields a DialogueView per dialogue, whose
+    arrays are slices of the store's (no copies).
+    """
+    def __init__(self, df):
+        self.frame = df
+        dialogue_ids = df["Dialogue_ID"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, dialogue_ids[1:] != dialogue_ids[:-1]])
+        self.dialogue_ids = dialogue_ids[starts]
+        if len(np.unique(self.dialogue_ids)) != len(self.dialogue_ids):
+            raise ValueError("Dialogues must be contiguous; load the split with preprocessing.load_split.")
+        self.offsets = np.r_[starts, len(df)]
+        self.sr_no = df["Sr No."].to_numpy()
+        self.utterances = df["Utterance"].to_numpy(dtype=object)
+        self.durations = df["Duration"].to_numpy() if "Duration" in df.columns else None
+        self.speaker_ids, speaker_names = pd.factorize(df["Speaker"])
+        self.speaker_names = np.asarray(speaker_names, dtype=object)
+        # Every row of a speaker refers to the same string object.
+        self.speakers = self.speaker_names[self.speaker_ids]
+
+        # Hashed speaker IDs: the rank of each (dialogue, speaker) pair's first row within its dialogue.
+        lengths = np.diff(self.offsets)
+        pair = np.repeat(np.arange(len(starts)), lengths) * (len(self.speaker_names) + 1) + self.speaker_ids
+        first_seen = ~pd.Series(pair).duplicated().to_numpy()
+        seen_so_far = np.cumsum(first_seen)
+        rank = seen_so_far - np.repeat(seen_so_far[starts], lengths)
+        self.hashed_ids = pd.Series(rank[first_seen], index=pair[first_seen]).reindex(pair).to_numpy()
+        self.hashed_names = np.array(
+            [f"Person {chr(ord('A') + k)}" for k in range(rank.max() + 1 if len(df) else 0)], dtype=object
+        )
+        self._dialogue_ids = self.dialogue_ids.tolist()
+        self._positions = {dialogue_id: i for i, dialogue_id in enumerate(self._dialogue_ids)}
+        self._row_hashes = {}
+        self._connection_indexes = {}
+
+    def __len__(self):
+        return len(self.dialogue_ids)
+
+    def __iter__(self):
+        return (DialogueView(self, i) for i in range(len(self)))
+
+    def __getitem__(self, dialogue_id):
+        return DialogueView(self, self._positions[dialogue_id])
+
+    def row_hashes(self, columns=None):
+        """
+        Per-row hashes of the given columns (all by default), computed once for the whole split;
+        a dialogue's slice equals hashing its group on its own, so fingerprints are unchanged.
+        """
+        key = tuple(columns) if columns is not None else None
+        if key not in self._row_hashes:
+            frame = self.frame[list(columns)] if columns is not None else self.frame
+            self._row_hashes[key] = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+        return self._row_hashes[key]
+
+    def connection_index(self, group_by):
+        """The split's ConnectionIndex for group_by, built on first use and shared by later runs."""
+        key = tuple(group_by)
+        if key not in self._connection_indexes:
+            self._connection_indexes[key] = ConnectionIndex(self.frame, list(group_by))
+        return self._connection_indexes[key]
+
+
+class DialogueView:
+    """
+    One dialogue of a DialogueStore. sr_no, speakers, utterances, durations, speaker_ids and
+    hashed_ids are array slices of the store; the list forms the approaches' prompt builders
+    and validators take (conversation, sr_no_list, ...) are built once, on first use.
+    """
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.dialogue_id = store._dialogue_ids[index]
+        self.start, self.stop = store.offsets[index], store.offsets[index + 1]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def sr_no(self):
+        return self.store.sr_no[self.start:self.stop]
+
+    @property
+    def speakers(self):
+        return self.store.speakers[self.start:self.stop]
+
+    @property
+    def utterances(self):
+        return self.store.utterances[self.start:self.stop]
+
+    @property
+    def durations(self):
+        return self.store.durations[self.start:self.stop]
+
+    @property
+    def speaker_ids(self):
+        return self.store.speaker_ids[self.start:self.stop]
+
+    @property
+    def hashed_ids(self):
+        return self.store.hashed_ids[self.start:self.stop]
+
+    @cached_property
+    def sr_no_list(self):
+        return self.sr_no.tolist()
+
+    @cached_property
+    def speakers_list(self):
+        return self.speakers.tolist()
+
+    @cached_property
+    def duration_list(self):
+        return self.durations.tolist()
+
+    @cached_property
+    def conversation(self):
+        """(Speaker, Utterance) tuples, as the prompt builders take them."""
+        return list(zip(self.speakers.tolist(), self.utterances.tolist()))
+
+    @cached_property
+    def hashed_speakers(self):
+        """Hashed speaker name of every utterance, as returned by BaseRoleApproach._hash_speakers."""
+        return self.store.hashed_names[self.hashed_ids].tolist()
+
+    @cached_property
+    def name_map(self):
+        """Speaker name -> hashed name, as returned by BaseRoleApproach._hash_speakers."""
+        return dict(zip(self.speakers_list, self.hashed_speakers))
+
+    def fingerprint(self, config_hash, columns=None, extra=None):
+        """Same value as checkpoint.dialogue_fingerprint of the dialogue's group (restricted to columns)."""
+        return rows_fingerprint(self.store.row_hashes(columns)[self.start:self.stop], config_hash, extra)
+
+
+_stores = {}
+
+
+def load_dialogues(path):
+    """
+    Returns the DialogueStore of a split, built once per process (and again only when the
+    CSV changes), so repeated process_data calls do not reload or regroup the data.
+    """
+    key = (path, os.path.getmtime(path))
+    if key not in _stores:
+        _stores.clear()
+        _stores[key] = DialogueStore(load_split(path))
+    return _stores[key]
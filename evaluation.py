@@ -0,0 +1,221 @@
+import os
+import numpy as np
+import pandas as pd
+from config import (
+    VALID_ROLES, FINAL_SAVE_DIR, EVALUATION_SEED, EVALUATION_BOOTSTRAP_SAMPLES, EVALUATION_CONFIDENCE
+)
+
+# Role order of the integer codes; -1 marks a missing or invalid role.
+ROLES = sorted(VALID_ROLES)
+
+
+def encode_roles(values, roles=ROLES):
+    """
+    Returns the integer codes (index into roles) of a Series, array or DataFrame of role
+    names; missing values and names outside roles become -1. A DataFrame gives an
+    (n_rows, n_columns) array.
+    """
+    if isinstance(values, pd.DataFrame):
+        return np.column_stack([encode_roles(values[column], roles) for column in values.columns])
+    return pd.Categorical(np.asarray(values, dtype=object), categories=roles).codes.astype(np.int64)
+
+
+def decode_roles(codes, roles=ROLES):
+    """Maps integer codes back to role names (NaN for -1)."""
+    codes = np.asarray(codes)
+    return np.where(codes >= 0, np.asarray(roles, dtype=object)[np.maximum(codes, 0)], np.nan)
+
+
+def _counts(codes, n_roles):
+    """(n_rows, n_roles) number of votes per role in each row of an (n_rows, n_raters) code array."""
+    codes = np.asarray(codes)
+    rows = np.repeat(np.arange(len(codes)), codes.shape[1])
+    flat = codes.ravel()
+    valid = flat >= 0
+    counts = np.zeros((len(codes), n_roles), dtype=np.int64)
+    np.add.at(counts, (rows[valid], flat[valid]), 1)
+    return counts
+
+
+def majority_vote(codes, seed=EVALUATION_SEED, n_roles=len(ROLES)):
+    """
+    Majority role per row of an (n_rows, n_raters) code array, ignoring missing votes.
+    Ties are broken uniformly at random among the tied roles with a generator seeded by seed,
+    so the result is reproducible; rows without any vote get -1.
+    """
+    counts = _counts(codes, n_roles)
+    top = counts.max(axis=1, keepdims=True)
+    tied = (counts == top) & (top > 0)
+    noise = np.random.default_rng(seed).random(counts.shape)
+    winner = np.where(tied, noise, -1.0).argmax(axis=1)
+    return np.where(top[:, 0] > 0, winner, -1)
+
+
+def confusion_matrix(truth, predicted, roles=ROLES):
+    """
+    Confusion matrix over the rows with a known truth: rows are true roles, columns predicted
+    roles, plus an "Invalid" column for predictions that are missing or not a valid role.
+    """
+    truth, predicted = np.asarray(truth), np.asarray(predicted)
+    known = truth >= 0
+    n_roles = len(roles)
+    # Invalid predictions (-1) go to the last column.
+    cells = truth[known] * (n_roles + 1) + np.where(predicted[known] >= 0, predicted[known], n_roles)
+    matrix = np.bincount(cells, minlength=n_roles * (n_roles + 1)).reshape(n_roles, n_roles + 1)
+    return pd.DataFrame(matrix, index=list(roles), columns=list(roles) + ["Invalid"])
+
+
+def cohen_kappa(a, b):
+    """Cohen's kappa between two code arrays, over the rows where both have a valid role."""
+    a, b = np.asarray(a), np.asarray(b)
+    both = (a >= 0) & (b >= 0)
+    a, b = a[both], b[both]
+    if not len(a):
+        return np.nan
+    n_roles = max(a.max(), b.max()) + 1
+    observed = np.mean(a == b)
+    expected = np.dot(np.bincount(a, minlength=n_roles), np.bincount(b, minlength=n_roles)) / len(a) ** 2
+    return (observed - expected) / (1 - expected) if expected < 1 else np.nan
+
+
+def pairwise_cohen_kappa(codes, names):
+    """Cohen's kappa for every pair of columns of an (n_rows, n_raters) code array, as a DataFrame."""
+    codes = np.asarray(codes)
+    kappas = np.ones((len(names), len(names)))
+    for i in range(len(names)):
+        for j in range(i + 1, len(names)):
+            kappas[i, j] = kappas[j, i] = cohen_kappa(codes[:, i], codes[:, j])
+    return pd.DataFrame(kappas, index=names, columns=names)
+
+
+def fleiss_kappa(codes, n_roles=len(ROLES)):
+    """Fleiss' kappa of an (n_rows, n_raters) code array, over the rows every rater labelled."""
+    codes = np.asarray(codes)
+    codes = codes[(codes >= 0).all(axis=1)]
+    if not len(codes) or codes.shape[1] < 2:
+        return np.nan
+    raters = codes.shape[1]
+    counts = _counts(codes, n_roles)
+    agreement = ((counts * (counts - 1)).sum(axis=1) / (raters * (raters - 1))).mean()
+    shares = counts.sum(axis=0) / counts.sum()
+    expected = np.dot(shares, shares)
+    return (agreement - expected) / (1 - expected) if expected < 1 else np.nan
+
+
+def _weighted_metrics(truth, predicted, weights, n_roles):
+    """
+    Accuracy, macro F1 and Cohen's kappa of every prediction row against truth, for every
+    row of weights (how many times each item is drawn; all ones for the plain estimate).
+    truth is (n,), predicted (n_variants, n) and weights (n_samples, n); each metric comes
+    back as an (n_variants, n_samples) array. Everything reduces to matrix products of
+    indicator arrays with the weights, so thousands of resamples cost a few BLAS calls.
+    """
+    weights = weights.astype(np.float64).T
+    total = weights.sum(axis=0)
+    truth_onehot = (truth[:, None] == np.arange(n_roles)).astype(np.float64)
+    predicted_onehot = (predicted[:, :, None] == np.arange(n_roles)).astype(np.float64)
+    correct_onehot = predicted_onehot * truth_onehot[None]
+
+    support = truth_onehot.T @ weights
+    predicted_counts = _per_class(predicted_onehot, weights)
+    true_positives = _per_class(correct_onehot, weights)
+
+    accuracy = true_positives.sum(axis=1) / total
+    denominator = predicted_counts + support[None]
+    f1 = np.divide(2 * true_positives, denominator, out=np.zeros_like(denominator), where=denominator > 0)
+    expected = (predicted_counts * support[None]).sum(axis=1) / total ** 2
+    kappa = (accuracy - expected) / (1 - expected)
+    return {"accuracy": accuracy, "macro_f1": f1.mean(axis=1), "kappa": kappa, "f1": f1}
+
+
+def _per_class(onehot, weights):
+    """(n_variants, n, n_roles) indicators times (n, n_samples) weights -> (n_variants, n_roles, n_samples)."""
+    variants, n, n_roles = onehot.shape
+    product = onehot.transpose(0, 2, 1).reshape(variants * n_roles, n) @ weights
+    return product.reshape(variants, n_roles, -1)
+
+
+def bootstrap_weights(n_items, n_samples, rng):
+    """(n_samples, n_items) draw counts of n_samples bootstrap resamples of n_items items."""
+    draws = rng.integers(0, n_items, size=(n_samples, n_items))
+    offsets = np.arange(n_samples)[:, None] * n_items
+    return np.bincount((draws + offsets).ravel(), minlength=n_samples * n_items).reshape(n_samples, n_items)
+
+
+def evaluate(truth, predictions, n_bootstrap=EVALUATION_BOOTSTRAP_SAMPLES, confidence=EVALUATION_CONFIDENCE,
+             seed=EVALUATION_SEED, roles=ROLES, chunk_size=500):
+    """
+    Scores every approach in predictions ({name: code array}) against the truth codes.
+    Returns (metrics, per_class_f1, confusion): metrics has one row per approach with
+    accuracy, macro F1 and Cohen's kappa, each with a percentile bootstrap confidence interval
+    (n_bootstrap resamples of the rows, drawn with a seeded generator), plus the number of
+    scored rows and of invalid predictions; per_class_f1 has the F1 of every role; confusion
+    maps each approach to its confusion_matrix. Rows without a truth are left out.
+    """
+    names = list(predictions)
+    truth = np.asarray(truth)
+    known = truth >= 0
+    truth = truth[known]
+    predicted = np.vstack([np.asarray(predictions[name])[known] for name in names])
+    n_roles = len(roles)
+
+    point = _weighted_metrics(truth, predicted, np.ones((1, len(truth))), n_roles)
+    metrics = pd.DataFrame({
+        "accuracy": point["accuracy"][:, 0], "macro_f1": point["macro_f1"][:, 0], "kappa": point["kappa"][:, 0],
+    }, index=names)
+
+    if n_bootstrap:
+        rng = np.random.default_rng(seed)
+        samples = {"accuracy": [], "macro_f1": [], "kappa": []}
+        for start in range(0, n_bootstrap, chunk_size):
+            weights = bootstrap_weights(len(truth), min(chunk_size, n_bootstrap - start), rng)
+            resampled = _weighted_metrics(truth, predicted, weights, n_roles)
+            for metric in samples:
+                samples[metric].append(resampled[metric])
+        tail = (1 - confidence) / 2 * 100
+        for metric, values in samples.items():
+            low, high = np.nanpercentile(np.hstack(values), [tail, 100 - tail], axis=1)
+            metrics[f"{metric}_low"] = low
+            metrics[f"{metric}_high"] = high
+
+    metrics["rows"] = len(truth)
+    metrics["invalid"] = (predicted < 0).sum(axis=1)
+    columns = ["accuracy", "accuracy_low", "accuracy_high", "macro_f1", "macro_f1_low", "macro_f1_high",
+               "kappa", "kappa_low", "kappa_high", "rows", "invalid"]
+    metrics = metrics[[column for column in columns if column in metrics.columns]]
+    per_class_f1 = pd.DataFrame(point["f1"][:, :, 0], index=names, columns=list(roles))
+    confusion = {name: confusion_matrix(truth, predicted[i], roles) for i, name in enumerate(names)}
+    return metrics, per_class_f1, confusion
+
+
+def load_predictions(file_names, sr_no, mode="test", results_dir=FINAL_SAVE_DIR, speakers=None):
+    """
+    Reads the Role column of each approach's output CSV (`{mode}_{file_name}.csv`) and aligns
+    it with sr_no. Approach 1 returns one row per dialogue: a single speaker (the one the
+    model named, else the dialogue's first speaker) and role, with the whole dialogue's Sr No.
+    comma-joined. Such a row is only scored on the utterances of its own speaker, which needs
+    speakers (the speaker of every sr_no); without them, joined rows are left unscored.
+    Returns {file_name: Series of roles}; missing files are reported and skipped.
+    """
+    index = pd.Index(sr_no)
+    speaker_of = pd.Series(list(speakers), index=index) if speakers is not None else None
+    predictions = {}
+    for file_name in file_names:
+        file_path = os.path.join(results_dir, f"{mode}_{file_name}.csv")
+        if not os.path.exists(file_path):
+            print(f"No results for {file_name} at {file_path}; skipped.")
+            continue
+        df = pd.read_csv(file_path, usecols=lambda column: column in ("Sr No.", "Speaker", "Role"))
+        if not pd.api.types.is_numeric_dtype(df["Sr No."]):
+            joined = df["Sr No."].astype(str).str.contains(",", regex=False)
+            df = df.assign(**{"Sr No.": df["Sr No."].astype(str).str.split(","), "Joined": joined}).explode("Sr No.")
+            df["Sr No."] = pd.to_numeric(df["Sr No."], errors="coerce")
+            if speaker_of is not None and "Speaker" in df.columns:
+                own = df["Speaker"].to_numpy() == speaker_of.reindex(df["Sr No."]).to_numpy()
+                df = df[~df["Joined"] | own]
+            else:
+                df = df[~df["Joined"]]
+        # The last label of an utterance wins, as with the dict mapping this replaces.
+        roles = df.drop_duplicates("Sr No.", keep="last").set_index("Sr No.")["Role"]
+        predictions[file_name] = roles.reindex(index).reset_index(drop=True)
+    return predictions
@@ -0,0 +1,137 @@
+import time
+import threading
+from retry_policy import is_transient
+from config import OLLAMA_HOST_EJECT_FAILURES, OLLAMA_HOST_EJECT_SECONDS
+
+
+class _Host:
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+        self.async_client = None
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self._backoff_level = 0
+
+
+class HostPool:
+    """
+    Spreads generate requests over several Ollama servers.
+    Each request goes to the healthy host with the fewest outstanding requests (ties go to the
+    host with fewer recent failures, then fewer requests served), so faster servers take more
+    of the work. A host is ejected for eject_seconds after eject_after consecutive transient
+    failures (doubling on every re-ejection, up to max_eject_seconds); when the time is up it
+    gets a single probe request, and a success puts it back in rotation. If every host is
+    ejected, the one due back first is used, and the RetryPolicy's circuit breaker decides
+    when to give up. Streamed responses count as outstanding until the stream is closed.
+    Exposes generate/agenerate like ollama.Client, so LLMClient uses it in place of a client.
+    """
+    def __init__(self, hosts, limits=None, timeout=None, eject_after=OLLAMA_HOST_EJECT_FAILURES,
+                 eject_seconds=OLLAMA_HOST_EJECT_SECONDS, max_eject_seconds=600.0):
+        from ollama import Client
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._limits = limits
+        self._timeout = timeout
+        self._hosts = [_Host(url, Client(host=url, limits=limits, timeout=timeout)) for url in hosts]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._hosts)
+
+    @property
+    def hosts(self):
+        return [host.url for host in self._hosts]
+
+    @property
+    def last_host(self):
+        """URL of the host that served the calling thread's latest request."""
+        return getattr(self._local, "last_host", None)
+
+    def _acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            # A host back from ejection only takes one request at a time until it succeeds.
+            candidates = [host for host in self._hosts if host.ejected_until <= now
+                          and (host.failures < self.eject_after or host.outstanding == 0)]
+            if not candidates:
+                candidates = [min(self._hosts, key=lambda host: host.ejected_until)]
+            host = min(candidates, key=lambda host: (host.outstanding, host.failures, host.requests))
+            host.outstanding += 1
+            host.requests += 1
+        self._local.last_host = host.url
+        return host
+
+    def _release(self, host, error=None):
+        with self._lock:
+            host.outstanding -= 1
+            if error is None or not is_transient(error):
+                # The host answered; errors about the request itself say nothing about its health.
+                host.failures = 0
+                host._backoff_level = 0
+                return
+            host.errors += 1
+            host.failures += 1
+            now = time.monotonic()
+            # Requests sent before the host was taken out do not extend its ejection.
+            if host.failures < self.eject_after or host.ejected_until > now:
+                return
+            timeout = min(self.eject_seconds * 2 ** host._backoff_level, self.max_eject_seconds)
+            host.ejected_until = now + timeout
+            host._backoff_level += 1
+            host.ejections += 1
+        print(f"Ollama host {host.url} taken out for {timeout:g}s after {host.failures} consecutive failures: "
+              f"{error}", flush=True)
+
+    def generate(self, **kwargs):
+        """Runs ollama.Client.generate on the least loaded healthy host."""
+        host = self._acquire()
+        try:
+            result = host.client.generate(**kwargs)
+        except Exception as e:
+            self._release(host, e)
+            raise
+        if kwargs.get("stream"):
+            return self._streamed(host, result)
+        self._release(host)
+        return result
+
+    def _streamed(self, host, stream):
+        error = None
+        try:
+            yield from stream
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(host, error)
+
+    async def agenerate(self, **kwargs):
+        """Async variant of generate (non-streaming), backed by one pooled AsyncClient per host."""
+        host = self._acquire()
+        if host.async_client is None:
+            from ollama import AsyncClient
+            host.async_client = AsyncClient(host=host.url, limits=self._limits, timeout=self._timeout)
+        try:
+            result = await host.async_client.generate(**kwargs)
+        except Exception as e:
+            self._release(host, e)
+            raise
+        self._release(host)
+        return result
+
+    def stats(self):
+        """Per-host counters: requests served, transient errors, ejections and current health."""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {"host": host.url, "requests": host.requests, "errors": host.errors, "ejections": host.ejections,
+                 "outstanding": host.outstanding, "healthy": host.ejected_until <= now}
+                for host in self._hosts
+            ]
@@ -0,0 +1,372 @@
+import os
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import VALID_ROLES, OLLAMA_MODEL
+
+# Utterance lines as written by the approaches' prompts, e.g.
+# 'Sr No. 12, Ross: "Hi"' or 'Sr No. 12, Speaker_3 (1.25s): "Hi"'.
+_UTTERANCE_LINE = re.compile(r'^Sr No\. (\d+), (.+?)(?: \([\d.]+s\))?: "', re.MULTILINE)
+_DIALOGUE_ID = re.compile(r"Dialogue_ID (\d+)")
+# Multi-dialogue (batched) prompts start each dialogue with this header line.
+_BATCH_HEADER = re.compile(r"^Dialogue_ID (\d+):$", re.MULTILINE)
+# Repair prompts list the utterances still to label after this marker.
+_REPAIR_MARKER = "Assign roles only to these utterances"
+_MALFORMED_KINDS = ("prose", "truncated", "wrong_speaker", "code")
+
+
+class MockBehaviour:
+    """
+    How the mock server answers. Every request waits for a time-to-first-token drawn from a
+    log-normal distribution (median latency_ms, shape latency_sigma) plus token_ms per output
+    token; a slow_rate share of requests is slow_factor times slower. An error_rate share fails
+    with one of error_statuses, and a malformed_rate share returns unusable output (prose,
+    truncated JSON, a wrong speaker or code). All draws come from one seeded generator.
+    Prompt evaluation costs prompt_token_ms per token not already cached: like Ollama, the
+    server keeps the last prompt of each of its `slots` and reuses the longest shared prefix.
+    One model is resident at a time: a request for another model (or after a keep_alive=0
+    request unloaded it) waits model_load_ms for the swap and starts with an empty prompt cache.
+    """
+    def __init__(self, latency_ms=50.0, latency_sigma=0.5, token_ms=0.0, slow_rate=0.0, slow_factor=10.0,
+                 error_rate=0.0, error_statuses=(503,), malformed_rate=0.0, seed=0, prompt_token_ms=0.0, slots=4,
+                 model_load_ms=0.0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.token_ms = token_ms
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.malformed_rate = malformed_rate
+        self.prompt_token_ms = prompt_token_ms
+        self.slots = slots
+        self.model_load_ms = model_load_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Returns (error_status or None, malformed kind or None, ttft seconds, seconds per token)."""
+        with self._lock:
+            error = self._random.choice(self.error_statuses) if self._random.random() < self.error_rate else None
+            malformed = self._random.choice(_MALFORMED_KINDS) if self._random.random() < self.malformed_rate else None
+            ttft = self._random.lognormvariate(0.0, self.latency_sigma) * self.latency_ms / 1000 \
+                if self.latency_ms > 0 else 0.0
+            slowdown = self.slow_factor if self._random.random() < self.slow_rate else 1.0
+        return error, malformed, ttft * slowdown, self.token_ms * slowdown / 1000
+
+    def pick_role(self):
+        with self._lock:
+            return self._random.choice(sorted(VALID_ROLES))
+
+
+def build_response(prompt, behaviour, format=None, malformed=None):
+    """
+    Builds the text an instruction-following model would return for one of the approaches'
+    prompts: one row per utterance in the prompt (only the missing ones for repair prompts),
+    or a single speaker object for the Approach 1 baseline. Rows of batched prompts carry their
+    Dialogue_ID. `malformed` spoils the output.
+    """
+    if malformed == "prose":
+        return "Sure! Here is an analysis of the conversation. The first speaker leads the discussion."
+    if malformed == "code":
+        return "```python\nroles = {}\nfor speaker in speakers:\n    roles[speaker] = 'Neutral'\n```"
+
+    section = prompt.split(_REPAIR_MARKER, 1)[1] if _REPAIR_MARKER in prompt else prompt
+    utterances = _UTTERANCE_LINE.findall(section)
+    if '"speaker_name":' in prompt:
+        speaker = utterances[0][1] if utterances else "Unknown"
+        text = json.dumps({"speaker_name": speaker, "role": behaviour.pick_role(),
+                           "justification": "Mock justification."})
+    else:
+        rows = [
+            {"Sr No.": int(sr_no), "Speaker": speaker, "Role": behaviour.pick_role(),
+             "Justification": "Mock justification."}
+            for sr_no, speaker in utterances
+        ]
+        headers = list(_BATCH_HEADER.finditer(section))
+        if headers:
+            sr_no_owners = {}
+            for header, next_header in zip(headers, headers[1:] + [None]):
+                block = section[header.end():next_header.start() if next_header else len(section)]
+                for sr_no, _ in _UTTERANCE_LINE.findall(block):
+                    sr_no_owners[int(sr_no)] = int(header.group(1))
+            rows = [dict(row, Dialogue_ID=sr_no_owners.get(row["Sr No."])) for row in rows]
+        if malformed == "wrong_speaker" and rows:
+            rows[0]["Speaker"] = rows[0]["Speaker"] + "_unknown"
+        if isinstance(format, dict):
+            text = json.dumps({"utterances": rows}, indent=2)
+        else:
+            text = "\n".join(json.dumps(row) for row in rows)
+    if malformed == "truncated":
+        text = text[:max(1, len(text) // 2)]
+    return text
+
+
+def _tokens(text):
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class MockOllamaServer:
+    """
+    Local stand-in for an Ollama server, for benchmarks and offline runs.
+    Speaks the parts of the Ollama HTTP API the pipeline uses: POST /api/generate and
+    /api/chat (streaming and non-streaming), GET /api/tags and /api/version. Responses follow
+    MockBehaviour, including the per-slot prompt-prefix cache, so prompt_eval_count and
+    prompt_eval_duration only cover the uncached part of each prompt, as with Ollama.
+    Counters in stats() include the number of requests per Dialogue_ID, so callers can count
+    retries without instrumenting the client.
+    Use as a context manager: the server runs in a daemon thread until the block exits.
+    """
+    def __init__(self, behaviour=None, host="127.0.0.1", port=0, model=OLLAMA_MODEL):
+        self.behaviour = behaviour or MockBehaviour()
+        self.model = model
+        self._lock = threading.Lock()
+        self._slots = [("", 0)] * max(self.behaviour.slots, 1)
+        self._slot_uses = 0
+        self._resident = None
+        self.reset_stats()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_stats(self):
+        with self._lock:
+            self.counters = Counter()
+            self.requests_by_dialogue = Counter()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["requests_by_dialogue"] = dict(self.requests_by_dialogue)
+        return stats
+
+    def _count(self, name, dialogue_id=None):
+        with self._lock:
+            self.counters[name] += 1
+            if dialogue_id is not None:
+                self.requests_by_dialogue[dialogue_id] += 1
+
+    def _claim_slot(self, prompt):
+        """
+        Returns how many leading characters of prompt are already evaluated in the best-matching
+        slot (least recently used on ties), and keeps prompt in that slot.
+        """
+        with self._lock:
+            self._slot_uses += 1
+            matches = [(len(os.path.commonprefix([cached, prompt])), -last_used, index)
+                       for index, (cached, last_used) in enumerate(self._slots)]
+            cached_chars, _, index = max(matches)
+            self._slots[index] = (prompt, self._slot_uses)
+        return cached_chars
+
+    def _load(self, model, keep_alive):
+        """
+        Makes model the resident one and returns the seconds the swap takes (0 if it is already
+        loaded). keep_alive=0 unloads it after the request, as Ollama does.
+        """
+        with self._lock:
+            load_seconds = 0.0
+            if self._resident != model:
+                self.counters["model_loads"] += 1
+                self._resident = model
+                self._slots = [("", 0)] * len(self._slots)
+                load_seconds = self.behaviour.model_load_ms / 1000
+            if keep_alive in (0, "0", "0s"):
+                self.counters["model_unloads"] += 1
+                self._resident = None
+        return load_seconds
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately; without this, Nagle's algorithm adds ~40 ms per response.
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionResetError:
+                # The client dropped an idle keep-alive connection (e.g. its process exited).
+                self.close_connection = True
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_chunk(self, payload):
+            data = (json.dumps(payload) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json(200, {"models": [{"name": server.model, "model": server.model}]})
+            elif self.path == "/api/version":
+                self._send_json(200, {"version": "mock"})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": "invalid JSON body"})
+                return
+            if self.path == "/api/generate":
+                prompt = request.get("prompt") or ""
+            elif self.path == "/api/chat":
+                messages = request.get("messages") or []
+                prompt = "\n".join(str(message.get("content") or "") for message in messages)
+            else:
+                self._send_json(404, {"error": "not found"})
+                return
+
+            match = _DIALOGUE_ID.search(prompt)
+            server._count("requests", int(match.group(1)) if match else None)
+            behaviour = server.behaviour
+            if self.path == "/api/generate" and not prompt and request.get("keep_alive") in (0, "0", "0s"):
+                # An unload request: Ollama answers at once, without generating.
+                with server._lock:
+                    if server._resident == request.get("model"):
+                        server.counters["model_unloads"] += 1
+                        server._resident = None
+                self._send_json(200, {"model": request.get("model"), "response": "", "done": True,
+                                      "done_reason": "unload"})
+                return
+            load_seconds = server._load(request.get("model") or server.model, request.get("keep_alive"))
+            error, malformed, ttft, token_seconds = behaviour.draw()
+            ttft += load_seconds
+            prompt_eval_count = _tokens(prompt[server._claim_slot(prompt):])
+            prompt_eval_seconds = prompt_eval_count * behaviour.prompt_token_ms / 1000
+            time.sleep(ttft + prompt_eval_seconds)
+            if error is not None:
+                server._count("errors")
+                self._send_json(error, {"error": f"mock error {error}"})
+                return
+            if malformed is not None:
+                server._count(f"malformed_{malformed}")
+
+            text = build_response(prompt, behaviour, request.get("format"), malformed)
+            num_predict = (request.get("options") or {}).get("num_predict")
+            if num_predict is not None and num_predict >= 0:
+                text = text[:num_predict * 4]
+            eval_count = _tokens(text)
+            started = time.perf_counter()
+            final = {
+                "model": request.get("model") or server.model,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "done": True,
+                "done_reason": "stop",
+                "load_duration": int(ttft * 1e9),
+                "prompt_eval_count": prompt_eval_count,
+                "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+                "eval_count": eval_count,
+            }
+            chat = self.path == "/api/chat"
+
+            def content(piece):
+                return {"message": {"role": "assistant", "content": piece}} if chat else {"response": piece}
+
+            if request.get("stream", True):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for start in range(0, len(text), 4):
+                        time.sleep(token_seconds)
+                        self._send_chunk(dict(content(text[start:start + 4]), model=final["model"],
+                                              created_at=final["created_at"], done=False))
+                    eval_seconds = time.perf_counter() - started
+                    self._send_chunk(dict(final, **content(""), eval_duration=int(eval_seconds * 1e9),
+                                          total_duration=int((ttft + prompt_eval_seconds + eval_seconds) * 1e9)))
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the generation.
+                    server._count("cancelled")
+                    self.close_connection = True
+                return
+
+            time.sleep(token_seconds * eval_count)
+            eval_seconds = time.perf_counter() - started
+            self._send_json(200, dict(final, **content(text), eval_duration=int(eval_seconds * 1e9),
+                                      total_duration=int((ttft + prompt_eval_seconds + eval_seconds) * 1e9)))
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal shape of the latency")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="generation time per output token")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.0, help="evaluation time per uncached prompt token")
+    parser.add_argument("--slots", type=int, default=4, help="parallel slots, each caching its last prompt")
+    parser.add_argument("--model-load-ms", type=float, default=0.0, help="time to swap in another model")
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    behaviour = MockBehaviour(args.latency_ms, args.latency_sigma, args.token_ms, args.slow_rate, args.slow_factor,
+                              args.error_rate, malformed_rate=args.malformed_rate, seed=args.seed,
+                              prompt_token_ms=args.prompt_token_ms, slots=args.slots,
+                              model_load_ms=args.model_load_ms)
+    server = MockOllamaServer(behaviour, args.host, args.port)
+    print(f"Mock Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
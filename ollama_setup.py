@@ -1,14 +1,285 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from config import OLLAMA_MODEL
+import time
+import threading
+from llm_cache import ResponseCache
+from retry_policy import RetryPolicy, GenerationAborted, AttemptTimeout
+from config import OLLAMA_MODEL, OLLAMA_HOST, OLLAMA_MAX_CONNECTIONS, OLLAMA_KEEP_ALIVE, LLM_CACHE_ENABLED
+
+
+class LLMClient:
+    """
+    Long-lived Ollama client shared by all approaches.
+    Prompt templates are compiled once per template string, and requests reuse pooled
+    keep-alive HTTP connections instead of opening a new client on every call.
+    Responses are served from the on-disk ResponseCache when use_cache is True, and every
+    request runs under the RetryPolicy (per-attempt timeout, backoff, circuit breaker).
+    langchain_core, ollama and httpx are imported when the first client is created, so
+    importing this module (and the approaches) stays cheap.
+    Timings and token counts of each thread's latest invoke are kept in last_call for telemetry.
+    Every request asks Ollama to keep the model loaded for keep_alive, so the server's prompt
+    cache (the evaluated prefix shared with the previous prompt in each slot) survives between
+    calls; see warm_prefix.
+    host may be a list of servers: requests are then spread across them by a HostPool (least
+    outstanding requests first, failing servers taken out of rotation).
+    """
+    def __init__(self, model=OLLAMA_MODEL, host=OLLAMA_HOST, max_connections=OLLAMA_MAX_CONNECTIONS,
+                 use_cache=LLM_CACHE_ENABLED, cache=None, retry_policy=None, keep_alive=OLLAMA_KEEP_ALIVE):
+        self.model = model
+        self.host = host
+        self.hosts = list(host) if isinstance(host, (list, tuple)) else [host]
+        self.keep_alive = keep_alive
+        self.cache = (cache or ResponseCache()) if use_cache else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        import httpx
+        from ollama import Client
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = httpx.Timeout(self.retry_policy.timeout, connect=min(10.0, self.retry_policy.timeout))
+        if len(self.hosts) > 1:
+            from host_pool import HostPool
+            self._client = HostPool(self.hosts, self._limits, self._timeout)
+        else:
+            self._client = Client(host=self.hosts[0], limits=self._limits, timeout=self._timeout)
+        self._async_client = None
+        self._templates = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def last_call(self):
+        """
+        Metrics of the calling thread's latest invoke: cached, host, http_attempts, prompt_tokens (as
+        evaluated by the server, i.e. without a cached prefix), prompt_eval_seconds,
+        response_tokens, ttft_seconds, server_seconds, latency_seconds, and for streamed calls
+        the abort reason and the estimated generation time saved (None when unknown).
+        """
+        return getattr(self._local, "last_call", None)
+
+    def _get_template(self, template):
+        """Returns the compiled ChatPromptTemplate for a template string, compiling it on first use."""
+        compiled = self._templates.get(template)
+        if compiled is None:
+            with self._lock:
+                compiled = self._templates.get(template)
+                if compiled is None:
+                    from langchain_core.prompts import ChatPromptTemplate
+                    compiled = ChatPromptTemplate.from_template(template)
+                    self._templates[template] = compiled
+        return compiled
+
+    def render(self, question, template):
+        """Renders the final prompt text exactly as the `prompt | OllamaLLM` chain would send it."""
+        return self._get_template(template).format_prompt(question=question).to_string()
+
+    def invoke(self, question, template, use_cache=True, format=None, check=None):
+        """
+        Runs a question through the Ollama model and returns the response text.
+        format is passed through to Ollama ("json" or a JSON schema dict) to constrain the output.
+        With a check (e.g. response_parser.StreamingRowValidator) the response is streamed and
+        check(text) is called as it grows; when it returns a reason, the generation is cancelled
+        and GenerationAborted is raised with the partial text. Aborted responses are not cached.
+        """
+        call = {"cached": False, "host": None, "http_attempts": 0, "prompt_tokens": None, "prompt_eval_seconds": None,
+                "response_tokens": None,
+                "ttft_seconds": None, "server_seconds": None, "latency_seconds": None,
+                "streamed": check is not None, "aborted": None, "saved_seconds": None}
+        self._local.last_call = call
+        started = time.perf_counter()
+        key = self._cache_key(question, template, format) if use_cache else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                call["cached"] = True
+                call["latency_seconds"] = time.perf_counter() - started
+                return cached
+
+        def generate(**kwargs):
+            call["http_attempts"] += 1
+            try:
+                return self._client.generate(**kwargs)
+            finally:
+                call["host"] = self._last_host()
+
+        try:
+            if check is not None:
+                response = self.retry_policy.call(
+                    self._stream, call, check, model=self.model, prompt=self.render(question, template), format=format,
+                    keep_alive=self.keep_alive
+                )
+            else:
+                result = self.retry_policy.call(
+                    generate, model=self.model, prompt=self.render(question, template), format=format,
+                    keep_alive=self.keep_alive
+                )
+                call.update(_server_metrics(result))
+                response = result["response"]
+        finally:
+            call["latency_seconds"] = time.perf_counter() - started
+        if key is not None:
+            self.cache.put(key, self.model, response)
+        return response
+
+    def _stream(self, call, check, **kwargs):
+        """
+        Runs one streamed generation and returns its text, checking the output as it arrives.
+        On abort, the connection is closed (which stops the generation on the server) and the
+        generation time saved is estimated from the speed so far and check.expected_chars.
+        A generation still running after the retry policy's timeout is cancelled the same way
+        and AttemptTimeout is raised, so the policy retries it.
+        """
+        call["http_attempts"] += 1
+        started = time.perf_counter()
+        deadline = started + self.retry_policy.timeout
+        first_token = None
+        pieces = []
+        try:
+            stream = self._client.generate(stream=True, **kwargs)
+        finally:
+            call["host"] = self._last_host()
+        try:
+            for chunk in stream:
+                piece = chunk.get("response") or ""
+                if chunk.get("done"):
+                    pieces.append(piece)
+                    metrics = _server_metrics(chunk)
+                    metrics.pop("ttft_seconds")
+                    call.update(metrics)
+                    break
+                if time.perf_counter() > deadline:
+                    raise AttemptTimeout(
+                        f"Streamed generation exceeded {self.retry_policy.timeout:g}s; cancelled."
+                    )
+                if not piece:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    call["ttft_seconds"] = first_token - started
+                pieces.append(piece)
+                text = "".join(pieces)
+                reason = check(text)
+                if reason:
+                    expected_chars = getattr(check, "expected_chars", None)
+                    generating = time.perf_counter() - first_token
+                    if expected_chars is not None and generating > 0:
+                        remaining = max(expected_chars(text) - len(text), 0)
+                        call["saved_seconds"] = remaining * generating / len(text)
+                    call["aborted"] = reason
+                    raise GenerationAborted(reason, text)
+        finally:
+            stream.close()
+        return "".join(pieces)
+
+    async def ainvoke(self, question, template, use_cache=True, format=None):
+        """Async variant of invoke, backed by a pooled AsyncClient."""
+        key = self._cache_key(question, template, format) if use_cache else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if len(self.hosts) > 1:
+            generate = self._client.agenerate
+        else:
+            if self._async_client is None:
+                from ollama import AsyncClient
+                self._async_client = AsyncClient(host=self.hosts[0], limits=self._limits, timeout=self._timeout)
+            generate = self._async_client.generate
+        response = await self.retry_policy.acall(
+            generate, model=self.model, prompt=self.render(question, template), format=format,
+            keep_alive=self.keep_alive
+        )
+        response = response["response"]
+        if key is not None:
+            self.cache.put(key, self.model, response)
+        return response
+
+    def warm_prefix(self, prefix, template, copies=1):
+        """
+        Loads the model and has the server evaluate the static start of the prompts (the template
+        up to `prefix`, rendered exactly as in invoke) once per slot, so later prompts starting
+        with it only pay for their own text. Run `copies` requests concurrently to warm one slot
+        per parallel worker; with several hosts, the concurrent requests spread across them.
+        Best effort: failures are reported and otherwise ignored.
+        """
+        prompt = self.render(prefix, template)
+
+        def warm():
+            try:
+                self.retry_policy.call(self._client.generate, model=self.model, prompt=prompt,
+                                       options={"num_predict": 1}, keep_alive=self.keep_alive)
+            except Exception as e:
+                print(f"Prompt prefix warm-up failed: {e}", flush=True)
+
+        threads = [threading.Thread(target=warm) for _ in range(copies)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def unload(self):
+        """
+        Asks every server to unload the model now (keep_alive=0) rather than when keep_alive runs
+        out, so the next model does not have to share memory with it. Best effort, like warm_prefix.
+        """
+        from ollama import Client
+        for host in self.hosts:
+            try:
+                Client(host=host, timeout=self._timeout).generate(model=self.model, prompt="", keep_alive=0)
+            except Exception as e:
+                print(f"Unloading {self.model} from {host or 'the default server'} failed: {e}", flush=True)
+
+    def _last_host(self):
+        return getattr(self._client, "last_host", self.hosts[0])
+
+    def host_stats(self):
+        """Per-host request, error and ejection counts when several hosts are used, otherwise None."""
+        return self._client.stats() if len(self.hosts) > 1 else None
+
+    def _cache_key(self, question, template, format=None):
+        if self.cache is None:
+            return None
+        return ResponseCache.key(self.model, template, question, {"format": format} if format else None)
+
+    def discard(self, question, template, format=None):
+        """
+        Drops the cached response for a request, so that a retry after a response
+        failed validation asks the model again instead of replaying the same answer.
+        """
+        key = self._cache_key(question, template, format)
+        if key is not None:
+            self.cache.discard(key)
+
+
+def _server_metrics(result):
+    """
+    Token counts and timings reported by Ollama for a generation. Without streaming, the time
+    to first token is the server's model load plus prompt evaluation time.
+    """
+    prompt_eval = result.get("prompt_eval_duration")
+    total = result.get("total_duration")
+    return {
+        "prompt_tokens": result.get("prompt_eval_count"),
+        "prompt_eval_seconds": prompt_eval / 1e9 if prompt_eval is not None else None,
+        "response_tokens": result.get("eval_count"),
+        "ttft_seconds": ((result.get("load_duration") or 0) + prompt_eval) / 1e9 if prompt_eval is not None else None,
+        "server_seconds": total / 1e9 if total is not None else None,
+    }
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide LLMClient, creating it on first use."""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = LLMClient()
+    return _shared_client
+
 
 def run_llm(question, template):
     """Runs a question through the Ollama model."""
-    prompt = ChatPromptTemplate.from_template(template)
-    model = OllamaLLM(model=OLLAMA_MODEL)
-    chain = prompt | model
-    response = chain.invoke({"question": question})
-    return response
+    return get_client().invoke(question, template)
 
 
 if __name__ == "__main__":
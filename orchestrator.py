@@ -0,0 +1,145 @@
+import os
+import re
+import time
+import argparse
+from config import OLLAMA_MODEL, OLLAMA_HOST, ORCHESTRATOR_MODELS, FINAL_SAVE_DIR, TRAIN_PATH, TEST_PATH
+from dialogue_store import load_dialogues
+
+APPROACHES = ["approach1", "approach2", "approach3"]
+
+
+class RunVariant:
+    """
+    One cell of the run matrix: an approach, with or without speaker hashing, on one model.
+    file_name is the name analysis.py reads its results under (e.g. "approach2_hashed").
+    """
+    def __init__(self, approach, hashed, model=OLLAMA_MODEL):
+        if approach not in APPROACHES:
+            raise ValueError(f"Unknown approach {approach!r}; expected one of {APPROACHES}.")
+        if hashed and approach == "approach1":
+            raise ValueError("Approach 1 does not support speaker hashing.")
+        self.approach = approach
+        self.hashed = hashed
+        self.model = model
+
+    @property
+    def file_name(self):
+        return f"{self.approach}{'_hashed' if self.hashed else ''}"
+
+    def __repr__(self):
+        return f"RunVariant({self.file_name}, {self.model})"
+
+
+def variant_matrix(approaches=APPROACHES, hashing=(False, True), models=ORCHESTRATOR_MODELS):
+    """Every (approach, hashing, model) combination; Approach 1 only runs unhashed."""
+    return [
+        RunVariant(approach, hashed, model)
+        for model in models for approach in approaches for hashed in hashing
+        if not (hashed and approach == "approach1")
+    ]
+
+
+def plan_runs(variants):
+    """
+    Groups the variants by model, in order of first appearance, so each model is loaded once
+    and serves all its variants before the next one; returns [(model, [variants])].
+    """
+    groups = {}
+    for variant in variants:
+        groups.setdefault(variant.model, []).append(variant)
+    return list(groups.items())
+
+
+def model_results_dir(model, results_dir=FINAL_SAVE_DIR, default_model=OLLAMA_MODEL):
+    """
+    Output directory of a model's runs: results_dir itself for default_model (the files
+    analysis.py reads), otherwise a subdirectory named after the model, with the same file names.
+    """
+    if model == default_model:
+        return results_dir
+    return os.path.join(results_dir, re.sub(r"[^\w.-]+", "_", model))
+
+
+def run_variant(variant, client, mode="test", output_dir=FINAL_SAVE_DIR, max_retries=5, group_by=("Episode", "Season"),
+                dry_run=False):
+    """Runs one variant with the given client through its approach's process_data."""
+    if variant.approach == "approach1":
+        from approach1 import SpeakerRoleBaseline, process_data
+        return process_data(mode, SpeakerRoleBaseline(client=client), "approach1", output_dir=output_dir,
+                            dry_run=dry_run)
+    if variant.approach == "approach2":
+        from approach2 import Approach2, process_data
+        instance = Approach2(max_retries, is_hash_speakers=variant.hashed, client=client)
+        return process_data(mode, instance, "approach2", output_dir=output_dir, dry_run=dry_run)
+    from approach3 import Approach3, process_data
+    instance = Approach3(max_retries, is_hash_speakers=variant.hashed, client=client)
+    return process_data(mode, instance, "approach3", list(group_by) if group_by else None, variant.hashed,
+                        output_dir=output_dir, dry_run=dry_run)
+
+
+def run_matrix(variants, mode="test", host=OLLAMA_HOST, results_dir=FINAL_SAVE_DIR, max_retries=5,
+               group_by=("Episode", "Season"), dry_run=False, make_client=None):
+    """
+    Runs every variant, one model at a time (see plan_runs). The split is loaded and grouped
+    once (DialogueStore), and Approach 3's connection summaries are built once, for all
+    variants. Each model gets its own client, which keeps it resident while its variants drain,
+    and is unloaded before the next model loads. Results go to model_results_dir(model).
+    make_client(model) creates the clients (an LLMClient on host by default). Returns one
+    summary dict per variant (with the plan instead of the results when dry_run is set).
+    """
+    store = load_dialogues(TRAIN_PATH if mode == 'train' else TEST_PATH)
+    if group_by and any(variant.approach == "approach3" for variant in variants):
+        store.connection_index(list(group_by))
+    if make_client is None:
+        from ollama_setup import LLMClient
+        make_client = lambda model: LLMClient(model=model, host=host)
+
+    summaries = []
+    for model, model_variants in plan_runs(variants):
+        output_dir = model_results_dir(model, results_dir)
+        if not dry_run:
+            os.makedirs(output_dir, exist_ok=True)
+        client = make_client(model)
+        print(f"Model {model}: {', '.join(variant.file_name for variant in model_variants)} -> {output_dir}", flush=True)
+        try:
+            for variant in model_variants:
+                start = time.perf_counter()
+                result = run_variant(variant, client, mode, output_dir, max_retries, group_by, dry_run)
+                summary = {
+                    "model": model,
+                    "variant": variant.file_name,
+                    "output_file": os.path.join(output_dir, f"{mode}_{variant.file_name}.csv"),
+                    "seconds": round(time.perf_counter() - start, 1),
+                }
+                if dry_run:
+                    summary["plan"] = result
+                else:
+                    summary["rows"] = len(result)
+                summaries.append(summary)
+        finally:
+            if not dry_run and hasattr(client, "unload"):
+                client.unload()
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run approaches x speaker hashing x models, one model at a time.")
+    parser.add_argument("--models", nargs="+", default=ORCHESTRATOR_MODELS)
+    parser.add_argument("--approaches", nargs="+", default=APPROACHES, choices=APPROACHES)
+    parser.add_argument("--hashing", default="both", choices=["plain", "hashed", "both"])
+    parser.add_argument("--mode", default="test", choices=["train", "test"])
+    parser.add_argument("--host", nargs="+", default=None, help="Ollama server(s); defaults to OLLAMA_HOST")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--dry-run", action="store_true", help="print each variant's estimated run instead")
+    args = parser.parse_args()
+
+    hashing = {"plain": (False,), "hashed": (True,), "both": (False, True)}[args.hashing]
+    host = (args.host[0] if len(args.host) == 1 else args.host) if args.host else OLLAMA_HOST
+    variants = variant_matrix(args.approaches, hashing, args.models)
+    for summary in run_matrix(variants, args.mode, host, max_retries=args.max_retries, dry_run=args.dry_run):
+        outcome = f"{summary['rows']} rows" if "rows" in summary else "planned"
+        print(f"{summary['model']} {summary['variant']}: {outcome} in {summary['seconds']}s -> {summary['output_file']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import glob
+import hashlib
+import pandas as pd
+from config import CACHE_DIR
+
+# Bump when the derived columns change so that existing artifacts are rebuilt.
+PREPROCESSING_VERSION = 1
+
+# SRT-style timestamps as found in MELD: "0:10:44,769", "00:10:44,769" or "00:05:11,82".
+_TIMESTAMP_PATTERN = r"^\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*$"
+
+
+def parse_timestamp_millis(series):
+    """
+    Parses SRT-style timestamps to (float) milliseconds in one vectorized pass.
+    The fraction is read as a decimal fraction (",82" is 820 ms), matching what
+    pd.to_datetime did. Unparseable values become NaN.
+    """
+    parts = series.astype(str).str.extract(_TIMESTAMP_PATTERN)
+    hours, minutes, seconds = (pd.to_numeric(parts[i]).astype("float64") for i in range(3))
+    millis = pd.to_numeric(parts[3].str.ljust(3, "0")).astype("float64")
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + millis
+
+
+def parse_timestamps(series):
+    """Parses SRT-style timestamps to float seconds (see parse_timestamp_millis)."""
+    return parse_timestamp_millis(series) / 1000
+
+
+def preprocess(df):
+    """
+    Adds the columns every approach derives from the raw MELD CSV:
+      - StartSeconds / EndSeconds / Duration: utterance timing in seconds;
+      - Words / Letters: utterance length counts;
+      - Utterance_Position: index of the utterance within its dialogue;
+      - Dialogue_Offset: row offset of the dialogue's first utterance.
+    Rows are ordered by Dialogue_ID (stable), so every dialogue is a contiguous block.
+    """
+    df = df.sort_values("Dialogue_ID", kind="stable").reset_index(drop=True)
+    start_millis = parse_timestamp_millis(df["StartTime"])
+    end_millis = parse_timestamp_millis(df["EndTime"])
+    df["StartSeconds"] = start_millis / 1000
+    df["EndSeconds"] = end_millis / 1000
+    # Subtract whole milliseconds, so Duration is exactly what Timedelta.total_seconds() gave.
+    df["Duration"] = (end_millis - start_millis) / 1000
+    df["Words"] = df["Utterance"].str.split().str.len().fillna(0).astype("int64")
+    df["Letters"] = df["Utterance"].str.count(r"[A-Za-z]").fillna(0).astype("int64")
+    df["Utterance_Position"] = df.groupby("Dialogue_ID").cumcount()
+    df["Dialogue_Offset"] = df.index - df["Utterance_Position"]
+    return df
+
+
+def _file_hash(path):
+    digest = hashlib.sha256(f"v{PREPROCESSING_VERSION}".encode("utf-8"))
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def load_split(path, cache_dir=CACHE_DIR):
+    """
+    Returns the preprocessed DataFrame for a MELD CSV.
+    The result is cached as a Feather file named after the source file and a hash of its
+    contents, so it is rebuilt only when the CSV (or PREPROCESSING_VERSION) changes.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    artifact = os.path.join(cache_dir, f"{name}.{_file_hash(path)}.feather")
+    if os.path.exists(artifact):
+        return pd.read_feather(artifact)
+
+    df = preprocess(pd.read_csv(path))
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(cache_dir, f"{name}.*.feather")):
+        os.remove(stale)
+    # Write to a temporary name first so a crash never leaves a truncated artifact behind.
+    tmp_artifact = artifact + ".tmp"
+    df.to_feather(tmp_artifact)
+    os.replace(tmp_artifact, artifact)
+    return df
@@ -0,0 +1,163 @@
+import re
+import json
+from config import VALID_ROLES
+
+ROW_FIELDS = ("Sr No.", "Speaker", "Role", "Justification")
+
+
+def _response_schema(row_properties):
+    return {
+        "type": "object",
+        "properties": {
+            "utterances": {
+                "type": "array",
+                "items": {"type": "object", "properties": row_properties, "required": list(row_properties)},
+            }
+        },
+        "required": ["utterances"],
+    }
+
+
+_ROW_PROPERTIES = {
+    "Sr No.": {"type": "integer"},
+    "Speaker": {"type": "string"},
+    "Role": {"type": "string", "enum": sorted(VALID_ROLES)},
+    "Justification": {"type": "string"},
+}
+
+# JSON schema sent to Ollama in structured-output mode.
+RESPONSE_SCHEMA = _response_schema(_ROW_PROPERTIES)
+# Same for multi-dialogue (batched) requests, where every row also names its dialogue.
+BATCH_RESPONSE_SCHEMA = _response_schema(dict({"Dialogue_ID": {"type": "integer"}}, **_ROW_PROPERTIES))
+
+_decoder = json.JSONDecoder()
+_ROLE_LOOKUP = {role.lower(): role for role in VALID_ROLES}
+
+
+def _normalize_key(key):
+    return re.sub(r"[^a-z]", "", str(key).lower())
+
+
+_FIELD_LOOKUP = {_normalize_key(field): field for field in ROW_FIELDS + ("Dialogue_ID",)}
+
+
+def _normalize_row(obj):
+    """
+    Maps loosely spelled keys ("sr_no", "role ") onto ROW_FIELDS (plus Dialogue_ID, for batched
+    requests); returns None if obj is not a row.
+    """
+    row = {}
+    for key, value in obj.items():
+        field = _FIELD_LOOKUP.get(_normalize_key(key))
+        if field is not None:
+            row[field] = value
+    if "Sr No." not in row:
+        return None
+    try:
+        row["Sr No."] = int(row["Sr No."])
+    except (TypeError, ValueError):
+        return None
+    if "Dialogue_ID" in row:
+        try:
+            row["Dialogue_ID"] = int(row["Dialogue_ID"])
+        except (TypeError, ValueError):
+            del row["Dialogue_ID"]
+    if isinstance(row.get("Role"), str):
+        role = row["Role"].strip()
+        row["Role"] = _ROLE_LOOKUP.get(role.lower(), role)
+    return row
+
+
+def _collect_rows(value, rows):
+    if isinstance(value, list):
+        for item in value:
+            _collect_rows(item, rows)
+    elif isinstance(value, dict):
+        row = _normalize_row(value)
+        if row is not None:
+            rows.append(row)
+        else:
+            for item in value.values():
+                _collect_rows(item, rows)
+
+
+def extract_json_rows(text):
+    """
+    Extracts every utterance row from a model response.
+    Accepts a bare array, an {"utterances": [...]} object, one object per line, or JSON
+    embedded in prose or code fences. Truncated output is tolerated: every complete row
+    before the cut is returned. Rows are returned in the order they appear.
+    """
+    rows = []
+    position = 0
+    while True:
+        start = min((i for i in (text.find("{", position), text.find("[", position)) if i != -1), default=-1)
+        if start == -1:
+            break
+        try:
+            value, end = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            # Not a complete JSON value here (e.g. a truncated wrapper); look inside it.
+            position = start + 1
+            continue
+        _collect_rows(value, rows)
+        position = end
+    return rows
+
+
+class StreamingRowValidator:
+    """
+    Watches a streamed response and reports as soon as it is provably wrong, so that the
+    generation can be cancelled instead of running to the end:
+      - no JSON has started within the first max_preamble_chars characters (the model drifted
+        into prose or code);
+      - the completed rows hold more invalid rows (unknown or repeated Sr No., wrong speaker,
+        invalid role) than valid ones, e.g. a wrong first row.
+    expected_speakers maps Sr No. to speaker name; rows for Sr Nos. in `ignore` (already
+    accepted) count as neither. The text is only re-parsed when an object may have closed.
+    """
+    def __init__(self, expected_speakers, ignore=(), max_preamble_chars=200, chars_per_row=150):
+        self.expected_speakers = expected_speakers
+        self.ignore = set(ignore)
+        self.max_preamble_chars = max_preamble_chars
+        self.chars_per_row = chars_per_row
+        self.rows = 0
+        self._json_started = False
+        self._checked = 0
+
+    def __call__(self, text):
+        """Returns the reason to abort, or None while the output may still be valid."""
+        if len(text) < self._checked:
+            # A new attempt after a transient failure restarted the response.
+            self._json_started = False
+            self._checked = 0
+        if not self._json_started:
+            self._json_started = "{" in text or "[" in text
+            if not self._json_started and len(text) > self.max_preamble_chars:
+                return f"no JSON in the first {self.max_preamble_chars} characters"
+        new_text = text[self._checked:]
+        self._checked = len(text)
+        if "}" not in new_text:
+            return None
+
+        valid = invalid = 0
+        seen = set()
+        for row in extract_json_rows(text):
+            sr_no = row["Sr No."]
+            if sr_no in self.ignore:
+                continue
+            if sr_no in self.expected_speakers and sr_no not in seen \
+                    and row.get("Speaker") == self.expected_speakers[sr_no] and row.get("Role") in VALID_ROLES:
+                valid += 1
+            else:
+                invalid += 1
+            seen.add(sr_no)
+        self.rows = valid + invalid
+        if invalid > valid:
+            return f"{invalid} of {self.rows} completed rows invalid"
+        return None
+
+    def expected_chars(self, text):
+        """Estimated length of the complete response, from the rows completed so far."""
+        per_row = len(text) / self.rows if self.rows else self.chars_per_row
+        return per_row * len(set(self.expected_speakers) - self.ignore)
@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+import argparse
+import pandas as pd
+from config import RESULTS_FSYNC_EVERY, RESULTS_CSV_WITH_TEXTS
+
+RESULT_COLUMNS = ["Sr No.", "Speaker", "Dialogue_ID", "Role", "Justification", "Prompt", "Response"]
+
+# Long text fields stored once in the side table and referenced by hash from the rows.
+TEXT_COLUMNS = ["Justification", "Prompt", "Response"]
+
+
+def _to_json(value):
+    """JSON fallback for numpy scalars coming out of pandas groupby keys and columns."""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def text_key(text):
+    """Side-table key of a text: a short hash of its contents."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultsStore:
+    """
+    Append-only results sink for a single output CSV.
+    Every finished dialogue is appended as one JSON line to a sidecar `.jsonl` file, so
+    writing a dialogue costs O(1) regardless of how many are already stored. Lines are
+    flushed immediately, fsynced every `fsync_every` dialogues and fsynced again on close. When a dialogue is
+    stored more than once (e.g. an errored dialogue that was re-run) the latest line wins.
+    The prompt, response and justification texts (TEXT_COLUMNS) are written once to a
+    `.texts.jsonl` side table keyed by text_key, and the rows only hold those keys, so a
+    dialogue's prompt and response are not repeated on every utterance row.
+    The CSV itself is only written by export_csv, once at the end of a run: the full texts (the
+    original CSV shape) by default, or, opted into, slim rows with `<column>_ref` keys into the
+    side table.
+    """
+    def __init__(self, output_file, fsync_every=RESULTS_FSYNC_EVERY):
+        self.output_file = output_file
+        self.path = os.path.splitext(output_file)[0] + ".jsonl"
+        self.texts_path = os.path.splitext(output_file)[0] + ".texts.jsonl"
+        self.fsync_every = fsync_every
+        self._file = None
+        self._texts_file = None
+        self._text_keys = None
+        self._unsynced = 0
+
+    def texts(self):
+        """Returns the side table as a dict mapping text_key to text."""
+        texts = {}
+        if os.path.exists(self.texts_path):
+            with open(self.texts_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    texts[record["key"]] = record["text"]
+        return texts
+
+    def _records(self):
+        """
+        Yields the stored records: the JSONL lines or, before the first write, the records of an
+        output CSV from an earlier CSV-only run (read in memory; see _csv_records).
+        """
+        if not os.path.exists(self.path):
+            if os.path.exists(self.output_file):
+                yield from self._csv_records()
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted run; that dialogue simply re-runs.
+                    continue
+
+    def _read(self):
+        """
+        Returns ({Dialogue_ID: rows}, texts) with the text columns of every row as side-table
+        keys. Texts of rows written before the side table existed are added to the returned
+        texts (in memory only). Reading never writes to disk.
+        """
+        texts = self.texts()
+        dialogues = {}
+        for record in self._records():
+            rows = record["rows"]
+            if "refs" not in record:
+                rows = [_with_refs(row, texts) for row in rows]
+            dialogues[record["Dialogue_ID"]] = rows
+        return dialogues, texts
+
+    def stored_rows(self):
+        """
+        Returns {Dialogue_ID: rows} as written, without reading the side table: the text columns
+        hold side-table keys (or, for rows written before it existed, the texts).
+        """
+        return {record["Dialogue_ID"]: record["rows"] for record in self._records()}
+
+    def load(self):
+        """
+        Returns a dict mapping Dialogue_ID to its list of result rows, with the full texts.
+        Results from an earlier CSV-only run are read from its CSV until the first write.
+        """
+        dialogues, texts = self._read()
+        return {
+            dialogue_id: [
+                {**row, **{column: texts.get(row[column]) for column in TEXT_COLUMNS if row.get(column) is not None}}
+                for row in rows
+            ]
+            for dialogue_id, rows in dialogues.items()
+        }
+
+    def _csv_records(self):
+        """
+        Returns the output CSV of an earlier CSV-only run as records, one per dialogue. Rows of
+        a slim export keep their side-table keys (the record has "refs"); full rows hold texts.
+        """
+        existing_df = pd.read_csv(self.output_file)
+        existing_df = existing_df.astype(object).where(existing_df.notna(), None)
+        refs = [column for column in TEXT_COLUMNS if f"{column}_ref" in existing_df.columns]
+        if refs:
+            # A slim export: its keys still point into the side table.
+            existing_df = existing_df.rename(columns={f"{column}_ref": column for column in refs})
+        if "Dialogue_ID" not in existing_df.columns:
+            # Older exports without Dialogue_ID are kept as one record so they survive the next export.
+            return [{"Dialogue_ID": None, "rows": existing_df.to_dict("records")}]
+        records = []
+        for dialogue_id, group in existing_df.groupby("Dialogue_ID", dropna=False):
+            record = {"Dialogue_ID": None if pd.isna(dialogue_id) else dialogue_id, "rows": group.to_dict("records")}
+            if refs:
+                record["refs"] = TEXT_COLUMNS
+            records.append(record)
+        return records
+
+    def open(self):
+        """
+        Opens the store for appending. On the first write next to an output CSV from an earlier
+        CSV-only run, the CSV's results are imported into the JSONL file first.
+        """
+        if self._file is None:
+            legacy = self._csv_records() if not os.path.exists(self.path) and os.path.exists(self.output_file) else []
+            if self._text_keys is None:
+                self._text_keys = set(self.texts())
+            self._texts_file = open(self.texts_path, "a", encoding="utf-8")
+            self._file = open(self.path, "a", encoding="utf-8")
+            for record in legacy:
+                if "refs" in record:
+                    self._write(record)
+                else:
+                    self.append(record["Dialogue_ID"], record["rows"])
+        return self
+
+    def _slim(self, row):
+        """Moves the row's texts to the side table (once per distinct text) and returns it with their keys."""
+        row = dict(row)
+        for column in TEXT_COLUMNS:
+            text = row.get(column)
+            if text is None:
+                continue
+            text = str(text)
+            key = text_key(text)
+            if key not in self._text_keys:
+                self._text_keys.add(key)
+                self._texts_file.write(json.dumps({"key": key, "text": text}, ensure_ascii=False) + "\n")
+            row[column] = key
+        return row
+
+    def append(self, dialogue_id, rows):
+        """Durably appends the result rows of one finished dialogue."""
+        self.open()
+        rows = [self._slim(row) for row in rows]
+        self._write({"Dialogue_ID": dialogue_id, "rows": rows, "refs": TEXT_COLUMNS})
+
+    def _write(self, record):
+        self.open()
+        # Texts are flushed first, so a stored row never refers to a text that is not on disk.
+        self._texts_file.flush()
+        self._file.write(json.dumps(record, ensure_ascii=False, default=_to_json) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self, force=False):
+        if self._file is not None and (self._unsynced or force):
+            os.fsync(self._texts_file.fileno())
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync(force=True)
+            self._file.close()
+            self._texts_file.close()
+            self._file = None
+            self._texts_file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def to_dataframe(self, with_texts=True):
+        """
+        Returns all stored results as a single DataFrame sorted by Sr No., with Role as a
+        categorical. with_texts=False keeps the slim rows: the text columns become
+        `<column>_ref` keys into texts() instead of the texts themselves.
+        """
+        dialogues, texts = self._read()
+        df = pd.DataFrame([row for rows in dialogues.values() for row in rows])
+        columns = RESULT_COLUMNS + [col for col in df.columns if col not in RESULT_COLUMNS]
+        df = df.reindex(columns=columns)
+        df["Role"] = df["Role"].astype("category")
+        if with_texts:
+            # Rows of a dialogue share the same string objects, so the texts are not copied per row.
+            for column in TEXT_COLUMNS:
+                df[column] = df[column].map(texts)
+        else:
+            df = df.rename(columns={column: f"{column}_ref" for column in TEXT_COLUMNS})
+        # Approach 1 stores comma-joined Sr No. strings, so sort numerically where possible.
+        df = df.sort_values(by="Sr No.", key=lambda col: pd.to_numeric(col, errors="coerce"), kind="stable")
+        return df.reset_index(drop=True)
+
+    def export_csv(self, with_texts=RESULTS_CSV_WITH_TEXTS, output_file=None):
+        """
+        Writes the sorted results to the output CSV (or output_file) in one pass and returns
+        them. with_texts=True writes the full texts on every row, as in the original CSV shape;
+        with_texts=False writes the slim rows, with `<column>_ref` columns in their place.
+        """
+        df = self.to_dataframe(with_texts)
+        df.to_csv(output_file or self.output_file, index=False, encoding="utf-8")
+        return df
+
+
+def _with_refs(row, texts):
+    """Replaces the inline texts of a row written before the side table existed by their keys."""
+    row = dict(row)
+    for column in TEXT_COLUMNS:
+        text = row.get(column)
+        if text is not None:
+            text = str(text)
+            row[column] = text_key(text)
+            texts.setdefault(row[column], text)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored results as CSV.")
+    parser.add_argument("output_file", help="the run's output CSV (its .jsonl and .texts.jsonl files are read)")
+    parser.add_argument("--slim", action="store_true",
+                        help="write keys into the .texts.jsonl side table instead of the full texts")
+    parser.add_argument("--to", default=None, help="write to this file instead of the output CSV")
+    args = parser.parse_args()
+    df = ResultsStore(args.output_file).export_csv(not args.slim, args.to)
+    print(f"Exported {len(df)} rows to {args.to or args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
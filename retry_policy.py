@@ -0,0 +1,221 @@
+import time
+import random
+import asyncio
+import threading
+from config import (
+    LLM_TIMEOUT_SECONDS, LLM_MAX_ATTEMPTS, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS,
+    LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_SECONDS, LLM_CIRCUIT_GIVE_UP_SECONDS
+)
+
+# HTTP statuses from the Ollama server that are worth retrying.
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class PermanentLLMError(RuntimeError):
+    """An LLM call failed in a way that retrying will not fix (e.g. unknown model, bad request)."""
+
+
+class CircuitOpenError(PermanentLLMError):
+    """The server stayed unhealthy for longer than the circuit breaker's give-up window."""
+
+
+class GenerationAborted(Exception):
+    """
+    The caller cancelled a streamed generation because its output was already invalid.
+    Not a server failure: it is neither retried nor counted against the circuit breaker.
+    text holds the output received before the cancellation.
+    """
+    def __init__(self, reason, text):
+        super().__init__(reason)
+        self.reason = reason
+        self.text = text
+
+
+class AttemptTimeout(TimeoutError):
+    """
+    A streamed generation ran past the policy's per-attempt timeout. The HTTP read timeout
+    only bounds the gap between chunks, so the client checks the attempt's total time itself.
+    A transient failure: it is counted as a timeout and retried.
+    """
+
+
+def is_timeout(error):
+    """True for client-side timeouts of an LLM call."""
+    import httpx
+    return isinstance(error, (httpx.TimeoutException, TimeoutError))
+
+
+def is_transient(error):
+    """Classifies an exception raised by an LLM call as transient (retry) or permanent (give up)."""
+    # Imported here so that importing the approaches does not pull in the HTTP stack.
+    import httpx
+    from ollama import ResponseError
+    if isinstance(error, ResponseError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Pauses every caller while the server is unhealthy.
+    After failure_threshold consecutive transient failures the circuit opens and all
+    callers block in before_call for reset_timeout seconds (doubling on every re-open, up
+    to max_reset_timeout). A single probe call is then let through: success closes the
+    circuit, failure re-opens it. If the circuit stays open for longer than give_up_after
+    seconds, CircuitOpenError is raised so the run stops instead of waiting forever.
+    """
+    def __init__(self, failure_threshold=LLM_CIRCUIT_FAILURE_THRESHOLD, reset_timeout=LLM_CIRCUIT_RESET_SECONDS,
+                 give_up_after=LLM_CIRCUIT_GIVE_UP_SECONDS, max_reset_timeout=300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.give_up_after = give_up_after
+        self.max_reset_timeout = max_reset_timeout
+        self.state = "closed"
+        self.opens = 0
+        self._failures = 0
+        self._reopens = 0
+        self._open_until = 0.0
+        self._unhealthy_since = None
+        self._probe_in_flight = False
+        self._cond = threading.Condition()
+
+    def before_call(self):
+        """Blocks while the circuit is open; raises CircuitOpenError once the give-up window has passed."""
+        with self._cond:
+            while True:
+                if self.state == "closed":
+                    return
+                now = time.monotonic()
+                if now - self._unhealthy_since > self.give_up_after:
+                    raise CircuitOpenError(
+                        f"Ollama server unhealthy for more than {self.give_up_after:.0f}s; stopping the run."
+                    )
+                if self.state == "open" and now >= self._open_until:
+                    self.state = "half_open"
+                if self.state == "half_open" and not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return
+                wait_for = self._open_until - now if self.state == "open" else 1.0
+                self._cond.wait(max(wait_for, 0.01))
+
+    def record_success(self):
+        with self._cond:
+            self.state = "closed"
+            self._failures = 0
+            self._reopens = 0
+            self._unhealthy_since = None
+            self._probe_in_flight = False
+            self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                now = time.monotonic()
+                timeout = min(self.reset_timeout * 2 ** self._reopens, self.max_reset_timeout)
+                self.state = "open"
+                self._open_until = now + timeout
+                self._unhealthy_since = self._unhealthy_since or now
+                self._reopens += 1
+                self.opens += 1
+            self._probe_in_flight = False
+            self._cond.notify_all()
+
+
+class RetryPolicy:
+    """
+    Shared retry policy for LLM calls.
+    Transient failures (connection errors, timeouts, 5xx/429 responses) are retried up to
+    max_attempts times with exponential backoff and full jitter; permanent failures raise
+    PermanentLLMError immediately. Each attempt is bounded by `timeout` seconds, which the
+    client applies to its HTTP requests and, for streamed generations, as a wall-clock
+    deadline (AttemptTimeout). Calls go through the circuit breaker, and the
+    counters in stats() are shared by every caller of the policy.
+    """
+    def __init__(self, max_attempts=LLM_MAX_ATTEMPTS, base_delay=LLM_BACKOFF_BASE_SECONDS,
+                 max_delay=LLM_BACKOFF_MAX_SECONDS, timeout=LLM_TIMEOUT_SECONDS, breaker=None, seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "attempts": 0, "successes": 0, "retries": 0, "timeouts": 0,
+            "transient_failures": 0, "permanent_failures": 0, "aborted": 0, "backoff_seconds": 0.0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given (0-based) attempt."""
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _on_failure(self, error, attempt):
+        """Records a failed attempt and returns the delay before the next one, or raises."""
+        if isinstance(error, PermanentLLMError):
+            raise error
+        if isinstance(error, GenerationAborted):
+            self.breaker.record_success()
+            self._count("aborted")
+            raise error
+        if not is_transient(error):
+            # The server answered, so it is healthy; the request itself is the problem.
+            self.breaker.record_success()
+            self._count("permanent_failures")
+            raise PermanentLLMError(f"Permanent LLM error: {error}") from error
+        self.breaker.record_failure()
+        self._count("transient_failures")
+        if is_timeout(error):
+            self._count("timeouts")
+        if attempt + 1 >= self.max_attempts:
+            raise error
+        delay = self.backoff(attempt)
+        self._count("retries")
+        self._count("backoff_seconds", delay)
+        return delay
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) under the policy."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            self._count("attempts")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._on_failure(e, attempt))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self._count("successes")
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """Async variant of call for coroutine functions."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self.breaker.before_call)
+            self._count("attempts")
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._on_failure(e, attempt))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self._count("successes")
+            return result
+
+    def stats(self):
+        """Returns a snapshot of the counters and the circuit state."""
+        with self._lock:
+            stats = dict(self.counters)
+        stats["circuit_state"] = self.breaker.state
+        stats["circuit_opens"] = self.breaker.opens
+        return stats
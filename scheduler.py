@@ -0,0 +1,103 @@
+import heapq
+from config import (
+    SCHEDULER_PRIORITY, LLM_PROMPT_TOKENS_PER_SECOND, LLM_OUTPUT_TOKENS_PER_SECOND, LLM_REQUEST_OVERHEAD_SECONDS
+)
+
+# Sort keys for the built-in priorities (smaller runs first).
+PRIORITIES = {
+    "lpt": lambda cost: -cost["seconds"],
+    "spt": lambda cost: cost["seconds"],
+    "fifo": lambda cost: 0,
+}
+
+
+class DialogueScheduler:
+    """
+    Orders the dialogues of a run by their estimated cost.
+    estimate_cost(payload) returns the (prompt_tokens, output_tokens) expected for a dialogue
+    (see BaseRoleApproach.estimate_cost); the expected duration of its request follows from
+    the per-slot throughput figures in config. With the default "lpt" priority the longest
+    dialogues are dispatched first, so they do not end up as stragglers at the end of a
+    concurrent run; "spt" runs the shortest first and "fifo" keeps the input order. priority
+    may also be a function of the cost dict returning a sort key (smaller runs first).
+    plan() estimates the tokens and wall-clock time of a run without calling the LLM.
+    """
+    def __init__(self, estimate_cost, priority=SCHEDULER_PRIORITY, prompt_tokens_per_second=LLM_PROMPT_TOKENS_PER_SECOND,
+                 output_tokens_per_second=LLM_OUTPUT_TOKENS_PER_SECOND, request_overhead=LLM_REQUEST_OVERHEAD_SECONDS):
+        if not callable(priority) and priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {sorted(PRIORITIES)} or a function.")
+        self.estimate_cost = estimate_cost
+        self.priority = priority
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.output_tokens_per_second = output_tokens_per_second
+        self.request_overhead = request_overhead
+
+    def cost(self, payload):
+        """Estimated prompt tokens, output tokens and request seconds of one dialogue."""
+        prompt_tokens, output_tokens = self.estimate_cost(payload)
+        seconds = (self.request_overhead + prompt_tokens / self.prompt_tokens_per_second
+                   + output_tokens / self.output_tokens_per_second)
+        return {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens, "seconds": seconds}
+
+    def _ranking(self, costs):
+        key = self.priority if callable(self.priority) else PRIORITIES[self.priority]
+        return sorted(range(len(costs)), key=lambda index: key(costs[index]))
+
+    def order(self, jobs):
+        """Returns the (dialogue_id, payload) jobs in dispatch order (stable for equal keys)."""
+        costs = [self.cost(payload) for _, payload in jobs]
+        return [jobs[index] for index in self._ranking(costs)]
+
+    def plan(self, jobs, max_in_flight):
+        """
+        Estimates a run over the (dialogue_id, payload) jobs with max_in_flight concurrent
+        requests: total tokens, LLM time, and the wall-clock time of dispatching the jobs in
+        this scheduler's order versus in input order (each finished request is replaced by the
+        next job, as in dialogue_runner.run_dialogues).
+        """
+        costs = [self.cost(payload) for _, payload in jobs]
+        seconds = [cost["seconds"] for cost in costs]
+        ordered = [seconds[index] for index in self._ranking(costs)]
+        workers = max(min(max_in_flight, len(jobs)), 1)
+        return {
+            "dialogues": len(jobs),
+            "max_in_flight": max_in_flight,
+            "priority": getattr(self.priority, "__name__", self.priority),
+            "prompt_tokens": sum(cost["prompt_tokens"] for cost in costs),
+            "output_tokens": sum(cost["output_tokens"] for cost in costs),
+            "llm_seconds": round(sum(seconds), 1),
+            "longest_dialogue_seconds": round(max(seconds, default=0.0), 1),
+            "wall_seconds": round(_makespan(ordered, workers), 1),
+            "input_order_wall_seconds": round(_makespan(seconds, workers), 1),
+            # No schedule can beat the larger of perfect balance and the single longest dialogue.
+            "lower_bound_seconds": round(max(sum(seconds) / workers, max(seconds, default=0.0)), 1),
+        }
+
+
+def estimate_prompt_tokens(conversation, static_chars=0):
+    """
+    Rough prompt tokens of a dialogue: static_chars of fixed prompt text plus one
+    `Sr No. n, Speaker: "utterance"` line per (speaker, utterance), at about four characters
+    per token.
+    """
+    line_chars = sum(len(speaker) + len(utterance) + 16 for speaker, utterance in conversation)
+    return (static_chars + line_chars) // 4
+
+
+def _makespan(durations, workers):
+    """Finish time of list-scheduling the durations, in order, on `workers` parallel slots."""
+    free_at = [0.0] * workers
+    for duration in durations:
+        heapq.heappush(free_at, heapq.heappop(free_at) + duration)
+    return max(free_at)
+
+
+def format_plan(plan):
+    """Renders a plan as a short multi-line report."""
+    return "\n".join([
+        f"Plan: {plan['dialogues']} dialogues with {plan['max_in_flight']} in flight, {plan['priority']} order",
+        f"  estimated tokens: {plan['prompt_tokens']} prompt, {plan['output_tokens']} output; "
+        f"{plan['llm_seconds']}s of LLM time (longest dialogue {plan['longest_dialogue_seconds']}s)",
+        f"  estimated wall-clock: {plan['wall_seconds']}s (input order: {plan['input_order_wall_seconds']}s, "
+        f"lower bound: {plan['lower_bound_seconds']}s)",
+    ])
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import threading
+from collections import Counter
+import numpy as np
+
+
+def _plain(value):
+    return value.item() if hasattr(value, "item") else value
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 4) if len(values) else None
+
+
+class RunTelemetry:
+    """
+    Per-call trace of one approach's LLM calls.
+    While a run is open (see dialogue_runner.process_dialogues), every call recorded with
+    record_call is appended as one JSON line to `<name>.trace.jsonl` next to the output CSV:
+    dialogue ID, approach, attempt number, serving host, prompt kind and size, token counts,
+    prompt-eval time, time to first token, latency, server time, parse outcome, error class and,
+    for streamed calls, the abort reason and estimated generation time saved. close() appends a
+    "run_summary" line and returns the summary (throughput, calls per host, retry histogram,
+    slowest dialogues).
+    Timings come from the client's last_call; calls made outside a run are not recorded.
+    """
+    def __init__(self, approach):
+        self.approach = approach
+        self.path = None
+        self._file = None
+        self._records = []
+        self._started = None
+        self._lock = threading.Lock()
+
+    def open(self, output_file):
+        """Starts a run whose trace is appended next to output_file."""
+        self.path = os.path.splitext(output_file)[0] + ".trace.jsonl"
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._records = []
+        self._started = time.perf_counter()
+
+    def record_call(self, dialogue_id, attempt, prompt, call, parse_outcome, prompt_kind="full", rows_accepted=0,
+                    error=None, batch=None):
+        """
+        Records one LLM call. call is the client's last_call dict (None for clients that do not
+        report timings); parse_outcome is "ok", "partial", "invalid", "aborted" or "error".
+        For a multi-dialogue request, batch lists its Dialogue_IDs and dialogue_id is None.
+        """
+        if self._file is None:
+            return
+        call = call or {}
+        record = {
+            "event": "llm_call",
+            "time": round(time.time(), 3),
+            "dialogue_id": _plain(dialogue_id),
+            "batch": [_plain(batch_id) for batch_id in batch] if batch is not None else None,
+            "approach": self.approach,
+            "attempt": attempt,
+            "host": call.get("host"),
+            "prompt_kind": prompt_kind,
+            "prompt_chars": len(prompt),
+            "prompt_tokens": call.get("prompt_tokens"),
+            "prompt_eval_seconds": call.get("prompt_eval_seconds"),
+            "response_tokens": call.get("response_tokens"),
+            "cached": call.get("cached", False),
+            "http_attempts": call.get("http_attempts"),
+            "ttft_seconds": call.get("ttft_seconds"),
+            "latency_seconds": call.get("latency_seconds"),
+            "server_seconds": call.get("server_seconds"),
+            "streamed": call.get("streamed", False),
+            "aborted": call.get("aborted"),
+            "saved_seconds": call.get("saved_seconds"),
+            "parse_outcome": parse_outcome,
+            "rows_accepted": rows_accepted,
+            "error_class": type(error).__name__ if error is not None else None,
+        }
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._records.append(record)
+            self._file.write(line)
+
+    def summary(self, slowest=5):
+        """Aggregates the calls recorded since open()."""
+        with self._lock:
+            records = list(self._records)
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0.0
+
+        per_dialogue = {}
+        for record in records:
+            # A batched call counts as one call for each of its dialogues, sharing the latency.
+            dialogue_ids = record["batch"] or [record["dialogue_id"]]
+            for dialogue_id in dialogue_ids:
+                entry = per_dialogue.setdefault(dialogue_id, {"calls": 0, "windows": 0, "latency_seconds": 0.0})
+                entry["calls"] += 1
+                entry["windows"] += record["prompt_kind"] == "window" and record["attempt"] == 1
+                entry["latency_seconds"] += (record["latency_seconds"] or 0.0) / len(dialogue_ids)
+        latencies = [r["latency_seconds"] for r in records if r["latency_seconds"] is not None]
+        rows_accepted = sum(r["rows_accepted"] for r in records)
+        ttfts = [r["ttft_seconds"] for r in records if r["ttft_seconds"] is not None]
+        prompt_evals = [r["prompt_eval_seconds"] for r in records if r["prompt_eval_seconds"] is not None]
+        server_seconds = sum(r["server_seconds"] or 0.0 for r in records)
+        # The first call for every window of a windowed dialogue is not a retry.
+        retry_histogram = Counter(entry["calls"] - max(entry["windows"], 1) for entry in per_dialogue.values())
+        slowest_dialogues = sorted(per_dialogue.items(), key=lambda item: item[1]["latency_seconds"], reverse=True)
+
+        return {
+            "approach": self.approach,
+            "wall_seconds": round(elapsed, 3),
+            "dialogues": len(per_dialogue),
+            "llm_calls": len(records),
+            "dialogues_per_second": round(len(per_dialogue) / elapsed, 3) if elapsed else None,
+            "calls_per_second": round(len(records) / elapsed, 3) if elapsed else None,
+            "batch_calls": sum(1 for r in records if r["batch"]),
+            "calls_by_host": dict(Counter(r["host"] for r in records if r["host"])),
+            "cached_calls": sum(1 for r in records if r["cached"]),
+            "aborted_calls": sum(1 for r in records if r["aborted"]),
+            # Estimated generation time not spent thanks to cancelling invalid streamed responses.
+            "saved_seconds": round(sum(r["saved_seconds"] or 0.0 for r in records), 3),
+            "prompt_tokens": sum(r["prompt_tokens"] or 0 for r in records),
+            "response_tokens": sum(r["response_tokens"] or 0 for r in records),
+            "latency_seconds": {"total": round(sum(latencies), 3), "p50": _percentile(latencies, 50),
+                                "p95": _percentile(latencies, 95), "max": _percentile(latencies, 100)},
+            "utterances_per_llm_second": round(rows_accepted / sum(latencies), 3) if sum(latencies) else None,
+            "ttft_seconds": {"p50": _percentile(ttfts, 50), "p95": _percentile(ttfts, 95)},
+            "prompt_eval_seconds": {"total": round(sum(prompt_evals), 3), "p50": _percentile(prompt_evals, 50),
+                                    "p95": _percentile(prompt_evals, 95)},
+            # Client-side latency not spent in the server: HTTP retries, backoff, queueing, network.
+            "outside_server_seconds": round(sum(latencies) - server_seconds, 3) if server_seconds else None,
+            "retry_histogram": {retries: retry_histogram[retries] for retries in sorted(retry_histogram)},
+            "parse_outcomes": dict(Counter(r["parse_outcome"] for r in records)),
+            "error_classes": dict(Counter(r["error_class"] for r in records if r["error_class"])),
+            "slowest_dialogues": [
+                {"dialogue_id": dialogue_id, "calls": entry["calls"],
+                 "latency_seconds": round(entry["latency_seconds"], 3)}
+                for dialogue_id, entry in slowest_dialogues[:slowest]
+            ],
+        }
+
+    def close(self):
+        """Ends the run: appends the summary to the trace and returns it."""
+        if self._file is None:
+            return None
+        summary = self.summary()
+        with self._lock:
+            self._file.write(json.dumps(dict(summary, event="run_summary")) + "\n")
+            self._file.close()
+            self._file = None
+        return summary
+
+
+def _seconds(value):
+    return f"{value}s" if value is not None else "n/a"
+
+
+def format_summary(summary):
+    """Renders a run summary as a short multi-line report."""
+    latency = {key: _seconds(value) for key, value in summary["latency_seconds"].items()}
+    ttft = {key: _seconds(value) for key, value in summary["ttft_seconds"].items()}
+    prompt_eval = {key: _seconds(value) for key, value in summary["prompt_eval_seconds"].items()}
+    lines = [
+        f"Telemetry for {summary['approach']}: {summary['dialogues']} dialogues, {summary['llm_calls']} LLM calls "
+        f"({summary['cached_calls']} cached, {summary['batch_calls']} batched) in {summary['wall_seconds']:.1f}s "
+        f"= {summary['dialogues_per_second']} dialogues/s, "
+        f"{summary['utterances_per_llm_second']} utterances labeled per LLM-second",
+        f"  tokens: {summary['prompt_tokens']} prompt, {summary['response_tokens']} response; "
+        f"call latency p50 {latency['p50']}, p95 {latency['p95']}, max {latency['max']}; "
+        f"TTFT p50 {ttft['p50']}, p95 {ttft['p95']}; "
+        f"prompt eval p50 {prompt_eval['p50']}, p95 {prompt_eval['p95']}, total {prompt_eval['total']}",
+        f"  retries per dialogue: {summary['retry_histogram']}; parse outcomes: {summary['parse_outcomes']}; "
+        f"errors: {summary['error_classes'] or 'none'}",
+    ]
+    if len(summary["calls_by_host"]) > 1:
+        lines.append("  calls by host: " + ", ".join(
+            f"{host} {calls}" for host, calls in summary["calls_by_host"].items()
+        ))
+    if summary["aborted_calls"]:
+        lines.append(f"  streaming: {summary['aborted_calls']} generations cancelled early, "
+                     f"~{summary['saved_seconds']}s of generation saved")
+    if summary["outside_server_seconds"] is not None:
+        lines.append(f"  time outside the server (retries, backoff, queueing): {summary['outside_server_seconds']}s "
+                     f"of {latency['total']}")
+    lines.append("  slowest dialogues: " + ", ".join(
+        f"{entry['dialogue_id']} ({entry['latency_seconds']}s, {entry['calls']} calls)"
+        for entry in summary["slowest_dialogues"]
+    ))
+    return "\n".join(lines)
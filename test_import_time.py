@@ -0,0 +1,25 @@
+import unittest
+from benchmark import check_import_time
+from config import IMPORT_TIME_BUDGET_SECONDS
+
+# Modules run as entry points; importing them must stay within IMPORT_TIME_BUDGET_SECONDS.
+ENTRY_MODULES = ("approach1", "approach2", "approach3", "main", "orchestrator", "cascade")
+
+
+class ImportTimeTest(unittest.TestCase):
+    """
+    Imports the entry modules in a fresh interpreter (`python -c "import ..."`, best of three)
+    and fails when that takes longer than IMPORT_TIME_BUDGET_SECONDS or loads a heavy
+    dependency (benchmark.HEAVY_MODULES) that should only be imported when it is used.
+    Run with `python -m unittest test_import_time`.
+    """
+    def test_import_time_within_budget(self):
+        result = check_import_time(ENTRY_MODULES)
+        self.assertEqual(result["heavy_modules_loaded"], [],
+                         f"importing {', '.join(ENTRY_MODULES)} loaded heavy dependencies")
+        self.assertLessEqual(result["seconds"], IMPORT_TIME_BUDGET_SECONDS,
+                             f"importing {', '.join(ENTRY_MODULES)} took {result['seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
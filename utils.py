@@ -1,18 +1,36 @@
 import os
-import tarfile
-import requests
-import pandas as pd
-import torch
-from config import TRAIN_PATH, TEST_PATH, HF_TOKEN
-from huggingface_hub import login
+from config import TRAIN_PATH, TEST_PATH
+from preprocessing import load_split
+
+_device = None
 
-# Device selection
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
 
 def load_dataset():
-    """Loads dataset CSV files into pandas DataFrames."""
-    return pd.read_csv(TRAIN_PATH), pd.read_csv(TEST_PATH)
+    """
+    Loads the train and test splits into pandas DataFrames, with durations, word/letter
+    counts and dialogue offsets precomputed (cached per source file, see preprocessing.load_split).
+    """
+    return load_split(TRAIN_PATH), load_split(TEST_PATH)
+
+
+def get_device():
+    """Returns the torch device to use (CUDA when available), importing torch on first use."""
+    global _device
+    if _device is None:
+        import torch
+        _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        print(f"Using device: {_device}")
+    return _device
+
 
-# Hugging Face authentication
-login(token=HF_TOKEN)
+def hf_login(token=None):
+    """
+    Authenticates with Hugging Face, only for code paths that download gated models.
+    The token is taken from the argument, config.HF_TOKEN or the HF_TOKEN environment variable.
+    """
+    import config
+    from huggingface_hub import login
+    token = token or getattr(config, "HF_TOKEN", None) or os.environ.get("HF_TOKEN")
+    if not token:
+        raise RuntimeError("No Hugging Face token: set config.HF_TOKEN or the HF_TOKEN environment variable.")
+    login(token=token)